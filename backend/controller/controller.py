@@ -1,16 +1,31 @@
-from database.database import users_collection, preferences_collection, lot_collection, occupancy_collection
+import asyncio
+import json
+import os
+
+from fastapi.encoders import jsonable_encoder
+
+from database.async_storage import get_async_storage
 from model.model import User, UserPreferences, LotDefinition
-from datetime import datetime
-from bson import ObjectId
+from datetime import datetime, timedelta, timezone
+
+# Users fetched per query when streaming the full user export
+USERS_EXPORT_PAGE_SIZE = int(os.getenv("USERS_EXPORT_PAGE_SIZE", "500"))
 
 #Default Message
 def default_message():
     return "Welcome Mac-a-Park backend" 
 
 
+async def check_readiness():
+    """
+    Readiness probe: storage connectivity (cached by the storage layer)
+    """
+    return await get_async_storage().ping()
+
+
 # ==================== USER OPERATIONS ====================
 
-def create_or_update_user(data: dict):
+async def create_or_update_user(data: dict):
     """
     Create or update user profile (upsert)
     Stores: firebase_id, full_name, email
@@ -30,32 +45,22 @@ def create_or_update_user(data: dict):
         "updated_at": datetime.utcnow(),
     }
     
-    result = users_collection.update_one(
-        {"firebase_id": firebase_id},
-        {
-            "$set": user_data,
-            "$setOnInsert": {"created_at": datetime.utcnow()},
-        },
-        upsert=True,
-    )
+    upserted, modified = await get_async_storage().upsert_user(firebase_id, user_data)
     
     return {
         "status": "success",
         "message": "User profile saved successfully",
         "firebase_id": firebase_id,
-        "upserted": result.upserted_id is not None,
-        "modified": result.modified_count > 0
+        "upserted": upserted,
+        "modified": modified
     }
 
 
-def get_user(firebase_id: str):
+async def get_user(firebase_id: str):
     """
     Get user profile by Firebase ID
     """
-    user = users_collection.find_one(
-        {"firebase_id": firebase_id},
-        {"_id": 0}
-    )
+    user = await get_async_storage().get_user(firebase_id)
     
     if not user:
         return {"status": "error", "message": "User not found"}
@@ -68,15 +73,16 @@ def get_user(firebase_id: str):
 
 # ==================== QUESTIONS/PREFERENCES OPERATIONS ====================
 
-def answer_questions(data: UserPreferences):
+async def answer_questions(data: UserPreferences):
     """
     Create or update user parking preferences
     """
 
     firebase_id = data.firebase_id
+    storage = get_async_storage()
 
     # Ensure user exists (must be synced via /user/sync)
-    if not users_collection.find_one({"firebase_id": firebase_id}):
+    if not await storage.get_user(firebase_id):
         return {
             "status": "error",
             "message": "User does not exist. Sync user first."
@@ -92,24 +98,17 @@ def answer_questions(data: UserPreferences):
         "updated_at": datetime.utcnow(),
     }
 
-    result = preferences_collection.update_one(
-        {"firebase_id": firebase_id},
-        {
-            "$set": preferences_data,
-            "$setOnInsert": {"created_at": datetime.utcnow()},
-        },
-        upsert=True,
-    )
+    upserted, modified = await storage.upsert_preferences(firebase_id, preferences_data)
 
     return {
         "status": "success",
         "message": "Preferences saved successfully",
         "firebase_id": firebase_id,
-        "upserted": result.upserted_id is not None,
-        "modified": result.modified_count > 0,
+        "upserted": upserted,
+        "modified": modified,
     }
 
-def edit_questions(firebase_id: str, data: dict):
+async def edit_questions(firebase_id: str, data: dict):
     """
     Edit/update survey answers (PATCH)
     Can update one or more questions
@@ -124,30 +123,24 @@ def edit_questions(firebase_id: str, data: dict):
     # Add updated timestamp
     update_fields["updated_at"] = datetime.utcnow()
     
-    result = preferences_collection.update_one(
-        {"firebase_id": firebase_id},
-        {"$set": update_fields}
-    )
+    matched, modified = await get_async_storage().update_preferences(firebase_id, update_fields)
     
-    if result.matched_count == 0:
+    if not matched:
         return {"status": "error", "message": "User preference answers not found"}
     
     return {
         "status": "success",
         "message": "User preference answers updated successfully",
         "firebase_id": firebase_id,
-        "modified": result.modified_count > 0
+        "modified": modified
     }
 
 
-def get_questions(firebase_id: str):
+async def get_questions(firebase_id: str):
     """
     Get user's survey answers
     """
-    preferences = preferences_collection.find_one(
-        {"firebase_id": firebase_id},
-        {"_id": 0}
-    )
+    preferences = await get_async_storage().get_preferences(firebase_id)
     
     if not preferences:
         return {"status": "error", "message": "User preference  answers not found"}
@@ -158,14 +151,14 @@ def get_questions(firebase_id: str):
     }
 
 
-def delete_questions(firebase_id: str):
+async def delete_questions(firebase_id: str):
     """
     Delete survey answers (DELETE)
     Keeps user profile intact
     """
-    result = preferences_collection.delete_one({"firebase_id": firebase_id})
+    deleted = await get_async_storage().delete_preferences(firebase_id)
     
-    if result.deleted_count == 0:
+    if deleted == 0:
         return {"status": "error", "message": "No user preference  answers found"}
     
     return {
@@ -176,18 +169,15 @@ def delete_questions(firebase_id: str):
 
 # ==================== COMBINED OPERATIONS ====================
 
-def get_user_with_preferences(firebase_id: str):
+async def get_user_with_preferences(firebase_id: str):
     """
     Get user profile + questions answers combined
     """
-    user = users_collection.find_one(
-        {"firebase_id": firebase_id},
-        {"_id": 0}
-    )
-    
-    preferences = preferences_collection.find_one(
-        {"firebase_id": firebase_id},
-        {"_id": 0}
+    storage = get_async_storage()
+    # Independent lookups: run both queries concurrently
+    user, preferences = await asyncio.gather(
+        storage.get_user(firebase_id),
+        storage.get_preferences(firebase_id)
     )
     
     if not user:
@@ -200,51 +190,61 @@ def get_user_with_preferences(firebase_id: str):
     }
 
 
-def delete_user_complete(firebase_id: str):
+async def delete_user_complete(firebase_id: str):
     """
     Delete user profile AND user preferences questions answers
     """
-    pref_result = preferences_collection.delete_one({"firebase_id": firebase_id})
+    deleted = await get_async_storage().delete_preferences(firebase_id)
     
-    if  pref_result.deleted_count == 0:
+    if deleted == 0:
         return {"status": "error", "message": "User not found"}
     
     return {
         "status": "success",
         "message": "User preference answers deleted successfully",
         "firebase_id": firebase_id,
-        "preferences_deleted": pref_result.deleted_count > 0
+        "preferences_deleted": deleted > 0
     }
 
 
-def get_all_users():
+async def get_users_page(limit: int, cursor: str = None):
     """
-    Get all users with their preferences (admin endpoint)
+    Get one page of users with their preferences (admin endpoint)
+    Users are ordered by firebase_id; pass the returned next_cursor to get the next page
     """
-    users = list(users_collection.find({}, {"_id": 0}))
-    
-    # Attach preferences to each user
-    for user in users:
-        preferences = preferences_collection.find_one(
-            {"firebase_id": user["firebase_id"]},
-            {"_id": 0}
-        )
-        user["preferences"] = preferences
+    users = await get_async_storage().list_users_with_preferences(cursor, limit)
     
     return {
         "status": "success",
         "count": len(users),
-        "users": users
+        "users": users,
+        "next_cursor": users[-1]["firebase_id"] if len(users) == limit else None
     }
 
 
+async def export_users(page_size: int = USERS_EXPORT_PAGE_SIZE):
+    """
+    Stream every user with their preferences as NDJSON lines (admin export)
+    Reads one page at a time, so memory does not grow with the number of users
+    """
+    storage = get_async_storage()
+    cursor = None
+    while True:
+        users = await storage.list_users_with_preferences(cursor, page_size)
+        for user in users:
+            yield json.dumps(jsonable_encoder(user)) + "\n"
+        if len(users) < page_size:
+            break
+        cursor = users[-1]["firebase_id"]
+
+
 # ==================== PARKING LOT OPERATIONS ====================
 
-def get_lot_by_id(lot_id: str):
+async def get_lot_by_id(lot_id: str):
     """
     Get parking lot definition by lot_id
     """
-    lot = lot_collection.find_one({"lot_id": lot_id})
+    lot = await get_async_storage().get_lot(lot_id)
     
     if not lot:
         return {
@@ -252,26 +252,30 @@ def get_lot_by_id(lot_id: str):
             "message": f"Lot with id '{lot_id}' not found"
         }
     
-    # Convert ObjectId to string for JSON serialization
-    if "_id" in lot:
-        lot["_id"] = str(lot["_id"])
-    
     return {
         "status": "success",
         "lot": lot
     }
 
 
-def get_all_lots():
+async def get_all_lots():
     """
     Get all parking lots (admin endpoint)
     """
-    lots = list(lot_collection.find({}))
+    lots = await get_async_storage().list_lots()
     
-    # Convert ObjectId to string for each lot
-    for lot in lots:
-        if "_id" in lot:
-            lot["_id"] = str(lot["_id"])
+    return {
+        "status": "success",
+        "count": len(lots),
+        "lots": lots
+    }
+
+
+async def get_lot_summaries():
+    """
+    Total / occupied / free counts of every lot, read from the counters the detector maintains
+    """
+    lots = await get_async_storage().list_lot_summaries()
     
     return {
         "status": "success",
@@ -280,25 +284,123 @@ def get_all_lots():
     }
 
 
-def get_occupancy_by_lot_id(lot_id: str):
+async def get_occupancy_by_lot_id(lot_id: str):
     """
     Get all occupancy states for a specific lot_id
     """
-    occupancies = list(occupancy_collection.find({"lot_id": lot_id}))
-    
+    return occupancy_result(lot_id, await get_async_storage().list_occupancy(lot_id))
+
+
+async def get_occupancy_for_lots(lot_ids: list):
+    """
+    Occupancy of several lots from one storage query
+    Returns {lot_id: result}, each result shaped like get_occupancy_by_lot_id()
+    """
+    grouped = await get_async_storage().list_occupancy_for_lots(lot_ids)
+    return {lot_id: occupancy_result(lot_id, grouped.get(lot_id, [])) for lot_id in lot_ids}
+
+
+def occupancy_result(lot_id: str, occupancies: list):
     if not occupancies:
         return {
             "status": "error",
             "message": f"No occupancy data found for lot '{lot_id}'"
         }
     
-    # Convert ObjectId to string for each entry
-    for occ in occupancies:
-        if "_id" in occ:
-            occ["_id"] = str(occ["_id"])
-    
     return {
         "status": "success",
         "count": len(occupancies),
+        # Cursor for GET /occupancy/{lot_id}?since=<version>
+        "version": max((occ.get("version", 0) for occ in occupancies), default=0),
         "occupancies": occupancies
-    }
\ No newline at end of file
+    }
+
+
+def parse_since(since: str):
+    """
+    Parse a delta cursor: a lot version ("42") or an ISO timestamp
+    Returns (version, timestamp) with exactly one of them set, or None if invalid
+    """
+    try:
+        return int(since), None
+    except ValueError:
+        pass
+    try:
+        timestamp = datetime.fromisoformat(since.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    # Stored timestamps are naive UTC
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return None, timestamp
+
+
+async def get_occupancy_changes(lot_id: str, since: str):
+    """
+    Get only the spots of a lot that changed after a cursor (version or timestamp)
+    Returns the changed spots plus the version to pass as `since` next time
+    """
+    cursor = parse_since(since)
+    if cursor is None:
+        return {"status": "error", "message": "since must be a lot version or an ISO timestamp"}
+    since_version, since_time = cursor
+    storage = get_async_storage()
+
+    if since_version is not None:
+        changes = await storage.list_occupancy_changes(lot_id, since_version=since_version)
+        version = max([since_version] + [change.get("version", 0) for change in changes])
+    else:
+        # Read the counter first: anything written after this read has a larger version
+        version = await storage.get_lot_version(lot_id)
+        changes = await storage.list_occupancy_changes(lot_id, since_time=since_time)
+
+    return {
+        "status": "success",
+        "version": version,
+        "changes": [{"spot_id": change["spot_id"], "occupied": change["occupied"]} for change in changes]
+    }
+
+
+async def get_hourly_occupancy(lot_id: str, days: int = 30):
+    """
+    Get hourly occupancy rates for a lot over the last `days` days
+    Reads the precomputed per-lot hourly rollups (one document per hour),
+    never the raw occupancy events
+    """
+    since = datetime.utcnow().replace(minute=0, second=0, microsecond=0) - timedelta(days=days)
+    rollups = await get_async_storage().list_hourly_occupancy(lot_id, since)
+
+    hours = []
+    by_hour_of_day = {hour: [] for hour in range(24)}
+    for rollup in rollups:
+        total_spots = rollup.get("total_spots") or 0
+        rate = None
+        if total_spots:
+            rate = min(rollup.get("occupied_seconds", 0) / (total_spots * 3600), 1.0)
+            by_hour_of_day[rollup["hour"].hour].append(rate)
+
+        hours.append({
+            "hour": rollup["hour"],
+            "occupancy_rate": rate,
+            "arrivals": rollup.get("arrivals", 0)
+        })
+
+    if not hours:
+        return {
+            "status": "error",
+            "message": f"No occupancy history found for lot '{lot_id}'"
+        }
+
+    return {
+        "status": "success",
+        "lot_id": lot_id,
+        "days": days,
+        "hours": hours,
+        "by_hour_of_day": [
+            {
+                "hour": hour,
+                "occupancy_rate": sum(rates) / len(rates) if rates else None
+            }
+            for hour, rates in by_hour_of_day.items()
+        ]
+    }
@@ -0,0 +1,219 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+
+from fastapi.encoders import jsonable_encoder
+
+from controller.controller import get_occupancy_by_lot_id, get_occupancy_for_lots
+from database.storage import get_storage
+
+# Seconds a snapshot is served before the lot is re-read (when no watcher invalidated it earlier)
+OCCUPANCY_CACHE_TTL = float(os.getenv("OCCUPANCY_CACHE_TTL", "2.0"))
+# Seconds between checks of the cached lots' change counters (one storage query for all of them)
+OCCUPANCY_VERSION_POLL_SECONDS = float(os.getenv("OCCUPANCY_VERSION_POLL_SECONDS", "0.5"))
+# Most lots one GET /occupancy?lot_ids= request may ask for
+OCCUPANCY_BATCH_MAX_LOTS = int(os.getenv("OCCUPANCY_BATCH_MAX_LOTS", "100"))
+
+# lot_version: the lot's change counter in storage (newest spot `version`, the ?since= cursor)
+# body: pre-serialized JSON response; found: False for the "no occupancy data" error
+# states: spot_id -> (occupied, last_updated), for the compact encodings
+OccupancySnapshot = namedtuple("OccupancySnapshot", "lot_id lot_version etag body found loaded_at states")
+
+
+class OccupancyCache:
+    """
+    Per-lot snapshot of GET /occupancy/{lot_id}, serialized once and shared by every poll
+    A snapshot is rebuilt when it is invalidated (the version watcher or a
+    live feed saw a spot change) or older than `ttl`. The ETag is a digest of the body, so content that did
+    not change keeps it, on every worker process and across restarts, and
+    clients holding it keep getting 304s. Lots without occupancy data are
+    only kept while requests wait on their read, so unknown lot_ids cannot
+    grow the cache.
+    """
+
+    def __init__(self, ttl=OCCUPANCY_CACHE_TTL):
+        self.ttl = float(ttl)
+        self.snapshots = {}
+        self.stale = set()
+        self.lock = threading.Lock()
+        # lot_id -> [asyncio.Lock, coroutines holding or waiting for it]
+        self.lot_locks = {}
+
+    def _acquire_lot_lock(self, lot_id):
+        # asyncio locks are only touched from the event loop; `lock` also guards feed-thread invalidations
+        with self.lock:
+            entry = self.lot_locks.setdefault(lot_id, [asyncio.Lock(), 0])
+            entry[1] += 1
+            return entry[0]
+
+    def _release_lot_lock(self, lot_id):
+        with self.lock:
+            entry = self.lot_locks[lot_id]
+            entry[1] -= 1
+            # Unknown lot_ids drop their lock and not-found snapshot once nobody waits on them
+            if not entry[1] and not getattr(self.snapshots.get(lot_id), "found", False):
+                del self.lot_locks[lot_id]
+                self.snapshots.pop(lot_id, None)
+
+    def _fresh(self, lot_id):
+        snapshot = self.snapshots.get(lot_id)
+        if snapshot is None or lot_id in self.stale:
+            return None
+        if time.monotonic() - snapshot.loaded_at >= self.ttl:
+            return None
+        return snapshot
+
+    async def get(self, lot_id):
+        """Return the current snapshot of a lot, reading storage at most once per invalidation/TTL"""
+        snapshot = self._fresh(lot_id)
+        if snapshot is not None:
+            return snapshot
+
+        # Single flight: concurrent misses for the same lot wait for one read
+        lot_lock = self._acquire_lot_lock(lot_id)
+        try:
+            async with lot_lock:
+                snapshot = self._fresh(lot_id)
+                if snapshot is None:
+                    snapshot = await self._build(lot_id)
+        finally:
+            self._release_lot_lock(lot_id)
+        return snapshot
+
+    async def get_many(self, lot_ids):
+        """
+        Snapshots of several lots, in the order asked
+        Fresh snapshots come from the cache; all the others are read with one
+        storage query and cached per lot, exactly as get() would have.
+        """
+        snapshots = {lot_id: self._fresh(lot_id) for lot_id in lot_ids}
+        missing = [lot_id for lot_id, snapshot in snapshots.items() if snapshot is None]
+        if missing:
+            with self.lock:
+                self.stale.difference_update(missing)
+            results = await get_occupancy_for_lots(missing)
+            for lot_id in missing:
+                snapshots[lot_id] = self._store(lot_id, results[lot_id])
+        return [snapshots[lot_id] for lot_id in lot_ids]
+
+    async def _build(self, lot_id):
+        with self.lock:
+            self.stale.discard(lot_id)
+        return self._store(lot_id, await get_occupancy_by_lot_id(lot_id))
+
+    def _store(self, lot_id, result):
+        found = result.get("status") != "error"
+        body = json.dumps(jsonable_encoder(result), separators=(",", ":")).encode()
+        digest = hashlib.sha1(body).hexdigest()[:16]
+
+        states = {
+            occ["spot_id"]: (bool(occ.get("occupied")), occ.get("last_updated"))
+            for occ in result.get("occupancies", [])
+        }
+        snapshot = OccupancySnapshot(
+            lot_id, result.get("version", 0), f'"{digest}"', body, found, time.monotonic(), states
+        )
+        with self.lock:
+            if found or lot_id in self.lot_locks:
+                # A not-found snapshot is shared with the requests waiting for this read only
+                self.snapshots[lot_id] = snapshot
+            else:
+                self.snapshots.pop(lot_id, None)
+        return snapshot
+
+    def versions(self):
+        """lot_id -> change counter of every cached snapshot"""
+        with self.lock:
+            return {lot_id: snapshot.lot_version for lot_id, snapshot in self.snapshots.items() if snapshot.found}
+
+    def invalidate(self, lot_id):
+        """Force the next request for a lot to re-read storage"""
+        with self.lock:
+            self.stale.add(lot_id)
+
+    def clear(self):
+        with self.lock:
+            self.snapshots.clear()
+            self.stale.clear()
+            # Locks still held or awaited stay, or their waiters would no longer share one read
+            for lot_id in [lot_id for lot_id, (_, users) in self.lot_locks.items() if not users]:
+                del self.lot_locks[lot_id]
+
+
+class VersionWatcher:
+    """
+    Invalidates cached snapshots whose lot changed, whether or not anyone is subscribed to the live feed
+    Once per `interval` it reads the change counters of every cached lot with
+    one storage query, and invalidates the lots whose counter moved since it
+    last looked (or since their snapshot was read). Deployments where clients
+    only poll therefore see a change within `interval`, not only after the TTL.
+    """
+
+    def __init__(self, cache, interval=OCCUPANCY_VERSION_POLL_SECONDS):
+        self.cache = cache
+        self.interval = float(interval)
+        self.seen = {}
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.thread is not None:
+            return
+        # A fresh event per run, so a thread from before a stop() never resumes
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(
+            target=self._run, args=(self.stopping,), name="occupancy-cache-watcher", daemon=True
+        )
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        self.thread = None
+
+    def check(self):
+        """Compare the cached lots' counters with storage once"""
+        cached = self.cache.versions()
+        current = get_storage().get_lot_versions(list(cached)) if cached else {}
+        for lot_id, snapshot_version in cached.items():
+            version = current.get(lot_id, 0)
+            if version != self.seen.get(lot_id, snapshot_version):
+                self.cache.invalidate(lot_id)
+            self.seen[lot_id] = version
+        # Forget lots that left the cache
+        for lot_id in set(self.seen) - set(cached):
+            del self.seen[lot_id]
+
+    def _run(self, stopping):
+        while not stopping.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                logging.error(f"Occupancy cache watcher: version check failed: {e}")
+
+
+def batch_response(snapshots):
+    """
+    Body and ETag of GET /occupancy?lot_ids= built from per-lot snapshots
+    The per-lot bodies are spliced in as already serialized; the ETag changes whenever one lot's does.
+    """
+    lots = b",".join(json.dumps(snapshot.lot_id).encode() + b":" + snapshot.body for snapshot in snapshots)
+    body = b'{"status":"success","count":%d,"lots":{%s}}' % (len(snapshots), lots)
+    digest = hashlib.sha1("".join(snapshot.etag for snapshot in snapshots).encode()).hexdigest()[:16]
+    return body, f'"batch-{digest}"'
+
+
+def etag_matches(if_none_match, etag):
+    """True if an If-None-Match header value matches `etag` (weak comparison, `*` allowed)"""
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or any(tag.removeprefix("W/") == etag for tag in candidates)
+
+
+occupancy_cache = OccupancyCache()
+version_watcher = VersionWatcher(occupancy_cache)
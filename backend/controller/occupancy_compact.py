@@ -0,0 +1,162 @@
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+from datetime import timezone
+
+try:
+    import msgpack
+except ImportError:
+    # Optional: without it only the base64 bitset in JSON is offered
+    msgpack = None
+
+from controller.controller import get_lot_by_id
+
+MSGPACK_MEDIA_TYPE = "application/x-msgpack"
+BITSET_JSON_MEDIA_TYPE = "application/vnd.mac-a-park.bitset+json"
+
+# Seconds a lot's spot order is reused before the lot definition is re-read
+LOT_LAYOUT_TTL = float(os.getenv("LOT_LAYOUT_TTL", "60.0"))
+
+# spot_ids: order of the bits (LotDefinition.spots); layout_id: short hash clients compare against
+LotLayout = namedtuple("LotLayout", "spot_ids layout_id loaded_at")
+
+
+def negotiate(accept):
+    """
+    Pick the compact media type an Accept header asks for, or None for plain JSON
+    Highest q wins; on a tie the type listed first does.
+    """
+    supported = {BITSET_JSON_MEDIA_TYPE}
+    if msgpack is not None:
+        supported.add(MSGPACK_MEDIA_TYPE)
+
+    best, best_q = None, 0.0
+    for item in (accept or "").split(","):
+        media_type, *params = [part.strip() for part in item.split(";")]
+        if media_type.lower() not in supported:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if q > best_q:
+            best, best_q = media_type.lower(), q
+    return best
+
+
+def layout_id(spot_ids):
+    """First 8 hex digits of sha1 over the spot ids joined by newlines"""
+    return hashlib.sha1("\n".join(spot_ids).encode()).hexdigest()[:8]
+
+
+def pack_bits(spot_ids, states):
+    """Occupied flags in spot order, MSB first: spot i is bit 7 - i % 8 of byte i // 8"""
+    bits = bytearray((len(spot_ids) + 7) // 8)
+    for i, spot_id in enumerate(spot_ids):
+        state = states.get(spot_id)
+        if state is not None and state[0]:
+            bits[i >> 3] |= 0x80 >> (i & 7)
+    return bytes(bits)
+
+
+def _epoch(value):
+    if value is None or not hasattr(value, "timestamp"):
+        return None
+    if value.tzinfo is None:
+        # Stored timestamps are naive UTC
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp())
+
+
+def compact_payload(snapshot, layout, offsets=False):
+    """
+    Compact form of a cached occupancy snapshot
+        v: lot version (the ?since= cursor), n: number of spots, l: layout id, b: packed bitset
+        t, o (offsets=True): newest change as epoch seconds, and per spot the
+        seconds between its last change and t (None for spots never reported)
+    """
+    payload = {
+        "v": snapshot.lot_version,
+        "n": len(layout.spot_ids),
+        "l": layout.layout_id,
+        "b": pack_bits(layout.spot_ids, snapshot.states)
+    }
+    if offsets:
+        changed = [_epoch(snapshot.states.get(spot_id, (None, None))[1]) for spot_id in layout.spot_ids]
+        newest = max((ts for ts in changed if ts is not None), default=None)
+        payload["t"] = newest
+        payload["o"] = [None if ts is None else newest - ts for ts in changed]
+    return payload
+
+
+def encode(payload, media_type):
+    if media_type == MSGPACK_MEDIA_TYPE:
+        return msgpack.packb(payload, use_bin_type=True)
+    payload = dict(payload, b=base64.b64encode(payload["b"]).decode())
+    return json.dumps(payload, separators=(",", ":")).encode()
+
+
+class CompactEncoder:
+    """
+    Compact bodies for GET /occupancy/{lot_id}, derived from the snapshot cache
+    The bit order comes from the lot definition (cached per lot for
+    LOT_LAYOUT_TTL seconds); the last body of each lot/format is kept until
+    the snapshot or the layout changes.
+    """
+
+    def __init__(self, ttl=LOT_LAYOUT_TTL):
+        self.ttl = float(ttl)
+        self.layouts = {}
+        self.bodies = {}
+        self.lock = threading.Lock()
+
+    async def layout(self, lot_id):
+        """Spot order of a lot, or None if the lot has no definition"""
+        layout = self.layouts.get(lot_id)
+        if layout is not None and time.monotonic() - layout.loaded_at < self.ttl:
+            return layout
+        result = await get_lot_by_id(lot_id)
+        if result.get("status") == "error":
+            return None
+        spot_ids = tuple(spot["spot_id"] for spot in result["lot"].get("spots", []))
+        layout = LotLayout(spot_ids, layout_id(spot_ids), time.monotonic())
+        with self.lock:
+            self.layouts[lot_id] = layout
+        return layout
+
+    async def get(self, snapshot, media_type, offsets=False):
+        """
+        Return (body, etag) of a snapshot in `media_type`, or None if the lot has no definition
+        """
+        layout = await self.layout(snapshot.lot_id)
+        if layout is None:
+            return None
+
+        key = (snapshot.lot_id, media_type, offsets)
+        source = (snapshot.etag, layout.layout_id)
+        cached = self.bodies.get(key)
+        if cached is not None and cached[0] == source:
+            return cached[1], cached[2]
+
+        body = encode(compact_payload(snapshot, layout, offsets), media_type)
+        tag = hashlib.sha1(f"{snapshot.etag}|{layout.layout_id}|{media_type}|{offsets}".encode()).hexdigest()[:16]
+        etag = f'"{snapshot.lot_version}-{tag}"'
+        with self.lock:
+            self.bodies[key] = (source, body, etag)
+        return body, etag
+
+    def clear(self):
+        with self.lock:
+            self.layouts.clear()
+            self.bodies.clear()
+
+
+compact_encoder = CompactEncoder()
@@ -0,0 +1,160 @@
+import asyncio
+import logging
+import os
+import threading
+from datetime import datetime
+
+from controller.occupancy_cache import occupancy_cache
+from database.storage import get_storage
+
+# Poll interval of the fallback feed (storage without change streams)
+STREAM_POLL_SECONDS = float(os.getenv("STREAM_POLL_SECONDS", "1.0"))
+# Messages buffered per subscriber before it is resynchronised with a snapshot
+STREAM_QUEUE_SIZE = int(os.getenv("STREAM_QUEUE_SIZE", "256"))
+
+
+def _timestamp(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value or datetime.utcnow().isoformat()
+
+
+class LotFeed:
+    """
+    One background watcher per lot, shared by every subscriber of that lot
+    The watcher follows the storage change stream (MongoDB) or, when the
+    storage cannot stream, polls the lot once per STREAM_POLL_SECONDS.
+    Only spots whose occupied flag changed are sent to subscribers; each
+    change also invalidates the lot's cached GET /occupancy snapshot.
+    """
+
+    def __init__(self, lot_id, loop, on_idle):
+        self.lot_id = lot_id
+        self.loop = loop
+        self.on_idle = on_idle
+        self.spots = {}          # spot_id -> (occupied, ts)
+        self.subscribers = set()
+        self.lock = threading.Lock()
+        self.ready = threading.Event()
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._run, name=f"lot-feed-{lot_id}", daemon=True)
+        self.thread.start()
+
+    # ---------- subscribers (event loop thread) ----------
+    def subscribe(self):
+        queue = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+        with self.lock:
+            self.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        with self.lock:
+            self.subscribers.discard(queue)
+            idle = not self.subscribers
+        if idle:
+            self.on_idle(self)
+
+    def snapshot(self):
+        with self.lock:
+            spots = [{"spot_id": spot_id, "occupied": occupied} for spot_id, (occupied, _) in self.spots.items()]
+        return {"type": "snapshot", "lot_id": self.lot_id, "spots": spots, "ts": datetime.utcnow().isoformat()}
+
+    def deliver(self, queue, message):
+        try:
+            queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # Slow consumer: drop its backlog and resynchronise it with the current state
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(self.snapshot())
+
+    def _publish(self, message):
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for queue in subscribers:
+            self.loop.call_soon_threadsafe(self.deliver, queue, message)
+
+    # ---------- watcher (background thread) ----------
+    def _apply(self, doc):
+        spot_id, occupied = doc.get("spot_id"), doc.get("occupied")
+        if spot_id is None:
+            return
+        ts = _timestamp(doc.get("last_updated"))
+        with self.lock:
+            previous = self.spots.get(spot_id)
+            self.spots[spot_id] = (occupied, ts)
+        if previous is None or previous[0] != occupied:
+            occupancy_cache.invalidate(self.lot_id)
+            self._publish({
+                "type": "spot_update",
+                "lot_id": self.lot_id,
+                "spot_id": spot_id,
+                "occupied": occupied,
+                "ts": ts
+            })
+
+    def _load(self):
+        for doc in get_storage().list_occupancy(self.lot_id):
+            self._apply(doc)
+
+    def _run(self):
+        storage = get_storage()
+        try:
+            self._load()
+        except Exception as e:
+            logging.error(f"Lot feed {self.lot_id}: initial load failed: {e}")
+        self.ready.set()
+
+        try:
+            for doc in storage.watch_occupancy(self.lot_id, self.stopping):
+                self._apply(doc)
+            return
+        except NotImplementedError:
+            pass
+        except Exception as e:
+            logging.warning(f"Lot feed {self.lot_id}: change stream unavailable ({e}), polling instead")
+
+        while not self.stopping.wait(STREAM_POLL_SECONDS):
+            try:
+                self._load()
+            except Exception as e:
+                logging.error(f"Lot feed {self.lot_id}: poll failed: {e}")
+
+    def stop(self):
+        self.stopping.set()
+
+
+class OccupancyBroadcaster:
+    """Fan-out of live spot changes: lot_id -> LotFeed, started on first subscriber, stopped on last"""
+
+    def __init__(self):
+        self.feeds = {}
+        self.lock = threading.Lock()
+
+    def subscribe(self, lot_id):
+        """Return (feed, queue) for a new subscriber of `lot_id` (call from the event loop)"""
+        with self.lock:
+            feed = self.feeds.get(lot_id)
+            if feed is None:
+                feed = LotFeed(lot_id, asyncio.get_running_loop(), self._idle)
+                self.feeds[lot_id] = feed
+            queue = feed.subscribe()
+        return feed, queue
+
+    def _idle(self, feed):
+        with self.lock:
+            with feed.lock:
+                if feed.subscribers:
+                    return
+            if self.feeds.get(feed.lot_id) is feed:
+                del self.feeds[feed.lot_id]
+        feed.stop()
+
+    def close(self):
+        with self.lock:
+            feeds, self.feeds = list(self.feeds.values()), {}
+        for feed in feeds:
+            feed.stop()
+
+
+broadcaster = OccupancyBroadcaster()
@@ -0,0 +1,208 @@
+import heapq
+import math
+import threading
+import time
+from collections import namedtuple
+
+from controller.controller import get_lot_by_id
+from controller.occupancy_cache import occupancy_cache
+from controller.occupancy_compact import LOT_LAYOUT_TTL, layout_id
+from database.async_storage import get_async_storage
+
+# UserPreferences.q5 answers -> Spot.type
+SPOT_TYPES_BY_REQUIREMENT = {
+    "EV charging spot": "ev",
+    "Accessible parking": "accessible",
+    "Wide/family spot": "wide",
+}
+
+# UserPreferences.q3 answers -> ranking
+RANKING_BY_PREFERENCE = {
+    "Closest to entrance": "entrance",
+    "Least walking distance": "entrance",
+    "Near exit": "exit",
+    "Easiest to park": "area",
+}
+RANKINGS = ("entrance", "exit", "area")
+DEFAULT_RANKING = "entrance"
+
+# spot_ids/types: LotDefinition.spots order (same bit order as the compact bitset)
+# ranked: ranking -> spot type -> ((score, index), ...) best first
+# ranked_by: ranking asked -> ranking actually used (lots without entrances/exits fall back)
+LotRanking = namedtuple("LotRanking", "spot_ids types layout_id ranked ranked_by loaded_at")
+
+
+def _centroid(polygon, scale):
+    xs = [point["x"] * scale[0] for point in polygon]
+    ys = [point["y"] * scale[1] for point in polygon]
+    return sum(xs) / len(xs), sum(ys) / len(ys)
+
+
+def _area(polygon, scale):
+    points = [(point["x"] * scale[0], point["y"] * scale[1]) for point in polygon]
+    return abs(sum(x1 * y2 - x2 * y1 for (x1, y1), (x2, y2) in zip(points, points[1:] + points[:1]))) / 2
+
+
+def build_ranking(lot):
+    """
+    Precompute, per spot type, the lot's spots ordered by each ranking
+        entrance / exit: distance from the spot centroid to the nearest entrance / exit
+        area: largest polygon first ("easiest to park")
+    Distances are in image pixels when the reference size is known.
+    """
+    spots = lot.get("spots", [])
+    scale = (lot.get("image_width") or 1, lot.get("image_height") or 1)
+    spot_ids = tuple(spot["spot_id"] for spot in spots)
+    types = tuple(spot.get("type", "standard") for spot in spots)
+
+    points = {
+        "entrance": [(p["x"] * scale[0], p["y"] * scale[1]) for p in lot.get("entrances") or []],
+        "exit": [(p["x"] * scale[0], p["y"] * scale[1]) for p in lot.get("exits") or []],
+    }
+    ranked_by = {
+        "entrance": "entrance" if points["entrance"] else "order",
+        "exit": "exit" if points["exit"] else ("entrance" if points["entrance"] else "order"),
+        "area": "area",
+    }
+
+    scores = {"order": list(range(len(spots)))}
+    centroids = [_centroid(spot["polygon"], scale) if spot.get("polygon") else None for spot in spots]
+    for ranking in ("entrance", "exit"):
+        if points[ranking]:
+            scores[ranking] = [
+                min(math.dist(centroid, point) for point in points[ranking]) if centroid else math.inf
+                for centroid in centroids
+            ]
+    scores["area"] = [-_area(spot["polygon"], scale) if spot.get("polygon") else 0.0 for spot in spots]
+
+    ranked = {}
+    for ranking, values in scores.items():
+        by_type = {}
+        for index, spot_type in enumerate(types):
+            by_type.setdefault(spot_type, []).append((values[index], index))
+        ranked[ranking] = {spot_type: tuple(sorted(entries)) for spot_type, entries in by_type.items()}
+
+    return LotRanking(spot_ids, types, layout_id(spot_ids), ranked, ranked_by, time.monotonic())
+
+
+def free_mask(spot_ids, states):
+    """Bit i set when spots[i] is reported free (spots never reported are not offered)"""
+    mask = 0
+    for index, spot_id in enumerate(spot_ids):
+        state = states.get(spot_id)
+        if state is not None and not state[0]:
+            mask |= 1 << index
+    return mask
+
+
+def preferences_to_query(preferences):
+    """(ranking, spot types) a user's survey answers ask for"""
+    preferences = preferences or {}
+    ranking = RANKING_BY_PREFERENCE.get(preferences.get("q3"), DEFAULT_RANKING)
+    types = [SPOT_TYPES_BY_REQUIREMENT[answer] for answer in preferences.get("q5") or []
+             if answer in SPOT_TYPES_BY_REQUIREMENT]
+    return ranking, types
+
+
+class RecommendationIndex:
+    """
+    Best free spots of a lot for a set of spot types and a ranking
+    Rankings are rebuilt only when the lot definition is re-read (every
+    LOT_LAYOUT_TTL seconds); the free-spot mask only when the cached occupancy
+    snapshot changes. A request then walks the precomputed order of the
+    wanted types and stops after `limit` free spots.
+    """
+
+    def __init__(self, ttl=LOT_LAYOUT_TTL):
+        self.ttl = float(ttl)
+        self.rankings = {}
+        self.masks = {}
+        self.lock = threading.Lock()
+
+    async def ranking(self, lot_id):
+        """Precomputed ranking of a lot, or None if the lot has no definition"""
+        ranking = self.rankings.get(lot_id)
+        if ranking is not None and time.monotonic() - ranking.loaded_at < self.ttl:
+            return ranking
+        result = await get_lot_by_id(lot_id)
+        if result.get("status") == "error":
+            return None
+        ranking = build_ranking(result["lot"])
+        with self.lock:
+            self.rankings[lot_id] = ranking
+        return ranking
+
+    def _free(self, ranking, snapshot):
+        source = (snapshot.etag, ranking.layout_id)
+        cached = self.masks.get(snapshot.lot_id)
+        if cached is not None and cached[0] == source:
+            return cached[1]
+        mask = free_mask(ranking.spot_ids, snapshot.states)
+        with self.lock:
+            self.masks[snapshot.lot_id] = (source, mask)
+        return mask
+
+    async def recommend(self, lot_id, ranking_name=DEFAULT_RANKING, types=(), limit=5):
+        """
+        Up to `limit` free spots: spots of the wanted types first (all types if
+        none are given), then, if too few are free, the best remaining spots
+        with "matches_preferences": False
+        """
+        ranking = await self.ranking(lot_id)
+        if ranking is None:
+            return {"status": "error", "message": f"Lot with id '{lot_id}' not found"}
+        snapshot = await occupancy_cache.get(lot_id)
+        if not snapshot.found:
+            return {"status": "error", "message": f"No occupancy data found for lot '{lot_id}'"}
+
+        free = self._free(ranking, snapshot)
+        ranked_by = ranking.ranked_by[ranking_name]
+        by_type = ranking.ranked[ranked_by]
+        if types:
+            wanted = [spot_type for spot_type in dict.fromkeys(types) if spot_type in by_type]
+            others = [spot_type for spot_type in by_type if spot_type not in wanted]
+        else:
+            wanted, others = list(by_type), []
+
+        spots = []
+        for group, matches in ((wanted, True), (others, False)):
+            for score, index in heapq.merge(*(by_type[spot_type] for spot_type in group)):
+                if len(spots) >= limit:
+                    break
+                if free >> index & 1:
+                    spots.append({
+                        "spot_id": ranking.spot_ids[index],
+                        "type": ranking.types[index],
+                        "matches_preferences": matches
+                    })
+
+        return {
+            "status": "success",
+            "lot_id": lot_id,
+            "ranked_by": ranked_by,
+            "types": list(types),
+            "version": snapshot.lot_version,
+            "count": len(spots),
+            "spots": spots
+        }
+
+
+async def get_recommendations(lot_id, firebase_id=None, ranking=None, types=None, limit=5):
+    """
+    Recommend free spots of a lot from a user's survey answers
+    Explicit `ranking` / `types` override the stored preferences.
+    """
+    preferred_ranking, preferred_types = DEFAULT_RANKING, []
+    if firebase_id:
+        preferred_ranking, preferred_types = preferences_to_query(
+            await get_async_storage().get_preferences(firebase_id)
+        )
+    return await recommendation_index.recommend(
+        lot_id,
+        ranking or preferred_ranking,
+        preferred_types if types is None else types,
+        limit
+    )
+
+
+recommendation_index = RecommendationIndex()
@@ -0,0 +1,191 @@
+import asyncio
+from datetime import datetime
+
+from database.storage import (
+    Storage, MongoStorage, CHANGE_LOG_PROJECTION, LOT_SUMMARY_PROJECTION, get_storage, group_by_lot, log_changes,
+    merge_changes, occupancy_changes_filter, overlay_log, users_with_preferences_pipeline
+)
+
+class AsyncStorage:
+    """
+    Awaitable version of the Storage interface used by the async controller
+    Same methods, arguments and return values as database.storage.Storage
+    """
+
+    name = "storage"
+
+
+# ==================== MONGODB (async driver) ====================
+
+class AsyncMongoStorage(AsyncStorage):
+    """MongoDB storage on pymongo's AsyncMongoClient: no thread is held while a query is in flight"""
+
+    name = "mongodb"
+
+    def __init__(self, db):
+        self.db = db
+        self.users = db["mac-a-park-collection"]
+        self.preferences = db["preferences-collection"]
+        self.lots = db["lot-collection"]
+        self.occupancy = db["occupancy-collection"]
+        self.hourly = db["occupancy-hourly"]
+        self.lot_status = db["lot-status"]
+
+    async def upsert_user(self, firebase_id, fields):
+        result = await self.users.update_one(
+            {"firebase_id": firebase_id},
+            {"$set": fields, "$setOnInsert": {"created_at": datetime.utcnow()}},
+            upsert=True,
+        )
+        return result.upserted_id is not None, result.modified_count > 0
+
+    async def get_user(self, firebase_id):
+        return await self.users.find_one({"firebase_id": firebase_id}, {"_id": 0})
+
+    async def list_users(self):
+        return await self.users.find({}, {"_id": 0}).to_list(None)
+
+    async def list_users_with_preferences(self, after=None, limit=None):
+        cursor = await self.users.aggregate(users_with_preferences_pipeline(after, limit))
+        return await cursor.to_list(None)
+
+    async def upsert_preferences(self, firebase_id, fields):
+        result = await self.preferences.update_one(
+            {"firebase_id": firebase_id},
+            {"$set": fields, "$setOnInsert": {"created_at": datetime.utcnow()}},
+            upsert=True,
+        )
+        return result.upserted_id is not None, result.modified_count > 0
+
+    async def update_preferences(self, firebase_id, fields):
+        result = await self.preferences.update_one({"firebase_id": firebase_id}, {"$set": fields})
+        return result.matched_count > 0, result.modified_count > 0
+
+    async def get_preferences(self, firebase_id):
+        return await self.preferences.find_one({"firebase_id": firebase_id}, {"_id": 0})
+
+    async def delete_preferences(self, firebase_id):
+        return (await self.preferences.delete_one({"firebase_id": firebase_id})).deleted_count
+
+    async def get_lot(self, lot_id):
+        return MongoStorage._stringify_id(await self.lots.find_one({"lot_id": lot_id}))
+
+    async def list_lots(self):
+        return [MongoStorage._stringify_id(lot) for lot in await self.lots.find({}).to_list(None)]
+
+    async def list_occupancy(self, lot_id):
+        # Change log first, as in MongoStorage.list_occupancy
+        status = await self.lot_status.find_one({"lot_id": lot_id}, CHANGE_LOG_PROJECTION)
+        occupancies = await self.occupancy.find({"lot_id": lot_id}).to_list(None)
+        docs = [MongoStorage._stringify_id(occ) for occ in occupancies]
+        return overlay_log(lot_id, docs, status)
+
+    async def list_occupancy_for_lots(self, lot_ids):
+        statuses = await self.lot_status.find(
+            {"lot_id": {"$in": list(lot_ids)}}, CHANGE_LOG_PROJECTION
+        ).to_list(None)
+        occupancies = await self.occupancy.find(
+            {"lot_id": {"$in": list(lot_ids)}}
+        ).sort([("lot_id", 1), ("spot_id", 1)]).to_list(None)
+        grouped = group_by_lot(MongoStorage._stringify_id(occ) for occ in occupancies)
+        for status in statuses:
+            merged = overlay_log(status["lot_id"], grouped.get(status["lot_id"], []), status)
+            if merged:
+                grouped[status["lot_id"]] = merged
+        return grouped
+
+    async def list_occupancy_changes(self, lot_id, since_version=None, since_time=None):
+        status = await self.lot_status.find_one({"lot_id": lot_id}, CHANGE_LOG_PROJECTION)
+        logged, covered = log_changes(status, since_version, since_time)
+        docs = [] if covered else await self.occupancy.find(
+            occupancy_changes_filter(lot_id, since_version, since_time),
+            {"_id": 0, "spot_id": 1, "occupied": 1, "version": 1}
+        ).to_list(None)
+        return merge_changes(docs, logged)
+
+    async def get_lot_version(self, lot_id):
+        status = await self.lot_status.find_one({"lot_id": lot_id}, {"version": 1})
+        return status.get("version", 0) if status else 0
+
+    async def list_lot_summaries(self):
+        return await self.lot_status.find(
+            {"total": {"$exists": True}}, LOT_SUMMARY_PROJECTION
+        ).sort("lot_id", 1).to_list(None)
+
+    async def list_hourly_occupancy(self, lot_id, since):
+        return await self.hourly.find(
+            {"lot_id": lot_id, "hour": {"$gte": since}},
+            {"_id": 0, "hour": 1, "occupied_seconds": 1, "arrivals": 1, "total_spots": 1}
+        ).sort("hour", 1).to_list(None)
+
+    async def ping(self):
+        # The sync probe is cached, so this rarely leaves the event loop for long
+        from database.database import check_db_connection
+        return await asyncio.to_thread(check_db_connection)
+
+
+# ==================== THREADPOOL ADAPTER ====================
+
+def _threaded(method_name):
+    async def method(self, *args, **kwargs):
+        return await asyncio.to_thread(getattr(self.storage, method_name), *args, **kwargs)
+    method.__name__ = method_name
+    return method
+
+
+class ThreadedAsyncStorage(AsyncStorage):
+    """Runs a synchronous Storage (SQLite, in-memory) in the default thread pool"""
+
+    def __init__(self, storage: Storage):
+        self.storage = storage
+        self.name = storage.name
+
+    upsert_user = _threaded("upsert_user")
+    get_user = _threaded("get_user")
+    list_users = _threaded("list_users")
+    list_users_with_preferences = _threaded("list_users_with_preferences")
+    upsert_preferences = _threaded("upsert_preferences")
+    update_preferences = _threaded("update_preferences")
+    get_preferences = _threaded("get_preferences")
+    delete_preferences = _threaded("delete_preferences")
+    get_lot = _threaded("get_lot")
+    list_lots = _threaded("list_lots")
+    list_occupancy = _threaded("list_occupancy")
+    list_occupancy_for_lots = _threaded("list_occupancy_for_lots")
+    list_hourly_occupancy = _threaded("list_hourly_occupancy")
+    list_occupancy_changes = _threaded("list_occupancy_changes")
+    get_lot_version = _threaded("get_lot_version")
+    list_lot_summaries = _threaded("list_lot_summaries")
+    ping = _threaded("ping")
+
+
+# ==================== FACTORY ====================
+
+_async_storage = None
+_async_storage_source = None
+
+
+def get_async_storage() -> AsyncStorage:
+    """
+    Return the async view of the process-wide storage
+    MongoDB uses the native async driver; other storages go through the thread pool
+    """
+    global _async_storage, _async_storage_source
+    storage = get_storage()
+    if _async_storage is None or _async_storage_source is not storage:
+        if isinstance(storage, MongoStorage):
+            from database.database import get_async_db
+            _async_storage = AsyncMongoStorage(get_async_db(storage.url))
+        else:
+            _async_storage = ThreadedAsyncStorage(storage)
+        _async_storage_source = storage
+    return _async_storage
+
+
+async def close_async_storage():
+    """Close the async client, if any (FastAPI shutdown)"""
+    global _async_storage, _async_storage_source
+    if isinstance(_async_storage, AsyncMongoStorage):
+        from database.database import close_async_client
+        await close_async_client()
+    _async_storage = _async_storage_source = None
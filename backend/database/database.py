@@ -1,6 +1,7 @@
-from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure, ServerSelectionTimeoutError
+from pymongo import AsyncMongoClient, MongoClient
 import os
+import threading
+import time
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -8,48 +9,111 @@ load_dotenv()
 
 # MongoDB Configuration
 MONGO_URI = os.getenv("MONGO_URI")
-DATABASE_NAME = "mac-a-park-db"  
+DATABASE_NAME = "mac-a-park-db"
 
-# Initialize MongoDB Client
-try:
-    client = MongoClient(
-        MONGO_URI,
-        serverSelectionTimeoutMS=5000  # 5 second timeout
+# Connection pool and timeouts (shared by every request in this worker)
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "10000"))
+
+# How long a readiness probe result is reused before pinging again
+READINESS_CACHE_SECONDS = float(os.getenv("READINESS_CACHE_SECONDS", "5"))
+
+_client = None
+_client_lock = threading.Lock()
+_async_client = None
+_readiness = None
+_readiness_checked_at = 0.0
+
+
+def _client_options():
+    return dict(
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        minPoolSize=MONGO_MIN_POOL_SIZE,
+        serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+        socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
     )
-    
-    # Test connection
-    client.admin.command('ping')
-    print(" MongoDB Connected Successfully")
-    
-except ConnectionFailure as e:
-    print(f"MongoDB Connection Failed: {e}")
-    raise
-except ServerSelectionTimeoutError as e:
-    print(f"MongoDB Server Selection Timeout: {e}")
-    raise
-
-# Database
-db = client[DATABASE_NAME]
-
-# Collections
-users_collection = db["mac-a-park-collection"]
-preferences_collection = db["preferences-collection"]
-lot_collection = db["lot-collection"]
-occupancy_collection = db["occupancy-collection"]
+
+
+def get_client(uri: str = None):
+    """
+    Return the process-wide MongoClient, creating it on first use
+    Creating the client does not wait for the server; connections are opened
+    by the pool when the first operation runs
+    `uri` overrides MONGO_URI when the client is first created
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = MongoClient(uri or MONGO_URI, **_client_options())
+    return _client
+
+
+def get_db(uri: str = None):
+    """Return the application database on the shared client"""
+    return get_client(uri)[DATABASE_NAME]
+
+
+def close_client():
+    """Close the shared client (FastAPI shutdown)"""
+    global _client, _readiness
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+            _readiness = None
+
+
+def get_async_client(uri: str = None):
+    """
+    Return the process-wide AsyncMongoClient used by the async controller
+    Like get_client() it is created on first use with the same pool settings;
+    it must be used from the event loop it was first used on
+    """
+    global _async_client
+    if _async_client is None:
+        _async_client = AsyncMongoClient(uri or MONGO_URI, **_client_options())
+    return _async_client
+
+
+def get_async_db(uri: str = None):
+    """Return the application database on the shared async client"""
+    return get_async_client(uri)[DATABASE_NAME]
+
+
+async def close_async_client():
+    """Close the shared async client (FastAPI shutdown)"""
+    global _async_client
+    if _async_client is not None:
+        await _async_client.close()
+        _async_client = None
+
 
 # Helper function to check database connection
-def check_db_connection():
+def check_db_connection(max_age: float = READINESS_CACHE_SECONDS):
     """
     Check if MongoDB connection is alive
+    The result is cached for `max_age` seconds so frequent readiness probes
+    do not turn into a ping per request
     """
+    global _readiness, _readiness_checked_at
+    now = time.monotonic()
+    if _readiness is not None and now - _readiness_checked_at < max_age:
+        return _readiness
+
     try:
-        client.admin.command('ping')
-        return {
+        get_client().admin.command('ping')
+        result = {
             "status": "connected",
             "database": DATABASE_NAME,
             "collection": "mac-a-park-collection"
         }
     except Exception as e:
-        return {"status": "disconnected", "error": str(e)}
-
+        result = {"status": "disconnected", "error": str(e)}
 
+    _readiness, _readiness_checked_at = result, now
+    return result
@@ -0,0 +1,128 @@
+"""
+MongoDB index bootstrap for every Mac-a-Park collection.
+
+The same INDEXES declaration lives in server/mongo_indexes.py (used by the
+detector's ParkingDB); keep the two in sync when adding a query pattern.
+
+Usage:
+    python -m database.indexes           # create missing indexes
+    python -m database.indexes --check   # also fail if a controller query would COLLSCAN
+"""
+import logging
+import sys
+
+from pymongo import ASCENDING
+from pymongo.errors import PyMongoError
+
+# collection -> list of (keys, options)
+INDEXES = {
+    "mac-a-park-collection": [
+        ([("firebase_id", ASCENDING)], {"name": "firebase_id_unique", "unique": True}),
+    ],
+    "preferences-collection": [
+        ([("firebase_id", ASCENDING)], {"name": "firebase_id_unique", "unique": True}),
+    ],
+    "lot-collection": [
+        ([("lot_id", ASCENDING)], {"name": "lot_id_unique", "unique": True}),
+    ],
+    "occupancy-collection": [
+        ([("lot_id", ASCENDING), ("spot_id", ASCENDING)], {"name": "lot_spot_unique", "unique": True}),
+        ([("lot_id", ASCENDING), ("version", ASCENDING)], {"name": "lot_version"}),
+        ([("lot_id", ASCENDING), ("last_updated", ASCENDING)], {"name": "lot_last_updated"}),
+    ],
+    "lot-status": [
+        ([("lot_id", ASCENDING)], {"name": "lot_id_unique", "unique": True}),
+    ],
+    "occupancy-history": [
+        ([("lot_id", ASCENDING), ("spot_id", ASCENDING), ("hour", ASCENDING)],
+         {"name": "lot_spot_hour_unique", "unique": True}),
+    ],
+    "occupancy-hourly": [
+        ([("lot_id", ASCENDING), ("hour", ASCENDING)], {"name": "lot_hour_unique", "unique": True}),
+    ],
+}
+
+# Filtered queries issued by controller.py: (collection, filter, sort)
+CONTROLLER_QUERIES = [
+    ("mac-a-park-collection", {"firebase_id": "explain-check"}, None),
+    ("mac-a-park-collection", {"firebase_id": {"$gt": "explain-check"}}, [("firebase_id", ASCENDING)]),
+    ("preferences-collection", {"firebase_id": "explain-check"}, None),
+    ("lot-collection", {"lot_id": "explain-check"}, None),
+    ("occupancy-collection", {"lot_id": "explain-check"}, None),
+    ("occupancy-collection", {"lot_id": {"$in": ["explain-check"]}}, [("lot_id", ASCENDING), ("spot_id", ASCENDING)]),
+    ("occupancy-collection", {"lot_id": "explain-check", "version": {"$gt": 0}}, None),
+    ("occupancy-collection", {"lot_id": "explain-check", "last_updated": {"$gt": 0}}, None),
+    ("occupancy-hourly", {"lot_id": "explain-check", "hour": {"$gte": 0}}, [("hour", ASCENDING)]),
+    ("lot-status", {"lot_id": "explain-check"}, None),
+    ("lot-status", {"lot_id": {"$in": ["explain-check"]}}, None),
+    ("lot-status", {"total": {"$exists": True}}, [("lot_id", ASCENDING)]),
+]
+
+
+def ensure_indexes(db):
+    """
+    Create every declared index (no-op for indexes that already exist).
+
+    Returns:
+        List of "collection.index" names that could not be created
+    """
+    failed = []
+    for collection_name, specs in INDEXES.items():
+        collection = db[collection_name]
+        for keys, options in specs:
+            try:
+                collection.create_index(keys, **options)
+            except PyMongoError as e:
+                logging.error(f"Failed to create index {collection_name}.{options['name']}: {e}")
+                failed.append(f"{collection_name}.{options['name']}")
+    return failed
+
+
+def _plan_stages(plan):
+    stages = [plan.get("stage")]
+    for child_key in ("inputStage", "queryPlan"):
+        if child_key in plan:
+            stages.extend(_plan_stages(plan[child_key]))
+    for child in plan.get("inputStages", []):
+        stages.extend(_plan_stages(child))
+    return stages
+
+
+def check_query_plans(db, queries=CONTROLLER_QUERIES):
+    """
+    Run explain() on every controller query and raise if any would do a COLLSCAN.
+
+    Returns:
+        Mapping of collection name -> winning plan stages
+    """
+    plans, scans = {}, []
+    for collection_name, query, sort in queries:
+        cursor = db[collection_name].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        winning_plan = cursor.explain()["queryPlanner"]["winningPlan"]
+        stages = _plan_stages(winning_plan)
+        plans[collection_name] = stages
+        if "COLLSCAN" in stages:
+            scans.append(f"{collection_name} {query}")
+
+    if scans:
+        raise RuntimeError("Queries without a supporting index (COLLSCAN): " + "; ".join(scans))
+    return plans
+
+
+if __name__ == "__main__":
+    from database.database import get_db
+
+    db = get_db()
+
+    logging.basicConfig(level=logging.INFO)
+    failed = ensure_indexes(db)
+    if failed:
+        sys.exit(f"Index creation failed: {', '.join(failed)}")
+    print("Indexes are in place")
+
+    if "--check" in sys.argv:
+        for collection_name, stages in check_query_plans(db).items():
+            print(f"{collection_name}: {' <- '.join(s for s in stages if s)}")
+        print("No controller query requires a collection scan")
@@ -0,0 +1,768 @@
+import copy
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+class Storage:
+    """
+    Storage interface used by the controller
+    Covers users, preferences, lot definitions and occupancy state.
+    Documents are plain dicts shaped like the MongoDB documents.
+    """
+
+    name = "storage"
+
+    # ---------- users ----------
+    def upsert_user(self, firebase_id: str, fields: dict):
+        """Create or update a user; returns (upserted, modified)"""
+        raise NotImplementedError
+
+    def get_user(self, firebase_id: str):
+        raise NotImplementedError
+
+    def list_users(self):
+        raise NotImplementedError
+
+    def list_users_with_preferences(self, after: str = None, limit: int = None):
+        """
+        Users ordered by firebase_id, each with a "preferences" field (or None)
+        Only users with firebase_id > after are returned, at most `limit` of them
+        """
+        raise NotImplementedError
+
+    # ---------- preferences ----------
+    def upsert_preferences(self, firebase_id: str, fields: dict):
+        """Create or replace preference answers; returns (upserted, modified)"""
+        raise NotImplementedError
+
+    def update_preferences(self, firebase_id: str, fields: dict):
+        """Patch existing preference answers; returns (matched, modified)"""
+        raise NotImplementedError
+
+    def get_preferences(self, firebase_id: str):
+        raise NotImplementedError
+
+    def delete_preferences(self, firebase_id: str):
+        """Returns the number of deleted documents"""
+        raise NotImplementedError
+
+    # ---------- lots & occupancy ----------
+    def get_lot(self, lot_id: str):
+        raise NotImplementedError
+
+    def list_lots(self):
+        raise NotImplementedError
+
+    def list_occupancy(self, lot_id: str):
+        raise NotImplementedError
+
+    def list_occupancy_for_lots(self, lot_ids: list):
+        """Occupancy of several lots in one query, grouped as {lot_id: [docs]} (lots without data are omitted)"""
+        raise NotImplementedError
+
+    def list_hourly_occupancy(self, lot_id: str, since: datetime):
+        """Hourly rollups for a lot with hour >= since, oldest first"""
+        raise NotImplementedError
+
+    def list_occupancy_changes(self, lot_id: str, since_version: int = None, since_time: datetime = None):
+        """Spots (spot_id, occupied, version) written after a lot version or after a timestamp"""
+        raise NotImplementedError
+
+    def get_lot_version(self, lot_id: str):
+        """Current value of the lot's change counter (0 if nothing was written yet)"""
+        raise NotImplementedError
+
+    def get_lot_versions(self, lot_ids: list):
+        """Change counters of several lots in one query, as {lot_id: version} (lots without writes are omitted)"""
+        raise NotImplementedError
+
+    def list_lot_summaries(self):
+        """
+        Occupancy counters of every lot, ordered by lot_id
+        Each item: lot_id, name, total, occupied, free, by_type {type: {total, occupied, free}}, updated_at
+        """
+        raise NotImplementedError
+
+    def watch_occupancy(self, lot_id: str, stop_event):
+        """
+        Yield occupancy documents of a lot as they change until stop_event is set
+        Storages without a change feed raise NotImplementedError (callers poll instead)
+        """
+        raise NotImplementedError
+
+    # ---------- lifecycle ----------
+    def ping(self):
+        return {"status": "connected", "storage": self.name}
+
+    def bootstrap(self):
+        """Create indexes / tables needed by the queries above"""
+
+    def close(self):
+        pass
+
+
+# ==================== MONGODB ====================
+
+def group_by_lot(docs):
+    """{lot_id: [docs]} in the order the documents were read"""
+    grouped = {}
+    for doc in docs:
+        grouped.setdefault(doc["lot_id"], []).append(doc)
+    return grouped
+
+
+def occupancy_changes_filter(lot_id, since_version=None, since_time=None):
+    """Filter for spots written after a lot version (index lot_version) or a time (index lot_last_updated)"""
+    if since_version is not None:
+        return {"lot_id": lot_id, "version": {"$gt": since_version}}
+    return {"lot_id": lot_id, "last_updated": {"$gt": since_time}}
+
+
+def log_changes(status, since_version=None, since_time=None):
+    """
+    Spots a lot's change log (`lot-status`.log) records after a cursor
+    The detector appends one entry per written spot in the same update that
+    advances `version`, so the last entry carries `version` and the log is in
+    commit order. Returns ({spot_id: newest change}, covered) where `covered`
+    is False when the log does not reach back to since_version.
+    """
+    log = (status or {}).get("log") or []
+    first = (status or {}).get("version", 0) - len(log) + 1
+    changes = {}
+    for offset, entry in enumerate(log):
+        version = first + offset
+        if since_version is not None and version <= since_version:
+            continue
+        if since_time is not None and not entry["t"] > since_time:
+            continue
+        changes[entry["s"]] = {"spot_id": entry["s"], "occupied": entry["o"], "last_updated": entry["t"],
+                               "version": version}
+    return changes, since_version is not None and since_version >= first - 1
+
+
+def merge_changes(docs, logged):
+    """Spot documents overlaid with logged changes, the higher version winning, oldest first"""
+    merged = {doc["spot_id"]: doc for doc in docs}
+    for spot_id, change in logged.items():
+        doc = merged.get(spot_id)
+        if doc is None or change["version"] > doc.get("version", 0):
+            merged[spot_id] = dict(doc or {}, **change)
+    return sorted(merged.values(), key=lambda doc: doc.get("version", 0))
+
+
+def overlay_log(lot_id, docs, status):
+    """
+    Current occupancy of a lot: spot documents overlaid with the change log
+    A spot whose batch is logged but not written yet shows its logged state,
+    so the lot version of the result never runs ahead of a spot.
+    """
+    logged, _ = log_changes(status)
+    for change in logged.values():
+        change["lot_id"] = lot_id
+    order = {doc["spot_id"]: index for index, doc in enumerate(docs)}
+    return sorted(merge_changes(docs, logged), key=lambda doc: (order.get(doc["spot_id"], len(order)), doc["spot_id"]))
+
+
+# Change counter and change log the detector keeps in each `lot-status` document
+CHANGE_LOG_PROJECTION = {"_id": 0, "lot_id": 1, "version": 1, "log": 1}
+
+# Counter fields the detector keeps in each `lot-status` document
+LOT_SUMMARY_PROJECTION = {
+    "_id": 0, "lot_id": 1, "name": 1, "total": 1, "occupied": 1, "free": 1, "by_type": 1, "updated_at": 1
+}
+
+
+def users_with_preferences_pipeline(after=None, limit=None):
+    """
+    One aggregation for a page of users joined with their preferences
+    Walks the firebase_id index in order; `after` is the last firebase_id of the previous page
+    """
+    pipeline = []
+    if after is not None:
+        pipeline.append({"$match": {"firebase_id": {"$gt": after}}})
+    pipeline.append({"$sort": {"firebase_id": 1}})
+    if limit is not None:
+        pipeline.append({"$limit": limit})
+    pipeline += [
+        {"$lookup": {
+            "from": "preferences-collection",
+            "localField": "firebase_id",
+            "foreignField": "firebase_id",
+            "as": "preferences"
+        }},
+        {"$project": {"_id": 0, "preferences._id": 0}},
+        {"$set": {"preferences": {"$ifNull": [{"$arrayElemAt": ["$preferences", 0]}, None]}}},
+    ]
+    return pipeline
+
+
+class MongoStorage(Storage):
+    """MongoDB-backed storage (the default)"""
+
+    name = "mongodb"
+
+    def __init__(self, db, url=None):
+        self.db = db
+        self.url = url
+        self.users = db["mac-a-park-collection"]
+        self.preferences = db["preferences-collection"]
+        self.lots = db["lot-collection"]
+        self.occupancy = db["occupancy-collection"]
+        self.hourly = db["occupancy-hourly"]
+        self.lot_status = db["lot-status"]
+
+    @staticmethod
+    def _stringify_id(doc):
+        # Convert ObjectId to string for JSON serialization
+        if doc and "_id" in doc:
+            doc["_id"] = str(doc["_id"])
+        return doc
+
+    def upsert_user(self, firebase_id, fields):
+        result = self.users.update_one(
+            {"firebase_id": firebase_id},
+            {"$set": fields, "$setOnInsert": {"created_at": datetime.utcnow()}},
+            upsert=True,
+        )
+        return result.upserted_id is not None, result.modified_count > 0
+
+    def get_user(self, firebase_id):
+        return self.users.find_one({"firebase_id": firebase_id}, {"_id": 0})
+
+    def list_users(self):
+        return list(self.users.find({}, {"_id": 0}))
+
+    def list_users_with_preferences(self, after=None, limit=None):
+        return list(self.users.aggregate(users_with_preferences_pipeline(after, limit)))
+
+    def upsert_preferences(self, firebase_id, fields):
+        result = self.preferences.update_one(
+            {"firebase_id": firebase_id},
+            {"$set": fields, "$setOnInsert": {"created_at": datetime.utcnow()}},
+            upsert=True,
+        )
+        return result.upserted_id is not None, result.modified_count > 0
+
+    def update_preferences(self, firebase_id, fields):
+        result = self.preferences.update_one({"firebase_id": firebase_id}, {"$set": fields})
+        return result.matched_count > 0, result.modified_count > 0
+
+    def get_preferences(self, firebase_id):
+        return self.preferences.find_one({"firebase_id": firebase_id}, {"_id": 0})
+
+    def delete_preferences(self, firebase_id):
+        return self.preferences.delete_one({"firebase_id": firebase_id}).deleted_count
+
+    def get_lot(self, lot_id):
+        return self._stringify_id(self.lots.find_one({"lot_id": lot_id}))
+
+    def list_lots(self):
+        return [self._stringify_id(lot) for lot in self.lots.find({})]
+
+    def _change_logs(self, lot_ids):
+        return {
+            status["lot_id"]: status
+            for status in self.lot_status.find({"lot_id": {"$in": list(lot_ids)}}, CHANGE_LOG_PROJECTION)
+        }
+
+    def list_occupancy(self, lot_id):
+        # Change log first: spots logged after it was read carry higher versions than the result
+        status = self.lot_status.find_one({"lot_id": lot_id}, CHANGE_LOG_PROJECTION)
+        docs = [self._stringify_id(occ) for occ in self.occupancy.find({"lot_id": lot_id})]
+        return overlay_log(lot_id, docs, status)
+
+    def list_occupancy_for_lots(self, lot_ids):
+        statuses = self._change_logs(lot_ids)
+        # One $in scan of the lot_spot_unique index; same per-lot spot order as list_occupancy
+        cursor = self.occupancy.find({"lot_id": {"$in": list(lot_ids)}}).sort([("lot_id", 1), ("spot_id", 1)])
+        grouped = group_by_lot(self._stringify_id(occ) for occ in cursor)
+        for lot_id, status in statuses.items():
+            occupancies = overlay_log(lot_id, grouped.get(lot_id, []), status)
+            if occupancies:
+                grouped[lot_id] = occupancies
+        return grouped
+
+    def list_occupancy_changes(self, lot_id, since_version=None, since_time=None):
+        status = self.lot_status.find_one({"lot_id": lot_id}, CHANGE_LOG_PROJECTION)
+        logged, covered = log_changes(status, since_version, since_time)
+        docs = [] if covered else list(self.occupancy.find(
+            occupancy_changes_filter(lot_id, since_version, since_time),
+            {"_id": 0, "spot_id": 1, "occupied": 1, "version": 1}
+        ))
+        return merge_changes(docs, logged)
+
+    def get_lot_version(self, lot_id):
+        status = self.lot_status.find_one({"lot_id": lot_id}, {"version": 1})
+        return status.get("version", 0) if status else 0
+
+    def get_lot_versions(self, lot_ids):
+        return {
+            status["lot_id"]: status.get("version", 0)
+            for status in self.lot_status.find({"lot_id": {"$in": list(lot_ids)}}, {"_id": 0, "lot_id": 1, "version": 1})
+        }
+
+    def list_lot_summaries(self):
+        # One small document per lot: no occupancy scan, no aggregation
+        return list(self.lot_status.find({"total": {"$exists": True}}, LOT_SUMMARY_PROJECTION).sort("lot_id", 1))
+
+    def list_hourly_occupancy(self, lot_id, since):
+        return list(self.hourly.find(
+            {"lot_id": lot_id, "hour": {"$gte": since}},
+            {"_id": 0, "hour": 1, "occupied_seconds": 1, "arrivals": 1, "total_spots": 1}
+        ).sort("hour", 1))
+
+    def watch_occupancy(self, lot_id, stop_event):
+        # Change streams need a replica set; a standalone server raises OperationFailure
+        pipeline = [{"$match": {"fullDocument.lot_id": lot_id}}]
+        with self.occupancy.watch(pipeline, full_document="updateLookup", max_await_time_ms=1000) as stream:
+            while not stop_event.is_set():
+                change = stream.try_next()
+                if change and change.get("fullDocument"):
+                    yield change["fullDocument"]
+
+    def ping(self):
+        from database.database import check_db_connection
+        return check_db_connection()
+
+    def bootstrap(self):
+        from database.indexes import ensure_indexes
+        ensure_indexes(self.db)
+
+    def close(self):
+        from database.database import close_client
+        close_client()
+
+
+# ==================== IN-MEMORY ====================
+
+class MemoryStorage(Storage):
+    """Process-local dict storage for tests and benchmarks (no database at all)"""
+
+    name = "memory"
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.users = {}
+        self.preferences = {}
+        self.lots = {}
+        self.occupancy = {}   # lot_id -> {spot_id: doc}
+        self.hourly = {}      # lot_id -> {hour: doc}
+        self.versions = {}    # lot_id -> change counter
+
+    @staticmethod
+    def _upsert(table, key, fields):
+        doc = table.get(key)
+        if doc is None:
+            table[key] = dict(fields, created_at=datetime.utcnow())
+            return True, False
+        modified = any(doc.get(k) != v for k, v in fields.items())
+        doc.update(fields)
+        return False, modified
+
+    def upsert_user(self, firebase_id, fields):
+        with self.lock:
+            return self._upsert(self.users, firebase_id, fields)
+
+    def get_user(self, firebase_id):
+        return copy.deepcopy(self.users.get(firebase_id))
+
+    def list_users(self):
+        return copy.deepcopy(list(self.users.values()))
+
+    def list_users_with_preferences(self, after=None, limit=None):
+        firebase_ids = sorted(f for f in self.users if after is None or f > after)[:limit]
+        return [
+            dict(copy.deepcopy(self.users[f]), preferences=copy.deepcopy(self.preferences.get(f)))
+            for f in firebase_ids
+        ]
+
+    def upsert_preferences(self, firebase_id, fields):
+        with self.lock:
+            return self._upsert(self.preferences, firebase_id, fields)
+
+    def update_preferences(self, firebase_id, fields):
+        with self.lock:
+            doc = self.preferences.get(firebase_id)
+            if doc is None:
+                return False, False
+            modified = any(doc.get(k) != v for k, v in fields.items())
+            doc.update(fields)
+            return True, modified
+
+    def get_preferences(self, firebase_id):
+        return copy.deepcopy(self.preferences.get(firebase_id))
+
+    def delete_preferences(self, firebase_id):
+        with self.lock:
+            return 1 if self.preferences.pop(firebase_id, None) is not None else 0
+
+    def get_lot(self, lot_id):
+        return copy.deepcopy(self.lots.get(lot_id))
+
+    def list_lots(self):
+        return copy.deepcopy(list(self.lots.values()))
+
+    def list_occupancy(self, lot_id):
+        return copy.deepcopy(list(self.occupancy.get(lot_id, {}).values()))
+
+    def list_occupancy_for_lots(self, lot_ids):
+        return {lot_id: self.list_occupancy(lot_id) for lot_id in lot_ids if self.occupancy.get(lot_id)}
+
+    def list_occupancy_changes(self, lot_id, since_version=None, since_time=None):
+        return [
+            {"spot_id": doc["spot_id"], "occupied": doc["occupied"], "version": doc.get("version", 0)}
+            for doc in self.occupancy.get(lot_id, {}).values()
+            if (doc.get("version", 0) > since_version if since_version is not None
+                else doc.get("last_updated") is not None and doc["last_updated"] > since_time)
+        ]
+
+    def get_lot_version(self, lot_id):
+        return self.versions.get(lot_id, 0)
+
+    def get_lot_versions(self, lot_ids):
+        return {lot_id: self.versions[lot_id] for lot_id in lot_ids if lot_id in self.versions}
+
+    def list_lot_summaries(self):
+        # Counted on the fly: this storage has no detector maintaining counters
+        summaries = []
+        for lot_id in sorted(self.lots):
+            lot = self.lots[lot_id]
+            state = self.occupancy.get(lot_id, {})
+            summary = {"lot_id": lot_id, "name": lot.get("name"), "total": 0, "occupied": 0, "free": 0, "by_type": {}}
+            for spot in lot.get("spots", []):
+                occupied = state.get(spot["spot_id"], {}).get("occupied", False)
+                counts = summary["by_type"].setdefault(
+                    spot.get("type", "standard"), {"total": 0, "occupied": 0, "free": 0}
+                )
+                for target in (summary, counts):
+                    target["total"] += 1
+                    target["occupied" if occupied else "free"] += 1
+            summaries.append(summary)
+        return summaries
+
+    def list_hourly_occupancy(self, lot_id, since):
+        rollups = self.hourly.get(lot_id, {})
+        return copy.deepcopy([rollups[hour] for hour in sorted(rollups) if hour >= since])
+
+    # Write helpers used to seed lots and occupancy (the detector writes them in production)
+    def save_lot(self, lot):
+        with self.lock:
+            self.lots[lot["lot_id"]] = copy.deepcopy(lot)
+
+    def save_occupancy(self, doc):
+        with self.lock:
+            version = self.versions[doc["lot_id"]] = self.versions.get(doc["lot_id"], 0) + 1
+            doc = dict(copy.deepcopy(doc), version=version)
+            doc.setdefault("last_updated", datetime.utcnow())
+            self.occupancy.setdefault(doc["lot_id"], {})[doc["spot_id"]] = doc
+
+
+# ==================== SQLITE ====================
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return {"$date": value.isoformat()}
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _decode(obj):
+    if len(obj) == 1 and "$date" in obj:
+        return datetime.fromisoformat(obj["$date"])
+    return obj
+
+
+def dumps(doc):
+    return json.dumps(doc, default=_encode)
+
+
+def loads(text):
+    return json.loads(text, object_hook=_decode) if text is not None else None
+
+
+# Shared with server/storage.py so the detector and backend can use one file at edge sites;
+# check_sqlite_schema() refuses a file whose schema differs, and
+# `python -m database.storage --check-schema` compares the two copies
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (firebase_id TEXT PRIMARY KEY, doc TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS preferences (firebase_id TEXT PRIMARY KEY, doc TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS lots (lot_id TEXT PRIMARY KEY, doc TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS occupancy (
+    lot_id TEXT NOT NULL, spot_id TEXT NOT NULL, doc TEXT NOT NULL,
+    PRIMARY KEY (lot_id, spot_id)
+);
+CREATE INDEX IF NOT EXISTS occupancy_lot_version ON occupancy (lot_id, json_extract(doc, '$.version'));
+CREATE TABLE IF NOT EXISTS lot_status (lot_id TEXT PRIMARY KEY, doc TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS occupancy_hourly (
+    lot_id TEXT NOT NULL, hour TEXT NOT NULL, doc TEXT NOT NULL,
+    PRIMARY KEY (lot_id, hour)
+);
+"""
+
+
+def sqlite_schema_objects(conn):
+    """{name: sql} of the tables and indexes in a SQLite database"""
+    return dict(conn.execute("SELECT name, sql FROM sqlite_master WHERE name NOT LIKE 'sqlite_%'"))
+
+
+def sqlite_schema_for(schema):
+    """{name: sql} that a schema script creates, as SQLite stores it"""
+    conn = sqlite3.connect(":memory:")
+    try:
+        conn.executescript(schema)
+        return sqlite_schema_objects(conn)
+    finally:
+        conn.close()
+
+
+def sqlite_schema_drift(expected, actual):
+    """Names of the tables and indexes that differ between two {name: sql} schemas"""
+    return sorted(name for name in set(expected) | set(actual) if expected.get(name) != actual.get(name))
+
+
+def check_sqlite_schema(conn, path):
+    """
+    Raise if a SQLite file holds tables or indexes other than SQLITE_SCHEMA's
+    CREATE ... IF NOT EXISTS keeps whatever layout the file was created with,
+    so a file written by a detector with a drifted copy of the schema is
+    refused here instead of being read with the wrong layout.
+    """
+    drifted = sqlite_schema_drift(sqlite_schema_for(SQLITE_SCHEMA), sqlite_schema_objects(conn))
+    if drifted:
+        raise RuntimeError(f"SQLite file {path} does not match SQLITE_SCHEMA: {', '.join(drifted)}")
+
+
+class SQLiteStorage(Storage):
+    """Embedded SQLite storage in WAL mode; each document is stored as JSON next to its key columns"""
+
+    name = "sqlite"
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        # Every thread's connection (request threads, ThreadedAsyncStorage executor threads), for close()
+        self.connections = []
+        self.connections_lock = threading.Lock()
+        self.bootstrap()
+
+    @property
+    def conn(self):
+        # sqlite3 connections are per-thread; WAL lets readers run alongside the detector's writes
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            # Only its own thread uses it; check_same_thread=False lets close() run from another one
+            conn = sqlite3.connect(self.path, timeout=5.0, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            with self.connections_lock:
+                self.connections.append(conn)
+            self.local.conn = conn
+        return conn
+
+    def bootstrap(self):
+        self.conn.executescript(SQLITE_SCHEMA)
+        check_sqlite_schema(self.conn, self.path)
+
+    def _get(self, table, key_column, key):
+        row = self.conn.execute(f"SELECT doc FROM {table} WHERE {key_column} = ?", (key,)).fetchone()
+        return loads(row[0]) if row else None
+
+    def _upsert(self, table, firebase_id, fields, create):
+        with self.conn:
+            existing = self._get(table, "firebase_id", firebase_id)
+            if existing is None:
+                if not create:
+                    return False, False
+                doc = dict(fields, created_at=datetime.utcnow())
+                self.conn.execute(f"INSERT INTO {table} (firebase_id, doc) VALUES (?, ?)", (firebase_id, dumps(doc)))
+                return True, False
+
+            modified = any(existing.get(k) != v for k, v in fields.items())
+            existing.update(fields)
+            self.conn.execute(f"UPDATE {table} SET doc = ? WHERE firebase_id = ?", (dumps(existing), firebase_id))
+            return False, modified
+
+    def upsert_user(self, firebase_id, fields):
+        return self._upsert("users", firebase_id, fields, create=True)
+
+    def get_user(self, firebase_id):
+        return self._get("users", "firebase_id", firebase_id)
+
+    def list_users(self):
+        return [loads(row[0]) for row in self.conn.execute("SELECT doc FROM users")]
+
+    def list_users_with_preferences(self, after=None, limit=None):
+        rows = self.conn.execute(
+            "SELECT u.doc, p.doc FROM users u LEFT JOIN preferences p ON p.firebase_id = u.firebase_id "
+            "WHERE u.firebase_id > ? ORDER BY u.firebase_id LIMIT ?",
+            (after or "", limit if limit is not None else -1)
+        )
+        return [dict(loads(user), preferences=loads(preferences)) for user, preferences in rows]
+
+    def upsert_preferences(self, firebase_id, fields):
+        return self._upsert("preferences", firebase_id, fields, create=True)
+
+    def update_preferences(self, firebase_id, fields):
+        upserted, modified = self._upsert("preferences", firebase_id, fields, create=False)
+        matched = self._get("preferences", "firebase_id", firebase_id) is not None
+        return matched, modified
+
+    def get_preferences(self, firebase_id):
+        return self._get("preferences", "firebase_id", firebase_id)
+
+    def delete_preferences(self, firebase_id):
+        with self.conn:
+            return self.conn.execute("DELETE FROM preferences WHERE firebase_id = ?", (firebase_id,)).rowcount
+
+    def get_lot(self, lot_id):
+        return self._get("lots", "lot_id", lot_id)
+
+    def list_lots(self):
+        return [loads(row[0]) for row in self.conn.execute("SELECT doc FROM lots")]
+
+    def list_occupancy(self, lot_id):
+        rows = self.conn.execute("SELECT doc FROM occupancy WHERE lot_id = ?", (lot_id,))
+        return [loads(row[0]) for row in rows]
+
+    def list_occupancy_for_lots(self, lot_ids):
+        lot_ids = list(lot_ids)
+        placeholders = ", ".join("?" * len(lot_ids))
+        rows = self.conn.execute(
+            f"SELECT doc FROM occupancy WHERE lot_id IN ({placeholders}) ORDER BY lot_id, spot_id", lot_ids
+        )
+        return group_by_lot(loads(row[0]) for row in rows)
+
+    def list_occupancy_changes(self, lot_id, since_version=None, since_time=None):
+        if since_version is not None:
+            # Uses the occupancy_lot_version expression index
+            rows = self.conn.execute(
+                "SELECT doc FROM occupancy WHERE lot_id = ? AND json_extract(doc, '$.version') > ?",
+                (lot_id, since_version)
+            )
+        else:
+            rows = self.conn.execute(
+                "SELECT doc FROM occupancy WHERE lot_id = ? AND json_extract(doc, '$.last_updated.\"$date\"') > ?",
+                (lot_id, since_time.isoformat())
+            )
+        return [
+            {"spot_id": doc["spot_id"], "occupied": doc["occupied"], "version": doc.get("version", 0)}
+            for doc in map(loads, (row[0] for row in rows))
+        ]
+
+    def get_lot_version(self, lot_id):
+        row = self.conn.execute("SELECT doc FROM lot_status WHERE lot_id = ?", (lot_id,)).fetchone()
+        return loads(row[0]).get("version", 0) if row else 0
+
+    def get_lot_versions(self, lot_ids):
+        lot_ids = list(lot_ids)
+        placeholders = ", ".join("?" * len(lot_ids))
+        rows = self.conn.execute(
+            f"SELECT lot_id, json_extract(doc, '$.version') FROM lot_status WHERE lot_id IN ({placeholders})", lot_ids
+        )
+        return {lot_id: version or 0 for lot_id, version in rows}
+
+    def list_lot_summaries(self):
+        rows = self.conn.execute(
+            "SELECT doc FROM lot_status WHERE json_extract(doc, '$.total') IS NOT NULL ORDER BY lot_id"
+        )
+        return [
+            {field: doc.get(field) for field in LOT_SUMMARY_PROJECTION if field != "_id"}
+            for doc in map(loads, (row[0] for row in rows))
+        ]
+
+    def list_hourly_occupancy(self, lot_id, since):
+        rows = self.conn.execute(
+            "SELECT doc FROM occupancy_hourly WHERE lot_id = ? AND hour >= ? ORDER BY hour",
+            (lot_id, since.isoformat())
+        )
+        return [loads(row[0]) for row in rows]
+
+    def ping(self):
+        try:
+            self.conn.execute("SELECT 1")
+            return {"status": "connected", "storage": self.name, "path": self.path}
+        except Exception as e:
+            return {"status": "disconnected", "error": str(e)}
+
+    def close(self):
+        with self.connections_lock:
+            connections, self.connections = self.connections, []
+            # Threads that still hold a closed connection open a new one on their next query
+            self.local = threading.local()
+        for conn in connections:
+            conn.close()
+
+
+# ==================== FACTORY ====================
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def open_storage(url: str):
+    """
+    Open a storage backend from a URL:
+        mongodb://... or mongodb+srv://...  -> MongoStorage (shared client from database.database)
+        sqlite:///path/to/file.db           -> SQLiteStorage
+        memory://                           -> MemoryStorage
+    """
+    if url.startswith("sqlite:///"):
+        return SQLiteStorage(url[len("sqlite:///"):])
+    if url.startswith("memory://"):
+        return MemoryStorage()
+    if url.startswith("mongodb"):
+        from database.database import get_db
+        return MongoStorage(get_db(url), url)
+    raise ValueError(f"Unsupported storage URL: {url}")
+
+
+def get_storage() -> Storage:
+    """Return the process-wide storage selected by STORAGE_URL (default: MONGO_URI)"""
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                url = os.getenv("STORAGE_URL") or os.getenv("MONGO_URI") or "mongodb://localhost:27017/"
+                _storage = open_storage(url)
+    return _storage
+
+
+def set_storage(storage: Storage):
+    """Replace the process-wide storage (tests, benchmarks)"""
+    global _storage
+    _storage = storage
+
+
+def close_storage():
+    """Close and forget the process-wide storage (FastAPI shutdown)"""
+    global _storage
+    with _storage_lock:
+        if _storage is not None:
+            _storage.close()
+            _storage = None
+
+
+if __name__ == "__main__":
+    import ast
+    import sys
+
+    # server/storage.py is not importable from here (other dependencies): read its SQLITE_SCHEMA literal
+    server_storage = os.path.join(os.path.dirname(__file__), "..", "..", "server", "storage.py")
+    if "--check-schema" not in sys.argv:
+        sys.exit("usage: python -m database.storage --check-schema")
+    with open(server_storage) as f:
+        tree = ast.parse(f.read())
+    server_schema = next(
+        node.value.value for node in tree.body
+        if isinstance(node, ast.Assign) and any(getattr(t, "id", None) == "SQLITE_SCHEMA" for t in node.targets)
+    )
+    drifted = sqlite_schema_drift(sqlite_schema_for(SQLITE_SCHEMA), sqlite_schema_for(server_schema))
+    if drifted:
+        sys.exit(f"SQLITE_SCHEMA differs from {server_storage}: {', '.join(drifted)}")
+    print("SQLITE_SCHEMA matches server/storage.py")
@@ -1,9 +1,40 @@
+import logging
+import threading
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from routes.routes import router 
-from database.database import check_db_connection
+from database.storage import get_storage, close_storage
+from database.async_storage import close_async_storage
+from controller.occupancy_cache import version_watcher
+from controller.occupancy_stream import broadcaster
+
+
+def bootstrap_storage(storage):
+    """Create indexes/tables in the background so a slow or missing DB never delays startup"""
+    try:
+        storage.bootstrap()
+    except Exception as e:
+        logging.error(f"Storage bootstrap failed: {e}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Storage is chosen by STORAGE_URL (mongodb://, sqlite:///, memory://).
+    # The Mongo client is created lazily and does not wait for the server here.
+    storage = get_storage()
+    threading.Thread(target=bootstrap_storage, args=(storage,), name="storage-bootstrap", daemon=True).start()
+    version_watcher.start()
+    yield
+    version_watcher.stop()
+    broadcaster.close()
+    await close_async_storage()
+    close_storage()
+
+
 # Initialize FastAPI app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # CORS Configuration
 app.add_middleware(
@@ -16,5 +47,3 @@ app.add_middleware(
 
 # Register Routes
 app.include_router(router)
-
-check_db_connection()
\ No newline at end of file
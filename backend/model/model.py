@@ -54,6 +54,8 @@ class LotDefinition(BaseModel):
     lot_id: str = Field(..., description="Unique lot identifier")
     name: str = Field(..., description="Parking lot name")
     spots: List[Spot] = Field(..., description="Array of parking spots")
+    entrances: Optional[List[Coordinate]] = Field(None, description="Lot entrances (normalized), used to rank spots")
+    exits: Optional[List[Coordinate]] = Field(None, description="Lot exits (normalized), used to rank spots")
     image_width: Optional[int] = Field(None, description="Original image width")
     image_height: Optional[int] = Field(None, description="Original image height")
     created_at: Optional[datetime] = Field(None, description="Creation timestamp")
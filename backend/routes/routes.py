@@ -1,4 +1,7 @@
-from fastapi import APIRouter, Body, HTTPException, status, Path
+import asyncio
+
+from fastapi import APIRouter, Body, HTTPException, status, Path, Query, Header, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
 from controller.controller import (
     answer_questions,
     edit_questions,
@@ -7,13 +10,20 @@ from controller.controller import (
     get_user,
     get_user_with_preferences,
     delete_user_complete,
-    get_all_users,
+    get_users_page,
+    export_users,
     default_message,
+    check_readiness,
     get_lot_by_id,
     get_all_lots,
-    get_occupancy_by_lot_id
+    get_lot_summaries,
+    get_hourly_occupancy,
+    get_occupancy_changes
 )
-from database.database import check_db_connection
+from controller.occupancy_cache import occupancy_cache, etag_matches, batch_response, OCCUPANCY_BATCH_MAX_LOTS
+from controller.occupancy_compact import compact_encoder, negotiate
+from controller.occupancy_stream import broadcaster
+from controller.recommendations import get_recommendations, RANKINGS
 from model.model import UserPreferences
 router = APIRouter()
 
@@ -22,10 +32,18 @@ router = APIRouter()
 def default_msg():
     return default_message()
 
+# Readiness probe (the DB ping result is cached, so probes stay cheap)
+@router.get('/ready')
+async def ready():
+    result = await check_readiness()
+    if result.get("status") != "connected":
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=result)
+    return result
+
 # ==================== USER SYNC ENDPOINT ====================
 
 @router.post("/user/sync", status_code=status.HTTP_201_CREATED)
-def sync_user(payload: dict = Body(...)):
+async def sync_user(payload: dict = Body(...)):
     """
     POST - Save or update user info in MongoDB immediately after sign-up/sign-in
 
@@ -38,7 +56,7 @@ def sync_user(payload: dict = Body(...)):
     """
     from controller.controller import create_or_update_user
 
-    result = create_or_update_user(payload)
+    result = await create_or_update_user(payload)
 
     if result.get("status") == "error":
         raise HTTPException(
@@ -50,8 +68,8 @@ def sync_user(payload: dict = Body(...)):
 # ==================== SURVEY/QUESTIONS ENDPOINTS ====================
 
 @router.post("/questions/answer", status_code=201)
-def submit_survey(payload: UserPreferences):
-    result = answer_questions(payload)
+async def submit_survey(payload: UserPreferences):
+    result = await answer_questions(payload)
 
     if result["status"] == "error":
         raise HTTPException(status_code=400, detail=result["message"])
@@ -59,7 +77,7 @@ def submit_survey(payload: UserPreferences):
     return result
 
 @router.put("/questions/{firebase_id}", status_code=status.HTTP_200_OK)
-def update_survey(firebase_id: str, payload: dict = Body(...)):
+async def update_survey(firebase_id: str, payload: dict = Body(...)):
     """
     PUT - Edit/Update survey answers
     
@@ -71,7 +89,7 @@ def update_survey(firebase_id: str, payload: dict = Body(...)):
         "q5": ["EV charging spot"]
     }
     """
-    result = edit_questions(firebase_id, payload)
+    result = await edit_questions(firebase_id, payload)
     
     if result.get("status") == "error":
         raise HTTPException(
@@ -83,11 +101,11 @@ def update_survey(firebase_id: str, payload: dict = Body(...)):
 
 
 @router.get("/questions/{firebase_id}", status_code=status.HTTP_200_OK)
-def get_survey_answers(firebase_id: str):
+async def get_survey_answers(firebase_id: str):
     """
     GET - Get user's survey answers
     """
-    result = get_questions(firebase_id)
+    result = await get_questions(firebase_id)
     
     if result.get("status") == "error":
         raise HTTPException(
@@ -99,13 +117,13 @@ def get_survey_answers(firebase_id: str):
 
 
 @router.delete("/questions/{firebase_id}", status_code=status.HTTP_200_OK)
-def delete_survey_answers(firebase_id: str):
+async def delete_survey_answers(firebase_id: str):
     """
     DELETE - Delete survey answers
     
     Keeps user profile intact
     """
-    result = delete_questions(firebase_id)
+    result = await delete_questions(firebase_id)
     
     if result.get("status") == "error":
         raise HTTPException(
@@ -119,11 +137,11 @@ def delete_survey_answers(firebase_id: str):
 # ==================== USER ENDPOINTS ====================
 
 @router.get("/user/{firebase_id}", status_code=status.HTTP_200_OK)
-def get_user_profile(firebase_id: str):
+async def get_user_profile(firebase_id: str):
     """
     GET - Get user profile (basic info only)
     """
-    result = get_user(firebase_id)
+    result = await get_user(firebase_id)
     
     if result.get("status") == "error":
         raise HTTPException(
@@ -135,11 +153,11 @@ def get_user_profile(firebase_id: str):
 
 #We may not meed this, but just in case
 @router.get("/user/{firebase_id}/complete", status_code=status.HTTP_200_OK)
-def get_complete_user_data(firebase_id: str):
+async def get_complete_user_data(firebase_id: str):
     """
     GET - Get user profile + user preferences answers combined
     """
-    result = get_user_with_preferences(firebase_id)
+    result = await get_user_with_preferences(firebase_id)
     
     if result.get("status") == "error":
         raise HTTPException(
@@ -151,11 +169,11 @@ def get_complete_user_data(firebase_id: str):
 
 
 @router.delete("/user/{firebase_id}/complete", status_code=status.HTTP_200_OK)
-def delete_complete_user_data(firebase_id: str):
+async def delete_complete_user_data(firebase_id: str):
     """
     DELETE - Delete user profile AND user preferences answers
     """
-    result = delete_user_complete(firebase_id)
+    result = await delete_user_complete(firebase_id)
     
     if result.get("status") == "error":
         raise HTTPException(
@@ -167,17 +185,61 @@ def delete_complete_user_data(firebase_id: str):
 
 
 @router.get("/users", status_code=status.HTTP_200_OK)
-def list_all_users():
+async def list_all_users(
+    limit: int = Query(None, ge=1, le=1000, description="Page size; omit to export every user as NDJSON"),
+    cursor: str = Query(None, description="next_cursor from the previous page")
+):
     """
-    GET - Get all users with their preference answers (admin endpoint)
+    GET - Get users with their preference answers (admin endpoint)
+    
+    Examples:
+        /users?limit=100                      -> first page
+        /users?limit=100&cursor=<next_cursor> -> next page
+        /users                                -> every user, one JSON object per line
+    
+    Returns (paginated):
+    {
+        "status": "success",
+        "count": 100,
+        "users": [...],
+        "next_cursor": "firebase-id-of-last-user"   # null on the last page
+    }
     """
-    return get_all_users()
+    if limit is None:
+        return StreamingResponse(export_users(), media_type="application/x-ndjson")
+    return await get_users_page(limit, cursor)
 
 
 # ==================== PARKING LOT ENDPOINTS ====================
 
+# Declared before /lots/{lot_id} so "summary" is not taken for a lot id
+@router.get("/lots/summary", status_code=status.HTTP_200_OK)
+async def lots_summary():
+    """
+    GET - Occupancy counters of every lot, one cheap read per lot
+    
+    Returns:
+    {
+        "status": "success",
+        "count": 1,
+        "lots": [
+            {
+                "lot_id": "lot1",
+                "name": "Mac Parking",
+                "total": 40,
+                "occupied": 12,
+                "free": 28,
+                "by_type": {"standard": {"total": 40, "occupied": 12, "free": 28}},
+                "updated_at": "2026-02-08T13:11:34.025000"
+            }
+        ]
+    }
+    """
+    return await get_lot_summaries()
+
+
 @router.get("/lots/{lot_id}", status_code=status.HTTP_200_OK)
-def get_lot(lot_id: str = Path(..., description="Parking lot ID")):
+async def get_lot(lot_id: str = Path(..., description="Parking lot ID")):
     """
     GET - Fetch parking lot definition by lot_id
     
@@ -195,7 +257,7 @@ def get_lot(lot_id: str = Path(..., description="Parking lot ID")):
         }
     }
     """
-    result = get_lot_by_id(lot_id)
+    result = await get_lot_by_id(lot_id)
     
     if result.get("status") == "error":
         raise HTTPException(
@@ -207,7 +269,7 @@ def get_lot(lot_id: str = Path(..., description="Parking lot ID")):
 
 
 @router.get("/lots", status_code=status.HTTP_200_OK)
-def list_all_lots():
+async def list_all_lots():
     """
     GET - Get all parking lots (admin endpoint)
     
@@ -218,20 +280,74 @@ def list_all_lots():
         "lots": [...]
     }
     """
-    return get_all_lots()
+    return await get_all_lots()
+
+
+@router.get("/occupancy", status_code=status.HTTP_200_OK)
+async def get_occupancy_batch(
+    lot_ids: list[str] = Query(..., description="Lot IDs, comma-separated and/or repeated"),
+    if_none_match: str = Header(None)
+):
+    """
+    GET - Fetch occupancy states of several lots in one request
+    
+    Example: /occupancy?lot_ids=lot1,lot2
+    
+    Lots whose snapshot is cached are served from it; the rest are read with one query.
+    Each lot's entry is exactly what GET /occupancy/{lot_id} would return.
+    
+    Returns:
+    {
+        "status": "success",
+        "count": 2,
+        "lots": {
+            "lot1": {"status": "success", "count": 19, "version": 42, "occupancies": [...]},
+            "lot2": {"status": "error", "message": "No occupancy data found for lot 'lot2'"}
+        }
+    }
+    """
+    requested = list(dict.fromkeys(
+        lot_id.strip() for value in lot_ids for lot_id in value.split(",") if lot_id.strip()
+    ))
+    if not requested or len(requested) > OCCUPANCY_BATCH_MAX_LOTS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"lot_ids must name between 1 and {OCCUPANCY_BATCH_MAX_LOTS} lots"
+        )
+    
+    body, etag = batch_response(await occupancy_cache.get_many(requested))
+    
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
 
 
 @router.get("/occupancy/{lot_id}", status_code=status.HTTP_200_OK)
-def get_occupancy(lot_id: str = Path(..., description="Parking lot ID")):
+async def get_occupancy(
+    lot_id: str = Path(..., description="Parking lot ID"),
+    since: str = Query(None, description="Only spots changed after this lot version or ISO timestamp"),
+    offsets: bool = Query(False, description="Compact encodings only: include last-change offsets"),
+    if_none_match: str = Header(None),
+    accept: str = Header(None)
+):
     """
     GET - Fetch occupancy states for all spots in a lot
     
     Example: /occupancy/lot1
     
+    Compact encodings (Accept: application/vnd.mac-a-park.bitset+json, or
+    application/x-msgpack when msgpack is installed) answer with
+    {"v": lot version (?since= cursor), "n": spots, "l": layout id, "b": bitset} where bit i
+    (MSB first) is spots[i] of GET /lots/{lot_id}; "b" is base64 in JSON.
+    With ?offsets=true they add "t" (newest change, epoch seconds) and "o"
+    (seconds before "t" each spot last changed).
+    
     Returns:
     {
         "status": "success",
         "count": 19,
+        "version": 42,
         "occupancies": [
             {
                 "spot_id": "0",
@@ -244,7 +360,76 @@ def get_occupancy(lot_id: str = Path(..., description="Parking lot ID")):
         ]
     }
     """
-    result = get_occupancy_by_lot_id(lot_id)
+    if since is not None:
+        # Delta: /occupancy/lot1?since=42 -> {"status": "success", "version": 45, "changes": [{"spot_id": "3", "occupied": true}]}
+        result = await get_occupancy_changes(lot_id, since)
+        if result.get("status") == "error":
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=result.get("message")
+            )
+        return result
+    
+    snapshot = await occupancy_cache.get(lot_id)
+    
+    if not snapshot.found:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"No occupancy data found for lot '{lot_id}'"
+        )
+    
+    # Served from the per-lot snapshot cache; pollers holding the current ETag get an empty 304
+    body, etag, media_type = snapshot.body, snapshot.etag, "application/json"
+    compact_type = negotiate(accept)
+    if compact_type is not None:
+        # Lots without a definition have no bit order: fall back to JSON
+        compact = await compact_encoder.get(snapshot, compact_type, offsets)
+        if compact is not None:
+            (body, etag), media_type = compact, compact_type
+    
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept"}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=body, media_type=media_type, headers=headers)
+
+
+@router.get("/recommendations/{lot_id}", status_code=status.HTTP_200_OK)
+async def recommend_spots(
+    lot_id: str = Path(..., description="Parking lot ID"),
+    firebase_id: str = Query(None, description="Use this user's survey answers (q3 ranking, q5 spot types)"),
+    ranking: str = Query(None, description="Override: entrance, exit or area"),
+    types: str = Query(None, description="Override: comma-separated spot types, e.g. ev,accessible"),
+    limit: int = Query(5, ge=1, le=50)
+):
+    """
+    GET - Best free spots of a lot for a user's preferences
+    
+    Example: /recommendations/lot1?firebase_id=abc123
+    
+    Returns:
+    {
+        "status": "success",
+        "lot_id": "lot1",
+        "ranked_by": "entrance",
+        "types": ["ev"],
+        "version": 7,
+        "count": 2,
+        "spots": [
+            {"spot_id": "12", "type": "ev", "matches_preferences": true},
+            {"spot_id": "3", "type": "standard", "matches_preferences": false}
+        ]
+    }
+    
+    ranked_by is "order" (definition order) when the lot has no entrances/exits.
+    """
+    if ranking is not None and ranking not in RANKINGS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"ranking must be one of {', '.join(RANKINGS)}"
+        )
+    spot_types = None if types is None else [t.strip() for t in types.split(",") if t.strip()]
+    
+    result = await get_recommendations(lot_id, firebase_id, ranking, spot_types, limit)
     
     if result.get("status") == "error":
         raise HTTPException(
@@ -255,3 +440,81 @@ def get_occupancy(lot_id: str = Path(..., description="Parking lot ID")):
     return result
 
 
+@router.get("/occupancy/{lot_id}/hourly", status_code=status.HTTP_200_OK)
+async def get_occupancy_hourly(
+    lot_id: str = Path(..., description="Parking lot ID"),
+    days: int = Query(30, ge=1, le=366, description="Number of days to look back")
+):
+    """
+    GET - Occupancy rate by hour for a lot, from the precomputed hourly rollups
+    
+    Example: /occupancy/lot1/hourly?days=30
+    
+    Returns:
+    {
+        "status": "success",
+        "lot_id": "lot1",
+        "days": 30,
+        "hours": [
+            {"hour": "2026-02-08T12:00:00", "occupancy_rate": 0.42, "arrivals": 7},
+            ...
+        ],
+        "by_hour_of_day": [
+            {"hour": 0, "occupancy_rate": 0.05},
+            ...
+        ]
+    }
+    """
+    result = await get_hourly_occupancy(lot_id, days)
+    
+    if result.get("status") == "error":
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=result.get("message")
+        )
+    
+    return result
+
+
+# ==================== LIVE OCCUPANCY ====================
+
+@router.websocket("/ws/occupancy/{lot_id}")
+async def occupancy_socket(websocket: WebSocket, lot_id: str):
+    """
+    WebSocket - Live spot changes for a lot
+    
+    Example: ws://host/ws/occupancy/lot1
+    
+    Server messages:
+        {"type": "snapshot", "lot_id": "lot1", "spots": [{"spot_id": "0", "occupied": true}, ...], "ts": "..."}
+        {"type": "spot_update", "lot_id": "lot1", "spot_id": "0", "occupied": false, "ts": "..."}
+    Client messages:
+        {"type": "get_snapshot"}
+    
+    All sockets of a lot share one storage watcher, so viewers add no database load.
+    """
+    await websocket.accept()
+    feed, queue = broadcaster.subscribe(lot_id)
+
+    async def send():
+        await asyncio.get_running_loop().run_in_executor(None, feed.ready.wait, 5.0)
+        await websocket.send_json(feed.snapshot())
+        while True:
+            await websocket.send_json(await queue.get())
+
+    async def receive():
+        while True:
+            message = await websocket.receive_json()
+            if isinstance(message, dict) and message.get("type") == "get_snapshot":
+                feed.deliver(queue, feed.snapshot())
+
+    tasks = [asyncio.create_task(send()), asyncio.create_task(receive())]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if not task.cancelled() and task.exception() and not isinstance(task.exception(), WebSocketDisconnect):
+                raise task.exception()
+    finally:
+        for task in tasks:
+            task.cancel()
+        feed.unsubscribe(queue)
@@ -23,19 +23,24 @@ export function ParkingProvider({ children }: { children: React.ReactNode }) {
   console.log(API_BASE_URL)
   // Load settings from localStorage on mount and fetch lot from backend
   useEffect(() => {
+    // Live updates are pushed over the backend's WebSocket (ws[s]://<api>/ws/occupancy/<lot_id>)
+    const defaultWsUrl = API_BASE_URL
+      ? `${API_BASE_URL.replace(/^http/, "ws")}/ws/occupancy/lot1`
+      : "";
     let settings: ParkingSettings = {
       restBaseUrl: `${API_BASE_URL}`,
-      wsUrl: "",
+      wsUrl: defaultWsUrl,
     };
     try {
       const saved = localStorage.getItem("parking-settings");
       if (saved) {
         settings = JSON.parse(saved);
-        dispatch({ type: "SET_SETTINGS", settings });
+        settings.wsUrl = settings.wsUrl || defaultWsUrl;
       }
     } catch {
       // Use defaults
     }
+    dispatch({ type: "SET_SETTINGS", settings });
 
     // Fetch lot from backend with lot_id="lot1"
     const lotId = "lot1";
@@ -60,8 +65,11 @@ export function ParkingProvider({ children }: { children: React.ReactNode }) {
     }
   }, []);
 
-  // Fetch and poll occupancy data
+  // Fetch and poll occupancy data, only while the live WebSocket is not connected
+  const live = state.connectionState === "connected";
   useEffect(() => {
+    if (live) return;
+
     const lotId = "lot1";
     const baseUrl = `${API_BASE_URL}`;
 
@@ -90,7 +98,7 @@ export function ParkingProvider({ children }: { children: React.ReactNode }) {
     const intervalId = setInterval(fetchOccupancy, 3000);
 
     return () => clearInterval(intervalId);
-  }, []);
+  }, [live]);
 
   return (
     <ParkingContext.Provider value={{ state, dispatch }}>
@@ -0,0 +1,83 @@
+import logging
+import queue
+import threading
+
+import cv2 as open_cv
+import numpy as np
+
+from drawing_utils import draw_contours
+from colors import COLOR_BLUE, COLOR_GREEN, COLOR_WHITE
+
+
+class AnnotatedWriter:
+    """Background worker that draws spot overlays and encodes them to a video file.
+
+    The detection loop hands over frames with `submit()`, which never blocks:
+    only every `every_n`-th frame is accepted, and frames are dropped when the
+    worker falls behind. The worker draws directly onto the submitted frame,
+    so the hot loop must not reuse it afterwards (VideoCapture.read returns a
+    fresh array per call) and no per-frame copy is needed.
+    """
+
+    def __init__(self, path, coordinates, fps=10.0, every_n=5, queue_size=4, fourcc="mp4v"):
+        """
+        Args:
+            path: Output video file
+            coordinates: Spot definitions ({"id", "coordinates"}) to draw
+            fps: Frame rate of the source; the output runs at fps / every_n
+            every_n: Annotate one frame out of every_n submitted
+            queue_size: Frames buffered before new ones are dropped
+            fourcc: Four-character codec code for cv2.VideoWriter
+        """
+        self.path = path
+        self.coordinates = [(np.array(p["coordinates"]), str(p["id"] + 1)) for p in coordinates]
+        self.every_n = max(int(every_n), 1)
+        self.fps = max(float(fps or 0) / self.every_n, 1.0)
+        self.fourcc = fourcc
+        self.writer = None
+        self.submitted = 0
+        self.written = 0
+        self.dropped = 0
+
+        self.queue = queue.Queue(maxsize=max(int(queue_size), 1))
+        self.thread = threading.Thread(target=self._run, name="annotated-writer", daemon=True)
+        self.thread.start()
+
+    def submit(self, frame, statuses):
+        """Queue a frame for annotation if it falls on the sampling rate; never blocks."""
+        self.submitted += 1
+        if (self.submitted - 1) % self.every_n:
+            return
+        try:
+            self.queue.put_nowait((frame, list(statuses)))
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+
+            frame, statuses = item
+            try:
+                for (coords, label), occupied in zip(self.coordinates, statuses):
+                    border = COLOR_BLUE if occupied else COLOR_GREEN
+                    draw_contours(frame, coords, label, COLOR_WHITE, border)
+
+                if self.writer is None:
+                    height, width = frame.shape[:2]
+                    self.writer = open_cv.VideoWriter(
+                        self.path, open_cv.VideoWriter_fourcc(*self.fourcc), self.fps, (width, height))
+                self.writer.write(frame)
+                self.written += 1
+            except Exception as e:
+                logging.error(f"Failed to write annotated frame: {e}")
+
+    def close(self):
+        """Flush queued frames and release the video file."""
+        self.queue.put(None)
+        self.thread.join()
+        if self.writer is not None:
+            self.writer.release()
+        logging.info(f"Annotated output: {self.path} | written {self.written} | dropped {self.dropped}")
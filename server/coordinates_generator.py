@@ -6,9 +6,9 @@ from colors import COLOR_WHITE
 from drawing_utils import draw_contours
 
 try:
-    from mongo_db import ParkingDB
+    from storage import open_parking_db
 except ImportError:
-    ParkingDB = None
+    open_parking_db = None
 
 
 class CoordinatesGenerator:
@@ -25,13 +25,13 @@ class CoordinatesGenerator:
         self.db = None
         
         if use_db:
-            if ParkingDB is None:
-                logging.warning("MongoDB integration not available. Install pymongo.")
+            if open_parking_db is None:
+                logging.warning("Database integration not available. Install pymongo.")
             else:
                 try:
-                    self.db = ParkingDB(connection_string=mongo_uri or "mongodb://localhost:27017/")
+                    self.db = open_parking_db(mongo_uri)
                 except Exception as e:
-                    logging.error(f"Failed to connect to MongoDB: {e}")
+                    logging.error(f"Failed to open parking store: {e}")
                     self.db = None
 
         self.image = open_cv.imread(image).copy()
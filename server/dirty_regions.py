@@ -0,0 +1,116 @@
+import time
+
+import cv2 as open_cv
+import numpy as np
+
+
+class DirtySpotTracker:
+    """Tracks which spot rects changed since they were last evaluated.
+
+    A downscaled grayscale reference frame is kept per camera. Each new frame
+    is differenced against it inside the spot rects only (one integral image
+    of the thresholded difference), and spots whose changed-pixel fraction
+    reaches `min_changed` are reported dirty. The reference is refreshed for
+    dirty spots only, so slow drift in untouched spots keeps accumulating
+    until it crosses the threshold. Spots whose evaluation was lost after
+    their reference moved on (see invalidate()) are reported dirty again on
+    the next update.
+    """
+
+    def __init__(self, bounds, scale=0.25, pixel_threshold=25, min_changed=0.02,
+                 refresh_interval=30.0, crop_margin=0.5):
+        """
+        Args:
+            bounds: List of (x, y, w, h) spot bounding rects in frame space
+            scale: Downscale factor applied before differencing
+            pixel_threshold: Gray-level difference that counts a pixel as changed
+            min_changed: Fraction of a spot rect that must change to mark it dirty
+            refresh_interval: Seconds after which every spot is re-evaluated
+            crop_margin: Padding around each dirty rect, as a fraction of its size
+        """
+        self.rects = np.asarray(bounds, dtype=np.int64).reshape(-1, 4)
+        self.scale = float(scale)
+        self.pixel_threshold = int(pixel_threshold)
+        self.min_changed = float(min_changed)
+        self.refresh_interval = float(refresh_interval)
+        self.crop_margin = float(crop_margin)
+
+        scaled = self.rects.astype(np.float64) * self.scale
+        self.x1 = np.floor(scaled[:, 0]).astype(np.int64)
+        self.y1 = np.floor(scaled[:, 1]).astype(np.int64)
+        self.x2 = np.ceil(scaled[:, 0] + scaled[:, 2]).astype(np.int64)
+        self.y2 = np.ceil(scaled[:, 1] + scaled[:, 3]).astype(np.int64)
+
+        self.reference = None
+        self.last_refresh = None
+        self.pending = np.zeros(len(self.rects), dtype=bool)
+
+    def _small_gray(self, frame):
+        small = open_cv.resize(frame, None, fx=self.scale, fy=self.scale, interpolation=open_cv.INTER_AREA)
+        if small.ndim == 3:
+            small = open_cv.cvtColor(small, open_cv.COLOR_BGR2GRAY)
+        return small
+
+    def update(self, frame):
+        """Return a boolean array of spots that changed, and fold them into the reference."""
+        gray = self._small_gray(frame)
+        now = time.monotonic()
+        count = len(self.rects)
+
+        if (self.reference is None or self.reference.shape != gray.shape
+                or now - self.last_refresh >= self.refresh_interval):
+            self.reference = gray
+            self.last_refresh = now
+            self.pending[:] = False
+            return np.ones(count, dtype=bool)
+
+        h, w = gray.shape
+        x1 = np.clip(self.x1, 0, w); x2 = np.clip(self.x2, 0, w)
+        y1 = np.clip(self.y1, 0, h); y2 = np.clip(self.y2, 0, h)
+
+        changed = open_cv.absdiff(gray, self.reference) > self.pixel_threshold
+        table = open_cv.integral(changed.astype(np.uint8))
+        counts = table[y2, x2] - table[y1, x2] - table[y2, x1] + table[y1, x1]
+        areas = np.maximum((x2 - x1) * (y2 - y1), 1)
+        dirty = counts / areas >= self.min_changed
+
+        for index in np.flatnonzero(dirty):
+            self.reference[y1[index]:y2[index], x1[index]:x2[index]] = \
+                gray[y1[index]:y2[index], x1[index]:x2[index]]
+
+        dirty |= self.pending
+        self.pending[:] = False
+        return dirty
+
+    def invalidate(self, spots=None):
+        """
+        Re-evaluate spots on the next update although their pixels already match the reference.
+
+        Call it when the result planned for them never reached post-processing
+        (e.g. a dropped pipeline output).
+
+        Args:
+            spots: Boolean mask of spots, or None for all spots
+        """
+        if spots is None:
+            self.pending[:] = True
+        else:
+            self.pending |= spots
+
+    def crop_for(self, dirty, frame_shape):
+        """
+        Return the padded frame-space crop (x1, y1, x2, y2) that covers all dirty spots.
+
+        Args:
+            dirty: Boolean array from update()
+            frame_shape: Shape of the full-resolution frame
+        """
+        rects = self.rects[dirty]
+        pad_x = (rects[:, 2] * self.crop_margin).astype(np.int64)
+        pad_y = (rects[:, 3] * self.crop_margin).astype(np.int64)
+        h, w = frame_shape[:2]
+        x1 = int(max((rects[:, 0] - pad_x).min(), 0))
+        y1 = int(max((rects[:, 1] - pad_y).min(), 0))
+        x2 = int(min((rects[:, 0] + rects[:, 2] + pad_x).max(), w))
+        y2 = int(min((rects[:, 1] + rects[:, 3] + pad_y).max(), h))
+        return (x1, y1, x2, y2)
@@ -0,0 +1,87 @@
+import numpy as np
+
+
+class SpotHysteresis:
+    """Per-spot occupancy state machine that suppresses flapping.
+
+    Recent overlap values are kept in a (spots, window) float32 ring buffer
+    with one write position per spot, so spots evaluated on different frames
+    (dirty regions) each dwell on their own samples.
+    A free spot only becomes occupied once its last `min_dwell` overlaps are
+    all >= `enter_threshold`, and an occupied spot only becomes free once its
+    last `min_dwell` overlaps are all < `exit_threshold`. Keeping the exit
+    threshold below the enter threshold adds a dead band, so a pedestrian
+    briefly occluding a parked car does not cause a commit.
+    Spots start unknown and are held to the same dwell: a first state is
+    only committed once a spot's last `min_dwell` overlaps all fall on the
+    same side of `enter_threshold`.
+    """
+
+    def __init__(self, count, enter_threshold=0.2, exit_threshold=0.15, min_dwell=5, window=None):
+        """
+        Args:
+            count: Number of spots
+            enter_threshold: Overlap at or above which a free spot may become occupied
+            exit_threshold: Overlap below which an occupied spot may become free
+            min_dwell: Consecutive evaluated frames a new state must hold before it is committed
+            window: Ring buffer length (defaults to min_dwell)
+        """
+        if exit_threshold > enter_threshold:
+            raise ValueError("exit_threshold must not be greater than enter_threshold")
+
+        self.enter_threshold = float(enter_threshold)
+        self.exit_threshold = float(exit_threshold)
+        self.min_dwell = max(int(min_dwell), 1)
+        self.window = max(int(window or self.min_dwell), self.min_dwell)
+
+        self.buffer = np.zeros((count, self.window), dtype=np.float32)
+        self.heads = np.zeros(count, dtype=np.int64)
+        self.filled = np.zeros(count, dtype=np.int64)
+        self.state = np.zeros(count, dtype=bool)
+        self.known = np.zeros(count, dtype=bool)
+
+    def update(self, overlaps, spots=None):
+        """
+        Push one evaluated frame of per-spot overlaps and return the committed states.
+
+        Only frames that were actually evaluated may be pushed: a skipped frame
+        carries stale overlaps and must not count towards `min_dwell`.
+
+        Args:
+            overlaps: Per-spot overlap values
+            spots: Optional boolean mask of the spots this frame evaluated; the
+                others get no sample and keep their state
+
+        Returns:
+            Object array of committed states: True/False, or None for spots
+            that have not dwelled `min_dwell` samples on a first state yet
+        """
+        overlaps = np.asarray(overlaps, dtype=np.float32)
+        index = np.arange(len(self.state)) if spots is None else np.flatnonzero(spots)
+        if not len(index):
+            return self.committed()
+
+        self.buffer[index, self.heads[index]] = overlaps[index]
+        self.heads[index] = (self.heads[index] + 1) % self.window
+        self.filled[index] = np.minimum(self.filled[index] + 1, self.window)
+
+        ready = index[self.filled[index] >= self.min_dwell]
+        if len(ready):
+            columns = (self.heads[ready, None] - 1 - np.arange(self.min_dwell)) % self.window
+            recent = self.buffer[ready[:, None], columns]
+            known = self.known[ready]
+            above = (recent >= self.enter_threshold).all(axis=1)
+            enter = ready[~self.state[ready] & above]
+            leave = ready[known & self.state[ready] & (recent < self.exit_threshold).all(axis=1)]
+            # Unknown spots settle on either side of enter_threshold
+            settle = ready[~known & (above | (recent < self.enter_threshold).all(axis=1))]
+            self.state[enter] = True
+            self.state[leave] = False
+            self.known[settle] = True
+        return self.committed()
+
+    def committed(self):
+        """Committed states as an object array, None where a spot is still unknown."""
+        states = self.state.astype(object)
+        states[~self.known] = None
+        return states
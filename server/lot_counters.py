@@ -0,0 +1,209 @@
+from datetime import datetime
+import logging
+import threading
+
+from pymongo import ReturnDocument
+
+
+def spot_types(lot):
+    """Map spot_id -> spot type for a lot definition (None -> {})."""
+    return {spot["spot_id"]: spot.get("type", "standard") for spot in (lot or {}).get("spots", [])}
+
+
+def absolute_counts(types, occupied_spots):
+    """
+    Full counter fields for a lot, as dotted paths.
+
+    Args:
+        types: Mapping spot_id -> spot type
+        occupied_spots: Collection of currently occupied spot ids
+    """
+    fields = {}
+    for spot_type in ("",) + tuple(f"by_type.{t}." for t in set(types.values())):
+        fields.update({f"{spot_type}total": 0, f"{spot_type}occupied": 0, f"{spot_type}free": 0})
+    for spot_id, spot_type in types.items():
+        state = "occupied" if spot_id in occupied_spots else "free"
+        for prefix in ("", f"by_type.{spot_type}."):
+            fields[f"{prefix}total"] += 1
+            fields[f"{prefix}{state}"] += 1
+    return fields
+
+
+def counter_deltas(types, changes, occupied_before):
+    """
+    `$inc` fields for a batch of status changes.
+
+    Only real transitions count: a spot reported occupied that was already
+    occupied (or free that was already free) contributes nothing. Spots that
+    are not part of the lot definition are ignored.
+    """
+    deltas = {}
+    for spot_id, occupied in changes.items():
+        if spot_id not in types or occupied == (spot_id in occupied_before):
+            continue
+        step = 1 if occupied else -1
+        for prefix in ("", f"by_type.{types[spot_id]}."):
+            deltas[f"{prefix}occupied"] = deltas.get(f"{prefix}occupied", 0) + step
+            deltas[f"{prefix}free"] = deltas.get(f"{prefix}free", 0) - step
+    return {field: value for field, value in deltas.items() if value}
+
+
+def apply_fields(doc, fields, increment=False):
+    """Apply dotted-path counter fields to a plain dict (embedded stores)."""
+    for path, value in fields.items():
+        *parents, leaf = path.split(".")
+        target = doc
+        for key in parents:
+            target = target.setdefault(key, {})
+        target[leaf] = target.get(leaf, 0) + value if increment else value
+    return doc
+
+
+def count_batch(status, types, changes, occupied_before, load_occupied):
+    """
+    Update the counters of a plain lot-status dict in place (embedded stores).
+
+    Increments when the document already carries counters for the current
+    definition, otherwise recomputes them from the stored state after the
+    batch (`load_occupied()` -> occupied spot ids).
+    """
+    if "occupied" in status and status.get("total") == len(types):
+        return apply_fields(status, counter_deltas(types, changes, occupied_before), increment=True)
+    status.pop("by_type", None)
+    return apply_fields(status, absolute_counts(types, load_occupied()))
+
+
+class LotCounters:
+    """Per-lot occupancy counters kept in the `lot-status` collection.
+
+    Each lot document holds `total`, `occupied`, `free` and the same three
+    counts per spot type under `by_type`. Status batches only `$inc` the
+    fields of spots that actually changed state, in the same update that
+    advances the lot's version, so several writers can share a lot-status
+    document. The first batch for a lot in a process instead `$set`s the
+    counts computed from the stored occupancy state once it is written, so
+    the counters re-baseline themselves after a restart or a lost update.
+    Saving a lot definition bumps the document's `layout`; a batch whose
+    update returns a `layout` other than the one the cached spot types were
+    loaded with reloads them and re-baselines the lot.
+    """
+
+    def __init__(self, lot_definitions, lot_status, occupancy_status):
+        """
+        Args:
+            lot_definitions: Collection with lot definitions (for spot types)
+            lot_status: Collection holding one counter document per lot
+            occupancy_status: Collection with the current state per spot
+        """
+        self.lot_definitions = lot_definitions
+        self.lot_status = lot_status
+        self.occupancy_status = occupancy_status
+        # Shared by every publisher thread of the process
+        self.lock = threading.Lock()
+        self.types = {}
+        # lot_id -> lot-status `layout` the cached spot types belong to
+        self.layouts = {}
+        self.baselined = set()
+
+    def _types(self, lot_id):
+        types = self.types.get(lot_id)
+        if types is None:
+            types = spot_types(
+                self.lot_definitions.find_one({"lot_id": lot_id}, {"spots.spot_id": 1, "spots.type": 1})
+            )
+            with self.lock:
+                types = self.types.setdefault(lot_id, types)
+        return types
+
+    def _occupied(self, lot_id):
+        return {
+            doc["spot_id"]
+            for doc in self.occupancy_status.find({"lot_id": lot_id, "occupied": True}, {"spot_id": 1})
+        }
+
+    def reset(self, lot_definition):
+        """Re-baseline a lot from the stored state after its definition was saved."""
+        lot_id = lot_definition["lot_id"]
+        types = spot_types(lot_definition)
+        with self.lock:
+            self.types[lot_id] = types
+        status = self._write(lot_id, {
+            "$set": dict(
+                apply_fields({}, absolute_counts(types, self._occupied(lot_id))),
+                name=lot_definition.get("name"),
+                updated_at=datetime.utcnow()
+            ),
+            "$inc": {"layout": 1}
+        })
+        if status is not None:
+            with self.lock:
+                self.layouts[lot_id] = status.get("layout")
+
+    def check_layout(self, lot_id, layout):
+        """
+        Compare the `layout` a batch's lot-status update returned with the cached spot types.
+
+        Returns:
+            True when the lot definition was saved since the types were loaded
+            (or they were never checked): the types are dropped and the lot
+            is re-baselined by the batch's rebaseline() call
+        """
+        with self.lock:
+            if lot_id in self.layouts and self.layouts[lot_id] == layout:
+                return False
+            self.layouts[lot_id] = layout
+            self.types.pop(lot_id, None)
+            self.baselined.discard(lot_id)
+        return True
+
+    def deltas(self, lot_id, changes, occupied_before):
+        """
+        `$inc` counter fields for a batch, applied by the batch's own lot-status update.
+
+        Args:
+            lot_id: Parking lot identifier
+            changes: Mapping spot_id -> occupied about to be written
+            occupied_before: Spot ids of the batch that were occupied before it
+
+        Returns:
+            The fields ({} when nothing flipped), or None when the lot must be
+            re-baselined with rebaseline() once the batch is written
+        """
+        types = self._types(lot_id)
+        if not types:
+            return {}
+        with self.lock:
+            baselined = lot_id in self.baselined
+        return counter_deltas(types, changes, occupied_before) if baselined else None
+
+    def rebaseline(self, lot_id):
+        """Set a lot's counters from the stored occupancy state, unless they are baselined already."""
+        with self.lock:
+            if lot_id in self.baselined:
+                return
+        types = self._types(lot_id)
+        if not types:
+            return
+        # Nested `by_type` replaces whatever types an older definition left behind
+        counts = apply_fields({}, absolute_counts(types, self._occupied(lot_id)))
+        self._write(lot_id, {"$set": dict(counts, updated_at=datetime.utcnow())})
+
+    def failed(self, lot_id):
+        """A batch update carrying deltas failed: re-baseline on the next batch."""
+        with self.lock:
+            self.baselined.discard(lot_id)
+
+    def _write(self, lot_id, update):
+        try:
+            status = self.lot_status.find_one_and_update(
+                {"lot_id": lot_id}, update, projection={"layout": 1}, upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+            with self.lock:
+                self.baselined.add(lot_id)
+            return status
+        except Exception as e:
+            # Next batch re-baselines from the current state instead of incrementing
+            logging.error(f"Failed to update counters for {lot_id}: {e}")
+            with self.lock:
+                self.baselined.discard(lot_id)
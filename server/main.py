@@ -17,6 +17,50 @@ video_file = "macPark.mp4"
 use_mongodb = os.getenv("USE_MONGODB", "True").lower() == "true"
 mongo_uri = os.getenv("MONGO_URI", "mongodb://localhost:27017/") 
 
+# Storage backend: mongodb://..., sqlite:///path.db or memory:// (defaults to MONGO_URI)
+mongo_uri = os.getenv("STORAGE_URL") or mongo_uri
+
+# Threaded capture/inference/post-process pipeline (drop_policy: drop_oldest or block)
+use_pipeline = os.getenv("PIPELINED", "False").lower() == "true"
+pipeline_queue_size = int(os.getenv("PIPELINE_QUEUE_SIZE", "4"))
+pipeline_drop_policy = os.getenv("PIPELINE_DROP_POLICY", "drop_oldest")
+
+# Batched inference: frames per predict call and max seconds to wait for a batch to fill
+batch_size = int(os.getenv("BATCH_SIZE", "1"))
+batch_timeout = float(os.getenv("BATCH_TIMEOUT", "0.05"))
+
+# Motion gate: only run YOLO when a spot sees motion or the refresh interval expires
+use_motion_gate = os.getenv("MOTION_GATE", "False").lower() == "true"
+motion_threshold = float(os.getenv("MOTION_THRESHOLD", "0.05"))
+motion_refresh_seconds = float(os.getenv("MOTION_REFRESH_SECONDS", "30"))
+
+# Dirty regions: re-evaluate only the spots whose pixels changed, on a crop around them
+use_dirty_regions = os.getenv("DIRTY_REGIONS", "False").lower() == "true"
+
+# ROI inference: crop to the spot area and tile large regions into overlapping tiles
+use_roi_inference = os.getenv("ROI_INFERENCE", "False").lower() == "true"
+tile_size = int(os.getenv("TILE_SIZE", "640"))
+tile_overlap = float(os.getenv("TILE_OVERLAP", "0.2"))
+max_tiles = int(os.getenv("MAX_TILES", "4"))
+
+# Headless mode: no display window; OUTPUT_VIDEO optionally records annotated frames in the background
+headless = os.getenv("HEADLESS", "False").lower() == "true"
+output_video = os.getenv("OUTPUT_VIDEO") or None
+annotate_every = int(os.getenv("ANNOTATE_EVERY", "5"))
+
+# Hysteresis: commit a status only after it held for HYSTERESIS_MIN_DWELL frames
+use_hysteresis = os.getenv("HYSTERESIS", "False").lower() == "true"
+hysteresis_enter = float(os.getenv("HYSTERESIS_ENTER", "0.2"))
+hysteresis_exit = float(os.getenv("HYSTERESIS_EXIT", "0.15"))
+hysteresis_min_dwell = int(os.getenv("HYSTERESIS_MIN_DWELL", "5"))
+
+# Write-behind publishing: MongoDB writes run on a background thread (spilled to SPILL_DIR during outages)
+write_behind = os.getenv("WRITE_BEHIND", "True").lower() == "true"
+spill_dir = os.getenv("SPILL_DIR", "spill")
+
+# Multi-camera supervisor configuration (see cameras.example.yml)
+cameras_config = os.getenv("CAMERAS_CONFIG", "cameras.yml")
+
 def generate_coordinates():
     """Generate parking spot coordinates from an image."""
     logging.basicConfig(level=logging.INFO)
@@ -73,16 +117,48 @@ def detect_parking():
         model_path=yolo_model, conf=yolo_conf,
         lot_id=lot_id,
         use_db=use_mongodb,
-        mongo_uri=mongo_uri
+        mongo_uri=mongo_uri,
+        pipelined=use_pipeline,
+        queue_size=pipeline_queue_size,
+        drop_policy=pipeline_drop_policy,
+        batch_size=batch_size,
+        batch_timeout=batch_timeout,
+        motion_gate=use_motion_gate,
+        motion_threshold=motion_threshold,
+        refresh_interval=motion_refresh_seconds,
+        dirty_regions=use_dirty_regions,
+        roi_inference=use_roi_inference,
+        tile_size=tile_size,
+        tile_overlap=tile_overlap,
+        max_tiles=max_tiles,
+        headless=headless,
+        output_video=output_video,
+        annotate_every=annotate_every,
+        hysteresis=use_hysteresis,
+        enter_threshold=hysteresis_enter,
+        exit_threshold=hysteresis_exit,
+        min_dwell=hysteresis_min_dwell,
+        write_behind=write_behind,
+        spill_dir=spill_dir
     )
     detector.detect_yolo()
 
 
+def supervise_cameras():
+    """Run detection for every camera in the multi-camera config across a process pool."""
+    from supervisor import Supervisor, load_config
+
+    logging.basicConfig(level=logging.INFO)
+    Supervisor(load_config(cameras_config)).run()
+
+
 if __name__ == '__main__':
-    input_mode = input("Enter 'g' to generate coordinates, 'd' to detect parking: ").strip().lower()
+    input_mode = input("Enter 'g' to generate coordinates, 'd' to detect parking, 's' to supervise all cameras: ").strip().lower()
     if input_mode == 'g':
         generate_coordinates()
     elif input_mode == 'd':
         detect_parking()
+    elif input_mode == 's':
+        supervise_cameras()
     else:
-        print("Invalid input. Please enter 'g' or 'd'.")
\ No newline at end of file
+        print("Invalid input. Please enter 'g', 'd' or 's'.")
\ No newline at end of file
@@ -1,28 +1,54 @@
-from pymongo import MongoClient
+from pymongo import MongoClient, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
 from datetime import datetime
 import logging
+import os
 
+from lot_counters import LotCounters
+from mongo_indexes import ensure_indexes
+from occupancy_history import OccupancyHistory
+from storage import ParkingStore, build_lot_definition
 
-class ParkingDB:
+
+# Change-log entries kept per lot in `lot-status`; the window GET /occupancy/{lot_id}?since= serves from
+CHANGE_LOG_SIZE = int(os.getenv("CHANGE_LOG_SIZE", "500"))
+
+
+class ParkingDB(ParkingStore):
     """MongoDB handler for parking lot definitions and occupancy data."""
     
     def __init__(self, connection_string="mongodb://localhost:27017/", db_name="mac-a-park-db"):
         """
         Initialize MongoDB connection.
         
+        Pool size and timeouts come from MONGO_MAX_POOL_SIZE, MONGO_MIN_POOL_SIZE,
+        MONGO_SERVER_SELECTION_TIMEOUT_MS and MONGO_CONNECT_TIMEOUT_MS. Use
+        storage.open_parking_db() to share one instance per process.
+        
         Args:
             connection_string: MongoDB connection URI (default: local)
             db_name: Database name
         """
         try:
-            self.client = MongoClient(connection_string)
+            self.client = MongoClient(
+                connection_string,
+                maxPoolSize=int(os.getenv("MONGO_MAX_POOL_SIZE", "20")),
+                minPoolSize=int(os.getenv("MONGO_MIN_POOL_SIZE", "0")),
+                serverSelectionTimeoutMS=int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000")),
+                connectTimeoutMS=int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+            )
             self.db = self.client[db_name]
             self.lot_definitions = self.db["lot-collection"]
             self.occupancy_status = self.db["occupancy-collection"]
+            self.lot_status = self.db["lot-status"]
+            self.history = OccupancyHistory(self.db, self.lot_definitions, self.occupancy_status)
+            self.counters = LotCounters(self.lot_definitions, self.lot_status, self.occupancy_status)
             
             # Test connection
             self.client.server_info()
             logging.info(f"Connected to MongoDB: {db_name}")
+            
+            ensure_indexes(self.db)
         except Exception as e:
             logging.error(f"Failed to connect to MongoDB: {e}")
             raise
@@ -38,31 +64,7 @@ class ParkingDB:
             image_width: Width of reference image for normalization
             image_height: Height of reference image for normalization
         """
-        # Normalize coordinates
-        normalized_spots = []
-        for spot in spots:
-            polygon = []
-            for coord in spot["coordinates"]:
-                polygon.append({
-                    "x": float(coord[0]) / image_width,
-                    "y": float(coord[1]) / image_height
-                })
-            
-            normalized_spots.append({
-                "spot_id": str(spot["id"]),
-                "type": "standard",
-                "polygon": polygon
-            })
-        
-        lot_definition = {
-            "lot_id": lot_id,
-            "name": name,
-            "spots": normalized_spots,
-            "image_width": image_width,
-            "image_height": image_height,
-            "created_at": datetime.utcnow(),
-            "updated_at": datetime.utcnow()
-        }
+        lot_definition = build_lot_definition(lot_id, name, spots, image_width, image_height)
         
         # Upsert lot definition
         self.lot_definitions.update_one(
@@ -70,8 +72,10 @@ class ParkingDB:
             {"$set": lot_definition},
             upsert=True
         )
+        self.history.track_lot(lot_id, lot_definition)
+        self.counters.reset(lot_definition)
         
-        logging.info(f"Saved lot definition: {lot_id} with {len(normalized_spots)} spots")
+        logging.info(f"Saved lot definition: {lot_id} with {len(lot_definition['spots'])} spots")
         return lot_definition
     
     def get_lot_definition(self, lot_id):
@@ -88,19 +92,146 @@ class ParkingDB:
             occupied: Boolean indicating if spot is occupied
             video_file: Optional video source name
         """
+        self.update_spot_statuses(lot_id, {spot_id: occupied}, video_file=video_file)
+    
+    def update_spot_statuses(self, lot_id, changes, video_file=None, timestamps=None):
+        """
+        Update the status of many parking spots in one round-trip.
+        
+        Args:
+            lot_id: Parking lot identifier
+            changes: Mapping (or iterable of pairs) of spot_id -> occupied
+            video_file: Optional video source name
+            timestamps: Optional mapping of spot_id -> detection time (default: now)
+            
+        Every batch appends its spots to the lot's change log in `lot-status`,
+        advancing the change counter by one version per spot in the same update,
+        and stamps each written spot with its version, so readers can ask for
+        "spots changed after version N". The log is in commit order even when
+        several cameras (and processes) write the same lot.
+        Spots that actually flipped are `$inc`-ed into the lot's occupied/free
+        counters by that same update, and flips are judged against the last
+        state this process holds for each spot (each spot has one camera), so a
+        batch costs two round-trips: the lot-status update and the spot upserts.
+        History samples and rollups are buffered and written in bulk.
+        Writing the same reports again (a retried batch) is harmless: spots
+        whose report is already in the change log keep their version and are
+        not counted again, and history samples are only pushed once.
+            
+        Returns:
+            Number of spots written
+        """
+        changes = dict(changes)
+        if not changes:
+            return 0
+        
         timestamp = datetime.utcnow()
+        timestamps = {spot_id: (timestamps or {}).get(spot_id, timestamp) for spot_id in changes}
+        # BSON dates keep milliseconds: a retried report must compare equal to the logged one
+        timestamps = {
+            spot_id: value.replace(microsecond=value.microsecond // 1000 * 1000)
+            for spot_id, value in timestamps.items()
+        }
         
-        self.occupancy_status.update_one(
-            {"lot_id": lot_id, "spot_id": spot_id},
-            {
-                "$set": {
-                    "occupied": occupied,
-                    "last_updated": timestamp,
-                    "video_source": video_file
-                }
-            },
-            upsert=True
-        )
+        # Last known state of each spot; only spots this process has not seen yet are read
+        previous = self.history.previous_states(lot_id, changes)
+        occupied_before = {spot_id for spot_id, doc in previous.items() if doc.get("occupied")}
+        counts = self.counters.deltas(lot_id, changes, occupied_before)
+        
+        try:
+            versions = self.claim_versions(lot_id, changes, timestamps, counts or {}, once=True)
+            if versions is None:
+                # Part of the batch was claimed before: a retry of a write that failed after its claim
+                versions = self.logged_versions(lot_id, changes, timestamps)
+                rest = {spot_id: occupied for spot_id, occupied in changes.items() if spot_id not in versions}
+                if rest:
+                    counts = self.counters.deltas(lot_id, rest, occupied_before)
+                    versions.update(self.claim_versions(lot_id, rest, timestamps, counts or {}))
+        except Exception:
+            if counts:
+                self.counters.failed(lot_id)
+            raise
+        # Opens and closes the history intervals; buffered now so a failed write below cannot lose them
+        transitions = self.history.remember(lot_id, changes, timestamps)
+        self.history.record(lot_id, changes, timestamps, transitions)
+        
+        operations = []
+        for spot_id, occupied in changes.items():
+            fields = {
+                "occupied": occupied,
+                "last_updated": timestamps[spot_id],
+                "video_source": video_file,
+                "version": versions[spot_id]
+            }
+            if spot_id in transitions.credited_until:
+                fields["credited_until"] = transitions.credited_until[spot_id]
+            operations.append(UpdateOne({"lot_id": lot_id, "spot_id": spot_id}, {"$set": fields}, upsert=True))
+        
+        # Unordered: the server may apply the upserts in parallel and keeps going past a failed one
+        self.occupancy_status.bulk_write(operations, ordered=False)
+        
+        # Lots that were not baselined, or whose definition changed since the batch's deltas
+        self.counters.rebaseline(lot_id)
+        return len(operations)
+    
+    def claim_versions(self, lot_id, changes, timestamps, counts=None, once=False):
+        """
+        Append a batch to the lot's change log and return spot_id -> version.
+        
+        The counter and the log move in one atomic update, so the last log
+        entry always carries `version` and the log order is the version order.
+        `counts` are extra `$inc` fields (the lot's occupancy counters) applied
+        by the same update. With `once`, nothing is written and None is
+        returned when one of the batch's timestamps is already logged.
+        """
+        entries = [
+            {"s": spot_id, "o": occupied, "t": timestamps[spot_id]}
+            for spot_id, occupied in changes.items()
+        ]
+        query = {"lot_id": lot_id}
+        if once:
+            query["log.t"] = {"$nin": sorted({entry["t"] for entry in entries})}
+        try:
+            status = self.lot_status.find_one_and_update(
+                query,
+                {
+                    "$inc": dict(counts or {}, version=len(entries)),
+                    "$set": {"updated_at": datetime.utcnow()},
+                    "$push": {"log": {"$each": entries, "$slice": -CHANGE_LOG_SIZE}}
+                },
+                projection={"version": 1, "layout": 1},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # The lot exists but did not match: a timestamp is logged (the upsert hit lot_id_unique)
+            if once:
+                return None
+            raise
+        self._check_layout(lot_id, status)
+        first = status["version"] - len(entries) + 1
+        return {spot_id: first + offset for offset, spot_id in enumerate(changes)}
+    
+    def logged_versions(self, lot_id, changes, timestamps):
+        """spot_id -> version of the batch's spots whose report (spot and timestamp) is in the change log."""
+        status = self.lot_status.find_one({"lot_id": lot_id}, {"version": 1, "log": 1, "layout": 1}) or {}
+        self._check_layout(lot_id, status)
+        log = status.get("log") or []
+        first = status.get("version", 0) - len(log) + 1
+        logged = {(entry["s"], entry["t"]): first + offset for offset, entry in enumerate(log)}
+        return {
+            spot_id: logged[(spot_id, timestamps[spot_id])]
+            for spot_id in changes if (spot_id, timestamps[spot_id]) in logged
+        }
+    
+    def _check_layout(self, lot_id, status):
+        # A definition saved by any process bumps `layout`: reload the spot types and count
+        if self.counters.check_layout(lot_id, status.get("layout")):
+            self.history.track_lot(lot_id, reload=True)
+    
+    def roll_history(self):
+        """Credit still-occupied spots to the hourly rollups once an hour has finished."""
+        self.history.roll()
     
     # def get_lot_occupancy(self, lot_id):
     #     """Get current occupancy status for all spots in a lot."""
@@ -128,6 +259,7 @@ class ParkingDB:
     #     }
     
     def close(self):
-        """Close MongoDB connection."""
+        """Write buffered history and close MongoDB connection."""
+        self.history.flush(force=True)
         self.client.close()
         logging.info("MongoDB connection closed")
@@ -0,0 +1,46 @@
+import logging
+
+from pymongo import ASCENDING
+from pymongo.errors import PyMongoError
+
+# Mirrors INDEXES in backend/database/indexes.py, which also checks the
+# backend's query plans; both processes write to the same collections.
+INDEXES = {
+    "mac-a-park-collection": [
+        ([("firebase_id", ASCENDING)], {"name": "firebase_id_unique", "unique": True}),
+    ],
+    "preferences-collection": [
+        ([("firebase_id", ASCENDING)], {"name": "firebase_id_unique", "unique": True}),
+    ],
+    "lot-collection": [
+        ([("lot_id", ASCENDING)], {"name": "lot_id_unique", "unique": True}),
+    ],
+    "occupancy-collection": [
+        ([("lot_id", ASCENDING), ("spot_id", ASCENDING)], {"name": "lot_spot_unique", "unique": True}),
+        ([("lot_id", ASCENDING), ("version", ASCENDING)], {"name": "lot_version"}),
+        ([("lot_id", ASCENDING), ("last_updated", ASCENDING)], {"name": "lot_last_updated"}),
+    ],
+    "lot-status": [
+        ([("lot_id", ASCENDING)], {"name": "lot_id_unique", "unique": True}),
+    ],
+    "occupancy-history": [
+        ([("lot_id", ASCENDING), ("spot_id", ASCENDING), ("hour", ASCENDING)],
+         {"name": "lot_spot_hour_unique", "unique": True}),
+    ],
+    "occupancy-hourly": [
+        ([("lot_id", ASCENDING), ("hour", ASCENDING)], {"name": "lot_hour_unique", "unique": True}),
+    ],
+}
+
+
+def ensure_indexes(db):
+    """Create the declared indexes idempotently; returns the names that failed."""
+    failed = []
+    for collection_name, specs in INDEXES.items():
+        for keys, options in specs:
+            try:
+                db[collection_name].create_index(keys, **options)
+            except PyMongoError as e:
+                logging.error(f"Failed to create index {collection_name}.{options['name']}: {e}")
+                failed.append(f"{collection_name}.{options['name']}")
+    return failed
@@ -0,0 +1,75 @@
+import time
+
+import cv2 as open_cv
+import numpy as np
+
+
+class MotionGate:
+    """Cheap MOG2 foreground check that decides whether a frame needs YOLO.
+
+    The background subtractor runs on a downscaled copy of the frame. Its
+    foreground mask is summed inside every (scaled) spot rect with one
+    integral image, and inference is requested only when some spot sees at
+    least `min_foreground` of its area change, or when `refresh_interval`
+    seconds have passed since the last inference.
+    """
+
+    def __init__(self, bounds, scale=0.25, min_foreground=0.05, refresh_interval=30.0,
+                 history=100, var_threshold=50):
+        """
+        Args:
+            bounds: List of (x, y, w, h) spot bounding rects in frame space
+            scale: Downscale factor applied before background subtraction
+            min_foreground: Fraction of a spot rect that must be foreground to trigger inference
+            refresh_interval: Seconds after which inference is forced regardless of motion
+            history: MOG2 history length
+            var_threshold: MOG2 variance threshold
+        """
+        self.scale = float(scale)
+        self.min_foreground = float(min_foreground)
+        self.refresh_interval = float(refresh_interval)
+        self.subtractor = open_cv.createBackgroundSubtractorMOG2(
+            history=history, varThreshold=var_threshold, detectShadows=False)
+
+        rects = np.asarray(bounds, dtype=np.float64).reshape(-1, 4)
+        self.x1 = np.floor(rects[:, 0] * self.scale).astype(np.int64)
+        self.y1 = np.floor(rects[:, 1] * self.scale).astype(np.int64)
+        self.x2 = np.ceil((rects[:, 0] + rects[:, 2]) * self.scale).astype(np.int64)
+        self.y2 = np.ceil((rects[:, 1] + rects[:, 3]) * self.scale).astype(np.int64)
+
+        self.last_inference = None
+        self.inferred = 0
+        self.skipped = 0
+
+    def foreground_fractions(self, frame):
+        """Feed a frame to the subtractor and return the foreground fraction per spot rect."""
+        small = open_cv.resize(frame, None, fx=self.scale, fy=self.scale, interpolation=open_cv.INTER_AREA)
+        foreground = self.subtractor.apply(small)
+        table = open_cv.integral((foreground > 0).astype(np.uint8))
+
+        h, w = foreground.shape[:2]
+        x1 = np.clip(self.x1, 0, w); x2 = np.clip(self.x2, 0, w)
+        y1 = np.clip(self.y1, 0, h); y2 = np.clip(self.y2, 0, h)
+        counts = table[y2, x2] - table[y1, x2] - table[y2, x1] + table[y1, x1]
+        areas = np.maximum((x2 - x1) * (y2 - y1), 1)
+        return counts / areas
+
+    def should_infer(self, frame):
+        """Return True when the frame must go through YOLO, False to carry statuses forward."""
+        fractions = self.foreground_fractions(frame)
+        now = time.monotonic()
+
+        expired = self.last_inference is None or now - self.last_inference >= self.refresh_interval
+        moving = fractions.size > 0 and bool((fractions >= self.min_foreground).any())
+        if expired or moving:
+            self.last_inference = now
+            self.inferred += 1
+            return True
+
+        self.skipped += 1
+        return False
+
+    def summary(self):
+        total = self.inferred + self.skipped
+        rate = self.skipped / total * 100 if total else 0.0
+        return f"motion gate: inferred {self.inferred} | skipped {self.skipped} ({rate:.0f}%)"
@@ -0,0 +1,317 @@
+from collections import namedtuple
+from datetime import datetime, timedelta
+import logging
+import os
+import threading
+import time
+import uuid
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+HOUR = timedelta(hours=1)
+
+# Seconds history samples and rollup increments are buffered before one bulk write per collection
+HISTORY_FLUSH_INTERVAL = float(os.getenv("HISTORY_FLUSH_INTERVAL", "5.0"))
+# Buffered history samples above which the oldest are dropped while MongoDB is unavailable
+HISTORY_MAX_PENDING = int(os.getenv("HISTORY_MAX_PENDING", "100000"))
+# Flush tokens kept per hourly rollup document, so a retried flush is not counted twice
+ROLLUP_FLUSH_TOKENS = 64
+
+
+def hour_start(timestamp):
+    """Truncate a datetime to the start of its hour."""
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+def split_by_hour(start, end):
+    """Yield (hour, seconds) for every hour bucket the interval [start, end) touches."""
+    current = start
+    while current < end:
+        bucket = hour_start(current)
+        boundary = min(bucket + HOUR, end)
+        yield bucket, (boundary - current).total_seconds()
+        current = boundary
+
+
+def interval_start(doc):
+    """Start of the part of an occupied spot's interval that was not credited yet."""
+    return doc.get("credited_until") or doc.get("last_updated") or datetime.utcnow()
+
+
+# arrivals: spot_id -> time it became occupied
+# departures: spot_id -> (uncredited interval start, time it became free)
+# credited_until: new stored value per spot (arrival time, None once free, or the pinned
+#   start of an interval written before the field existed)
+Transitions = namedtuple("Transitions", "arrivals departures credited_until")
+
+
+def classify(changes, timestamps, previous):
+    """
+    Compare a batch of statuses with the stored state it overwrites.
+
+    Args:
+        changes: Mapping spot_id -> occupied
+        timestamps: Mapping spot_id -> datetime of the change
+        previous: Mapping spot_id -> stored occupancy document (missing = never reported)
+    """
+    arrivals, departures, credited_until = {}, {}, {}
+    for spot_id, occupied in changes.items():
+        before = previous.get(spot_id)
+        was_occupied = bool(before and before.get("occupied"))
+        if occupied and not was_occupied:
+            arrivals[spot_id] = credited_until[spot_id] = timestamps[spot_id]
+        elif not occupied and was_occupied:
+            departures[spot_id] = (interval_start(before), timestamps[spot_id])
+            credited_until[spot_id] = None
+        elif occupied and before.get("credited_until") is None:
+            # Pin the start before last_updated is overwritten
+            credited_until[spot_id] = interval_start(before)
+    return Transitions(arrivals, departures, credited_until)
+
+
+class OccupancyHistory:
+    """Bucketed occupancy history plus incrementally maintained hourly rollups.
+
+    Transitions are appended to one document per spot per hour in
+    `occupancy-history` (parallel `t`/`o` arrays of timestamps and states), so
+    history grows by one small document per active spot-hour instead of one
+    document per event. Occupied time is credited to per-lot hour documents in
+    `occupancy-hourly` as `$inc`s, which lets "occupancy rate by hour" be
+    answered from at most 24 documents per lot per day. Samples and
+    increments are buffered and written with one bulk write per collection
+    every `flush_interval` seconds, whatever the number of batches and lots.
+
+    Open intervals live in the stored spot documents: an occupied spot's
+    document carries `credited_until`, the start of its uncredited time.
+    Transitions are classified against the last state of each spot, kept in
+    `state` for the spots this process writes (loaded from the stored
+    documents the first time a spot is written). roll() only closes the
+    intervals of those spots, so every second is credited once even when
+    several processes write parts of the same lot (each spot having a
+    single camera).
+    """
+
+    def __init__(self, db, lot_definitions, occupancy_status, flush_interval=HISTORY_FLUSH_INTERVAL):
+        """
+        Args:
+            db: pymongo Database holding the history collections
+            lot_definitions: Collection with lot definitions (for spot counts)
+            occupancy_status: Collection with the current state per spot
+            flush_interval: Seconds between bulk writes of the buffered history
+        """
+        self.buckets = db["occupancy-history"]
+        self.hourly = db["occupancy-hourly"]
+        self.lot_definitions = lot_definitions
+        self.occupancy_status = occupancy_status
+        self.flush_interval = float(flush_interval)
+
+        # Shared by every publisher thread of the process
+        self.lock = threading.Lock()
+        # One flush at a time, so a new bucket or rollup document is never upserted twice concurrently
+        self.flushing = threading.Lock()
+        self.lots = set()
+        self.total_spots = {}
+        self.current_hour = None
+        # lot_id -> spot_id -> {"occupied", "last_updated", "credited_until"} (None: never reported)
+        self.state = {}
+        # (lot_id, spot_id, timestamp, occupied) samples and (lot_id, hour) -> [seconds, arrivals]
+        self.pending_samples = []
+        self.pending_rollups = {}
+        # (token, rollups) of flushes that failed, retried with their token before newer increments
+        self.unacked_rollups = []
+        self.flushed_at = time.monotonic()
+
+    def track_lot(self, lot_id, lot=None, reload=False):
+        """Load a lot's spot count (from `lot` when just saved, again with `reload`)."""
+        if lot_id in self.lots and lot is None and not reload:
+            return
+        with self.lock:
+            lot = lot or self.lot_definitions.find_one({"lot_id": lot_id}, {"spots.spot_id": 1})
+            self.total_spots[lot_id] = len(lot.get("spots", [])) if lot else 0
+            self.lots.add(lot_id)
+
+    def previous_states(self, lot_id, spot_ids):
+        """
+        Last state of the given spots, before a batch overwrites them.
+
+        Spots this process has not written yet are read from the stored
+        documents once; after that the state is kept up to date by remember().
+        """
+        with self.lock:
+            known = self.state.setdefault(lot_id, {})
+            missing = [spot_id for spot_id in spot_ids if spot_id not in known]
+        if missing:
+            stored = {
+                doc["spot_id"]: doc
+                for doc in self.occupancy_status.find(
+                    {"lot_id": lot_id, "spot_id": {"$in": missing}},
+                    {"_id": 0, "spot_id": 1, "occupied": 1, "last_updated": 1, "credited_until": 1}
+                )
+            }
+            with self.lock:
+                for spot_id in missing:
+                    known.setdefault(spot_id, stored.get(spot_id))
+        with self.lock:
+            return {spot_id: dict(known[spot_id]) for spot_id in spot_ids if known.get(spot_id) is not None}
+
+    def remember(self, lot_id, changes, timestamps):
+        """
+        Move the kept state of a batch's spots forward once its change is committed.
+
+        Returns the batch's transitions against the kept state as it is now:
+        a roll() that ran since previous_states() already credited part of a
+        closing interval and moved its start.
+        """
+        with self.lock:
+            known = self.state.setdefault(lot_id, {})
+            transitions = classify(
+                changes, timestamps, {spot_id: known[spot_id] for spot_id in changes if known.get(spot_id)}
+            )
+            for spot_id, occupied in changes.items():
+                credited_until = transitions.credited_until.get(
+                    spot_id, (known.get(spot_id) or {}).get("credited_until")
+                )
+                known[spot_id] = {
+                    "occupied": occupied,
+                    "last_updated": timestamps[spot_id],
+                    "credited_until": credited_until if occupied else None
+                }
+        return transitions
+
+    def _credit(self, lot_id, start, end):
+        # Caller holds the lock
+        for bucket, seconds in split_by_hour(start, end):
+            self.pending_rollups.setdefault((lot_id, bucket), [0.0, 0])[0] += seconds
+
+    def record(self, lot_id, changes, timestamps, transitions):
+        """
+        Buffer a committed batch's samples and occupied-time credits.
+
+        Args:
+            lot_id: Parking lot identifier
+            changes: Mapping spot_id -> occupied
+            timestamps: Mapping spot_id -> datetime of the change
+            transitions: remember() result for this batch
+        """
+        self.track_lot(lot_id)
+        with self.lock:
+            self.pending_samples.extend(
+                (lot_id, spot_id, timestamps[spot_id], occupied) for spot_id, occupied in changes.items()
+            )
+            for timestamp in transitions.arrivals.values():
+                self.pending_rollups.setdefault((lot_id, hour_start(timestamp)), [0.0, 0])[1] += 1
+            for start, end in transitions.departures.values():
+                self._credit(lot_id, start, end)
+            overflow = len(self.pending_samples) - HISTORY_MAX_PENDING
+            if overflow > 0:
+                del self.pending_samples[:overflow]
+        if overflow > 0:
+            logging.error(f"Occupancy history buffer full, dropped {overflow} samples")
+        self.flush()
+
+    def flush(self, force=False):
+        """
+        Write the buffered samples and rollup increments (at most once per flush_interval unless forced).
+
+        Retries are idempotent: a sample is only pushed into a bucket that does
+        not hold its timestamp yet, and every flush tags the rollup documents it
+        increments with a token, so a flush that failed halfway is retried
+        with the same token and skips the documents it already reached.
+        """
+        if not self.flushing.acquire(blocking=force):
+            return
+        try:
+            self._flush(force)
+        finally:
+            self.flushing.release()
+
+    def _flush(self, force):
+        with self.lock:
+            if not force and time.monotonic() - self.flushed_at < self.flush_interval:
+                return
+            samples, self.pending_samples = self.pending_samples, []
+            if self.pending_rollups:
+                self.unacked_rollups.append((uuid.uuid4().hex, self.pending_rollups))
+                self.pending_rollups = {}
+            unacked, self.unacked_rollups = self.unacked_rollups, []
+            self.flushed_at = time.monotonic()
+        try:
+            if samples:
+                _bulk_upsert(self.buckets, [
+                    UpdateOne(
+                        {"lot_id": lot_id, "spot_id": spot_id, "hour": hour_start(timestamp), "t": {"$ne": timestamp}},
+                        {"$push": {"t": timestamp, "o": occupied}, "$inc": {"n": 1}},
+                        upsert=True
+                    )
+                    for lot_id, spot_id, timestamp, occupied in samples
+                ])
+                samples = []
+            while unacked:
+                token, rollups = unacked[0]
+                _bulk_upsert(self.hourly, [
+                    UpdateOne(
+                        {"lot_id": lot_id, "hour": bucket, "flushes": {"$ne": token}},
+                        {
+                            "$inc": {"occupied_seconds": seconds, "arrivals": arrivals},
+                            "$max": {"total_spots": self.total_spots.get(lot_id, 0)},
+                            "$push": {"flushes": {"$each": [token], "$slice": -ROLLUP_FLUSH_TOKENS}}
+                        },
+                        upsert=True
+                    )
+                    for (lot_id, bucket), (seconds, arrivals) in rollups.items()
+                ])
+                unacked.pop(0)
+        except Exception as e:
+            logging.error(f"Failed to write occupancy history, retrying with the next flush: {e}")
+            with self.lock:
+                self.pending_samples[:0] = samples
+                self.unacked_rollups[:0] = unacked
+
+    def roll(self, now=None):
+        """
+        Credit open intervals of this process's spots up to the current hour boundary.
+
+        The new interval starts are stored (`credited_until`) before the time
+        is credited.
+
+        Cars that stay parked for hours would otherwise only be credited when
+        they leave; calling this periodically closes every finished hour. Also
+        flushes the buffered history when it is due.
+        """
+        now = now or datetime.utcnow()
+        boundary = hour_start(now)
+        with self.lock:
+            if self.current_hour != boundary:
+                open_spots = [
+                    (lot_id, spot_id, doc)
+                    for lot_id, spots in self.state.items()
+                    for spot_id, doc in spots.items()
+                    if doc and doc["occupied"] and interval_start(doc) < boundary
+                ]
+                try:
+                    # Hourly, so writers may wait for it: a batch must not close an interval mid-roll
+                    if open_spots:
+                        self.occupancy_status.bulk_write([
+                            UpdateOne({"lot_id": lot_id, "spot_id": spot_id}, {"$set": {"credited_until": boundary}})
+                            for lot_id, spot_id, _ in open_spots
+                        ], ordered=False)
+                    for lot_id, _, doc in open_spots:
+                        self._credit(lot_id, interval_start(doc), boundary)
+                        doc["credited_until"] = boundary
+                    self.current_hour = boundary
+                except Exception as e:
+                    logging.error(f"Failed to roll occupancy history: {e}")
+        self.flush()
+
+
+def _bulk_upsert(collection, operations):
+    """Unordered bulk upsert where a duplicate key means the guarded update was already applied."""
+    try:
+        collection.bulk_write(operations, ordered=False)
+    except BulkWriteError as e:
+        # The filter's guard did not match an existing document, so the upsert tried to insert a second one
+        if e.details.get("writeConcernErrors") or any(
+            error.get("code") != 11000 for error in e.details.get("writeErrors", [])
+        ):
+            raise
@@ -0,0 +1,117 @@
+import numpy as np
+
+
+class OverlapEngine:
+    """Batched spot x box overlap computation backed by summed-area tables.
+
+    Each spot mask is converted once into an integral image padded with a
+    leading zero row/column, so the number of spot pixels covered by any
+    axis-aligned box is four table lookups. All tables live in one flat
+    array and are addressed with per-spot offsets and strides, which lets a
+    whole frame's (spot, box) pairs be evaluated in a single NumPy gather.
+    """
+
+    def __init__(self, bounds, masks):
+        """
+        Build the per-spot integral images.
+
+        Args:
+            bounds: List of (x, y, w, h) spot bounding rects in frame space
+            masks: List of boolean masks with shape (h, w), one per rect
+        """
+        count = len(bounds)
+        self.rects = np.asarray(bounds, dtype=np.int64).reshape(count, 4)
+        self.areas = np.ones(count, dtype=np.float64)
+        self.offsets = np.zeros(count, dtype=np.int64)
+        self.strides = np.zeros(count, dtype=np.int64)
+
+        sizes = [(int(h) + 1) * (int(w) + 1) for (_, _, w, h) in self.rects]
+        self.tables = np.zeros(sum(sizes), dtype=np.int32)
+
+        offset = 0
+        for index, mask in enumerate(masks):
+            h, w = mask.shape
+            table = np.zeros((h + 1, w + 1), dtype=np.int32)
+            table[1:, 1:] = mask.astype(np.int32).cumsum(axis=0).cumsum(axis=1)
+
+            self.tables[offset:offset + sizes[index]] = table.ravel()
+            self.offsets[index] = offset
+            self.strides[index] = w + 1
+            area = float(table[-1, -1])
+            self.areas[index] = area if area > 0 else 1.0
+            offset += sizes[index]
+
+    def __len__(self):
+        return len(self.rects)
+
+    def overlap_pairs(self, spot_idx, box_idx, boxes):
+        """
+        Compute overlap fractions for explicit (spot, box) pairs.
+
+        Args:
+            spot_idx: 1-D integer array of spot indices
+            box_idx: 1-D integer array of box indices, same length as spot_idx
+            boxes: (M, 4) integer array of (x1, y1, x2, y2) boxes
+
+        Returns:
+            1-D float array: covered spot pixels / spot area for each pair
+        """
+        spot_idx = np.asarray(spot_idx, dtype=np.int64)
+        box_idx = np.asarray(box_idx, dtype=np.int64)
+        if spot_idx.size == 0:
+            return np.zeros(0, dtype=np.float64)
+
+        boxes = np.asarray(boxes, dtype=np.int64).reshape(-1, 4)
+        rects = self.rects[spot_idx]
+        sel = boxes[box_idx]
+
+        # Clip each box to the spot rect, expressed relative to the rect origin
+        x1 = np.clip(sel[:, 0] - rects[:, 0], 0, rects[:, 2])
+        y1 = np.clip(sel[:, 1] - rects[:, 1], 0, rects[:, 3])
+        x2 = np.clip(sel[:, 2] - rects[:, 0], 0, rects[:, 2])
+        y2 = np.clip(sel[:, 3] - rects[:, 1], 0, rects[:, 3])
+        x2 = np.maximum(x2, x1)
+        y2 = np.maximum(y2, y1)
+
+        base = self.offsets[spot_idx]
+        stride = self.strides[spot_idx]
+        t = self.tables
+        covered = (t[base + y2 * stride + x2]
+                   - t[base + y1 * stride + x2]
+                   - t[base + y2 * stride + x1]
+                   + t[base + y1 * stride + x1])
+
+        return covered / self.areas[spot_idx]
+
+    def overlap_matrix(self, boxes):
+        """Return the dense (spots, boxes) overlap matrix for one frame."""
+        boxes = np.asarray(boxes, dtype=np.int64).reshape(-1, 4)
+        spots, count = len(self.rects), len(boxes)
+        spot_idx = np.repeat(np.arange(spots), count)
+        box_idx = np.tile(np.arange(count), spots)
+        return self.overlap_pairs(spot_idx, box_idx, boxes).reshape(spots, count)
+
+    def max_overlaps(self, boxes, pairs=None):
+        """
+        Return the largest overlap fraction of any box for each spot.
+
+        Args:
+            boxes: (M, 4) integer array of (x1, y1, x2, y2) boxes
+            pairs: Optional (spot_idx, box_idx) candidates, e.g. from a
+                SpotGridIndex; pairs left out are treated as no overlap
+        """
+        boxes = np.asarray(boxes, dtype=np.int64).reshape(-1, 4)
+        best = np.zeros(len(self.rects), dtype=np.float64)
+        if len(boxes) == 0:
+            return best
+
+        if pairs is None:
+            return self.overlap_matrix(boxes).max(axis=1)
+
+        spot_idx, box_idx = pairs
+        np.maximum.at(best, spot_idx, self.overlap_pairs(spot_idx, box_idx, boxes))
+        return best
+
+    def occupied(self, boxes, threshold, pairs=None):
+        """Return a boolean array marking spots covered by at least `threshold`."""
+        return self.max_overlaps(boxes, pairs) >= threshold
@@ -0,0 +1,261 @@
+import logging
+import queue
+import threading
+import time
+
+DROP_OLDEST = "drop_oldest"
+BLOCK = "block"
+DROP_POLICIES = (DROP_OLDEST, BLOCK)
+
+# Marks the end of the frame stream as it travels through the stage queues
+_END = object()
+
+
+class StageStats:
+    """Throughput counters for a single pipeline stage."""
+
+    def __init__(self, name):
+        self.name = name
+        self.processed = 0
+        self.dropped = 0
+        self.busy = 0.0
+        self.started = time.perf_counter()
+
+    def record(self, seconds, items=1):
+        self.processed += items
+        self.busy += seconds
+
+    def throughput(self):
+        """Items per second of wall-clock time since the stage started."""
+        elapsed = time.perf_counter() - self.started
+        return self.processed / elapsed if elapsed > 0 else 0.0
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.started
+        utilization = self.busy / elapsed * 100 if elapsed > 0 else 0.0
+        return (f"{self.name}: {self.throughput():.1f}/s | processed {self.processed} | "
+                f"dropped {self.dropped} | busy {utilization:.0f}%")
+
+
+class FrameBatcher:
+    """Groups queued frames into batches for a single model call.
+
+    Items are returned in arrival order so outputs can be zipped back onto
+    their (source, frame index) tags. A batch is released as soon as it is
+    full or `max_wait` seconds after its first item arrived, which bounds the
+    latency added when frames arrive slowly.
+    """
+
+    def __init__(self, batch_size=1, max_wait=0.05):
+        self.batch_size = max(int(batch_size), 1)
+        self.max_wait = max(float(max_wait), 0.0)
+
+    def collect(self, get, end_marker=None, poll=0.1):
+        """
+        Gather the next batch.
+
+        Args:
+            get: Callable get(timeout) returning the next item or raising queue.Empty
+            end_marker: Sentinel that ends the stream; it is never included in a batch
+            poll: Seconds to wait for the first item before returning an empty batch
+
+        Returns:
+            Tuple (items, ended) where ended is True once end_marker was seen
+        """
+        try:
+            first = get(timeout=poll)
+        except queue.Empty:
+            return [], False
+        if first is end_marker:
+            return [], True
+
+        items = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(items) < self.batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                item = get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is end_marker:
+                return items, True
+            items.append(item)
+
+        return items, False
+
+
+class StageQueue:
+    """Bounded hand-off between two stages with a configurable drop policy.
+
+    With `drop_oldest` a full queue discards its oldest item so a live feed
+    never builds up latency; with `block` the producer waits for room.
+    `on_drop` is called (on the producer's thread) with every discarded item.
+    """
+
+    def __init__(self, maxsize, drop_policy, stats, stop_event, on_drop=None):
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(f"Unknown drop policy '{drop_policy}', expected one of {DROP_POLICIES}")
+        self.queue = queue.Queue(maxsize=max(int(maxsize), 1))
+        self.drop_policy = drop_policy
+        self.stats = stats
+        self.stop_event = stop_event
+        self.on_drop = on_drop
+
+    def put(self, item):
+        if self.drop_policy == DROP_OLDEST and item is not _END:
+            while True:
+                try:
+                    self.queue.put_nowait(item)
+                    return
+                except queue.Full:
+                    try:
+                        dropped = self.queue.get_nowait()
+                        self.stats.dropped += 1
+                    except queue.Empty:
+                        continue
+                    if self.on_drop is not None:
+                        self.on_drop(dropped)
+
+        while not self.stop_event.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def get(self, timeout=None):
+        """Return the next item, or raise queue.Empty after `timeout` seconds."""
+        return self.queue.get(timeout=timeout)
+
+
+class FramePipeline:
+    """Three-stage capture -> inference -> post-process pipeline.
+
+    Capture and inference each run on their own thread and are connected by
+    bounded `StageQueue`s. Post-processing (DB publishing, display) runs on
+    the calling thread inside `run()`, which keeps OpenCV GUI calls on the
+    main thread.
+    """
+
+    def __init__(self, read_frame, infer_batch, queue_size=4, drop_policy=DROP_OLDEST,
+                 batch_size=1, max_wait=0.05, report_interval=10.0, on_output_dropped=None):
+        """
+        Args:
+            read_frame: Callable returning (ok, frame); a None frame ends the stream
+            infer_batch: Callable mapping a list of frames to a list of outputs
+            queue_size: Capacity of each inter-stage queue
+            drop_policy: 'drop_oldest' or 'block' when a queue is full
+            batch_size: Maximum number of frames per inference call
+            max_wait: Seconds to wait for a batch to fill before running it
+            report_interval: Seconds between throughput log lines (0 disables)
+            on_output_dropped: Callable (frame_index, frame, output) run on the
+                inference thread for every output discarded before post-processing
+        """
+        self.read_frame = read_frame
+        self.infer_batch = infer_batch
+        self.batcher = FrameBatcher(batch_size, max_wait)
+        self.report_interval = report_interval
+        self.stop_event = threading.Event()
+        self.error = None
+
+        self.capture_stats = StageStats("capture")
+        self.inference_stats = StageStats("inference")
+        self.postprocess_stats = StageStats("postprocess")
+
+        queue_size = max(int(queue_size), self.batcher.batch_size)
+        self.frames = StageQueue(queue_size, drop_policy, self.capture_stats, self.stop_event)
+        self.outputs = StageQueue(
+            queue_size, drop_policy, self.inference_stats, self.stop_event,
+            on_drop=(lambda item: on_output_dropped(*item)) if on_output_dropped else None)
+
+        self.threads = [
+            threading.Thread(target=self._capture_loop, name="pipeline-capture", daemon=True),
+            threading.Thread(target=self._inference_loop, name="pipeline-inference", daemon=True),
+        ]
+
+    def _capture_loop(self):
+        index = 0
+        try:
+            while not self.stop_event.is_set():
+                started = time.perf_counter()
+                result, frame = self.read_frame()
+                if frame is None:
+                    break
+                if not result:
+                    raise Exception("Error reading video capture")
+                self.capture_stats.record(time.perf_counter() - started)
+                index += 1
+                self.frames.put((index, frame))
+        except Exception as e:
+            self.error = e
+        finally:
+            self.frames.put(_END)
+
+    def _inference_loop(self):
+        try:
+            ended = False
+            while not ended and not self.stop_event.is_set():
+                items, ended = self.batcher.collect(self.frames.get, end_marker=_END)
+                if not items:
+                    continue
+
+                started = time.perf_counter()
+                outputs = self.infer_batch([frame for _, frame in items])
+                self.inference_stats.record(time.perf_counter() - started, len(items))
+                for (index, frame), output in zip(items, outputs):
+                    self.outputs.put((index, frame, output))
+        except Exception as e:
+            self.error = e
+        finally:
+            self.outputs.put(_END)
+
+    def run(self, postprocess):
+        """
+        Start the worker stages and post-process their output until the stream ends.
+
+        Args:
+            postprocess: Callable (frame_index, frame, output) -> bool; returning
+                False stops the pipeline early
+        """
+        for thread in self.threads:
+            thread.start()
+
+        last_report = time.perf_counter()
+        try:
+            while True:
+                try:
+                    item = self.outputs.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if item is _END:
+                    break
+
+                started = time.perf_counter()
+                keep_going = postprocess(*item)
+                self.postprocess_stats.record(time.perf_counter() - started)
+                if keep_going is False:
+                    break
+
+                if self.report_interval and time.perf_counter() - last_report >= self.report_interval:
+                    self.report()
+                    last_report = time.perf_counter()
+        finally:
+            self.stop()
+
+        if self.error is not None:
+            raise self.error
+
+    def stop(self):
+        self.stop_event.set()
+        for thread in self.threads:
+            if thread.is_alive() and thread is not threading.current_thread():
+                thread.join(timeout=2.0)
+
+    def stats(self):
+        return [self.capture_stats, self.inference_stats, self.postprocess_stats]
+
+    def report(self):
+        for stage in self.stats():
+            logging.info(f"[pipeline] {stage.summary()}")
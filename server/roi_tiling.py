@@ -0,0 +1,136 @@
+import numpy as np
+
+
+def lot_roi(bounds, frame_shape, margin=0.1):
+    """
+    Return the padded union of all spot rects as an (x1, y1, x2, y2) frame crop.
+
+    Args:
+        bounds: List of (x, y, w, h) spot bounding rects in frame space
+        frame_shape: Shape of the frame the rects belong to
+        margin: Padding as a fraction of the union's width/height, so cars
+            overhanging the outer spots are still fully visible
+    """
+    h, w = frame_shape[:2]
+    rects = np.asarray(bounds, dtype=np.int64).reshape(-1, 4)
+    if len(rects) == 0:
+        return (0, 0, w, h)
+
+    x1 = int(rects[:, 0].min()); y1 = int(rects[:, 1].min())
+    x2 = int((rects[:, 0] + rects[:, 2]).max()); y2 = int((rects[:, 1] + rects[:, 3]).max())
+    pad_x = int((x2 - x1) * margin); pad_y = int((y2 - y1) * margin)
+    return (max(x1 - pad_x, 0), max(y1 - pad_y, 0), min(x2 + pad_x, w), min(y2 + pad_y, h))
+
+
+def intersect(a, b):
+    """Intersection of two (x1, y1, x2, y2) regions, or None when they do not overlap."""
+    x1 = max(a[0], b[0]); y1 = max(a[1], b[1])
+    x2 = min(a[2], b[2]); y2 = min(a[3], b[3])
+    if x2 <= x1 or y2 <= y1:
+        return None
+    return (x1, y1, x2, y2)
+
+
+def _axis_starts(start, end, tile, step):
+    # Evenly spread the fewest tiles that cover [start, end) with at most `step` between starts
+    if end - start <= tile:
+        return [start]
+    count = -(-(end - start - tile) // step) + 1
+    return [int(round(s)) for s in np.linspace(start, end - tile, count)]
+
+
+def plan_tiles(region, tile_size=640, overlap=0.2, max_scale=2.0, max_tiles=4, spot_index=None):
+    """
+    Split a region into a small set of overlapping inference tiles.
+
+    Regions whose longest side is at most `tile_size * max_scale` are returned
+    whole, since downsampling them to the model input costs little recall.
+    Larger regions are cut into square tiles overlapping by `overlap`. Tiles
+    start at `tile_size` pixels and grow until at most `max_tiles` are needed,
+    so CPU cost stays bounded on very large frames. Tiles that touch no spot
+    (per `spot_index`) are dropped.
+
+    Returns:
+        List of (x1, y1, x2, y2) tiles in frame space
+    """
+    x1, y1, x2, y2 = region
+    if max(x2 - x1, y2 - y1) <= tile_size * max_scale:
+        return [region]
+
+    window = int(tile_size)
+    while True:
+        step = max(int(window * (1.0 - overlap)), 1)
+        xs = _axis_starts(x1, x2, window, step)
+        ys = _axis_starts(y1, y2, window, step)
+        if len(xs) * len(ys) <= max_tiles:
+            break
+        window = int(window * 1.25)
+
+    tiles = []
+    for ty in ys:
+        for tx in xs:
+            tile = (tx, ty, min(tx + window, x2), min(ty + window, y2))
+            if spot_index is not None and spot_index.query(tile).size == 0:
+                continue
+            tiles.append(tile)
+    return tiles
+
+
+def _in_overlap_band(region, a_tiles, b_tiles):
+    # True when `region` reaches into the area shared by a tile of each side
+    for a in a_tiles:
+        for b in b_tiles:
+            band = intersect(a, b)
+            if band is not None and intersect(region, band) is not None:
+                return True
+    return False
+
+
+def merge_tiled_boxes(parts, tiles, containment=0.6):
+    """
+    Merge duplicate detections produced by overlapping tiles.
+
+    A car cut by a tile edge shows up as a partial box in one tile and a full
+    box in its neighbour. Two boxes are fused into their union only when they
+    come from different tiles, meet inside the band where those tiles overlap,
+    and their intersection covers at least `containment` of the smaller box.
+    Boxes from the same tile are never merged: the model already suppressed
+    duplicates there, so overlapping boxes are adjacent cars.
+
+    Args:
+        parts: One (M_i, 4) int array of (x1, y1, x2, y2) boxes per tile, in frame space
+        tiles: The (x1, y1, x2, y2) tile each part was detected in
+
+    Returns:
+        (K, 4) int array with K <= sum(M_i)
+    """
+    # Each box keeps the tiles it was seen in, so a fused box is not merged again with their boxes
+    merged = [
+        (list(box), {tuple(tile)})
+        for part, tile in zip(parts, tiles)
+        for box in np.asarray(part, dtype=np.int64).reshape(-1, 4)
+    ]
+    changed = True
+    while changed:
+        changed = False
+        for i in range(len(merged)):
+            for j in range(i + 1, len(merged)):
+                (a, a_tiles), (b, b_tiles) = merged[i], merged[j]
+                if a_tiles & b_tiles:
+                    continue
+                overlap = intersect(a, b)
+                if overlap is None or not _in_overlap_band(overlap, a_tiles, b_tiles):
+                    continue
+                inter = (overlap[2] - overlap[0]) * (overlap[3] - overlap[1])
+                smaller = min((a[2] - a[0]) * (a[3] - a[1]), (b[2] - b[0]) * (b[3] - b[1]))
+                if smaller > 0 and inter / smaller >= containment:
+                    merged[i] = (
+                        [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])],
+                        a_tiles | b_tiles
+                    )
+                    del merged[j]
+                    changed = True
+                    break
+            if changed:
+                break
+    return np.array([box for box, _ in merged], dtype=np.int64).reshape(-1, 4)
@@ -0,0 +1,111 @@
+import numpy as np
+
+
+class SpotGridIndex:
+    """Uniform grid over spot bounding rects for pruning overlap candidates.
+
+    Spots are bucketed into every grid cell their rect touches and the
+    buckets are packed into CSR arrays (`cell_start`, `cell_spots`). A box
+    query only visits the cells under the box, so the per-frame cost grows
+    with the number of detections instead of detections x spots.
+    """
+
+    def __init__(self, bounds, cell_size=None):
+        """
+        Build the grid from spot rects.
+
+        Args:
+            bounds: List of (x, y, w, h) spot bounding rects in frame space
+            cell_size: Grid cell edge in pixels (default: median spot extent)
+        """
+        count = len(bounds)
+        self.rects = np.asarray(bounds, dtype=np.int64).reshape(count, 4)
+
+        if count == 0:
+            self.origin = (0, 0)
+            self.cell_size = 1
+            self.cols = self.rows = 0
+            self.cell_start = np.zeros(1, dtype=np.int64)
+            self.cell_spots = np.zeros(0, dtype=np.int64)
+            return
+
+        if cell_size is None:
+            cell_size = int(np.median(np.maximum(self.rects[:, 2], self.rects[:, 3])))
+        self.cell_size = max(int(cell_size), 1)
+
+        x0 = int(self.rects[:, 0].min())
+        y0 = int(self.rects[:, 1].min())
+        x1 = int((self.rects[:, 0] + self.rects[:, 2]).max())
+        y1 = int((self.rects[:, 1] + self.rects[:, 3]).max())
+        self.origin = (x0, y0)
+        self.cols = (x1 - x0) // self.cell_size + 1
+        self.rows = (y1 - y0) // self.cell_size + 1
+
+        cells, owners = [], []
+        for index, (x, y, w, h) in enumerate(self.rects):
+            cx1, cy1 = self._cell(x, y)
+            cx2, cy2 = self._cell(x + w, y + h)
+            cy, cx = np.mgrid[cy1:cy2 + 1, cx1:cx2 + 1]
+            ids = (cy * self.cols + cx).ravel()
+            cells.append(ids)
+            owners.append(np.full(ids.size, index, dtype=np.int64))
+
+        cells = np.concatenate(cells)
+        owners = np.concatenate(owners)
+        order = np.argsort(cells, kind="stable")
+        self.cell_spots = owners[order]
+        counts = np.bincount(cells, minlength=self.rows * self.cols)
+        self.cell_start = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+
+    def _cell(self, x, y):
+        cx = (int(x) - self.origin[0]) // self.cell_size
+        cy = (int(y) - self.origin[1]) // self.cell_size
+        return (min(max(cx, 0), self.cols - 1), min(max(cy, 0), self.rows - 1))
+
+    def query(self, box):
+        """Return the indices of spots whose rect intersects box (x1, y1, x2, y2)."""
+        if self.cols == 0:
+            return np.zeros(0, dtype=np.int64)
+
+        bx1, by1, bx2, by2 = (int(v) for v in box)
+        x0, y0 = self.origin
+        grid_x2 = x0 + self.cols * self.cell_size
+        grid_y2 = y0 + self.rows * self.cell_size
+        if bx2 <= x0 or by2 <= y0 or bx1 >= grid_x2 or by1 >= grid_y2:
+            return np.zeros(0, dtype=np.int64)
+
+        cx1, cy1 = self._cell(bx1, by1)
+        cx2, cy2 = self._cell(bx2, by2)
+        parts = []
+        for cy in range(cy1, cy2 + 1):
+            row = cy * self.cols
+            start = self.cell_start[row + cx1]
+            end = self.cell_start[row + cx2 + 1]
+            parts.append(self.cell_spots[start:end])
+        candidates = np.unique(np.concatenate(parts))
+
+        rects = self.rects[candidates]
+        hit = ((rects[:, 0] < bx2) & (rects[:, 0] + rects[:, 2] > bx1) &
+               (rects[:, 1] < by2) & (rects[:, 1] + rects[:, 3] > by1))
+        return candidates[hit]
+
+    def candidate_pairs(self, boxes):
+        """
+        Collect every (spot, box) pair whose rects intersect.
+
+        Args:
+            boxes: (M, 4) integer array of (x1, y1, x2, y2) boxes
+
+        Returns:
+            Tuple of equally sized index arrays (spot_idx, box_idx)
+        """
+        spot_parts, box_parts = [], []
+        for box_index, box in enumerate(np.asarray(boxes).reshape(-1, 4)):
+            spots = self.query(box)
+            spot_parts.append(spots)
+            box_parts.append(np.full(spots.size, box_index, dtype=np.int64))
+
+        if not spot_parts:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty
+        return np.concatenate(spot_parts), np.concatenate(box_parts)
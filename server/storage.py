@@ -0,0 +1,463 @@
+from datetime import datetime
+import copy
+import json
+import logging
+import sqlite3
+import threading
+
+from lot_counters import absolute_counts, apply_fields, count_batch, spot_types
+from occupancy_history import classify, hour_start, interval_start, split_by_hour
+
+
+def build_lot_definition(lot_id, name, spots, image_width, image_height):
+    """
+    Build a lot definition document with coordinates normalized to [0, 1].
+
+    Args:
+        lot_id: Unique lot identifier
+        name: Lot name/description
+        spots: List of spot dictionaries with id and coordinates
+        image_width: Width of reference image for normalization
+        image_height: Height of reference image for normalization
+    """
+    normalized_spots = []
+    for spot in spots:
+        polygon = []
+        for coord in spot["coordinates"]:
+            polygon.append({
+                "x": float(coord[0]) / image_width,
+                "y": float(coord[1]) / image_height
+            })
+
+        normalized_spots.append({
+            "spot_id": str(spot["id"]),
+            "type": "standard",
+            "polygon": polygon
+        })
+
+    return {
+        "lot_id": lot_id,
+        "name": name,
+        "spots": normalized_spots,
+        "image_width": image_width,
+        "image_height": image_height,
+        "created_at": datetime.utcnow(),
+        "updated_at": datetime.utcnow()
+    }
+
+
+class ParkingStore:
+    """Storage interface used by YOLODetector, CoordinatesGenerator and the write-behind publisher."""
+
+    def save_lot_definition(self, lot_id, name, spots, image_width, image_height):
+        raise NotImplementedError
+
+    def get_lot_definition(self, lot_id):
+        raise NotImplementedError
+
+    def update_spot_status(self, lot_id, spot_id, occupied, video_file=None):
+        """Update a single spot; see update_spot_statuses()."""
+        return self.update_spot_statuses(lot_id, {spot_id: occupied}, video_file=video_file)
+
+    def update_spot_statuses(self, lot_id, changes, video_file=None, timestamps=None):
+        raise NotImplementedError
+
+    def roll_history(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class _HourlyRollups:
+    """In-process hourly rollups for the embedded stores.
+
+    Mirrors OccupancyHistory's `occupancy-hourly` documents (occupied_seconds,
+    arrivals, total_spots per lot and hour) without the per-spot buckets.
+    Open intervals are read from the stored spot documents (`credited_until`),
+    as in OccupancyHistory. Subclasses provide `_current_state`, `_put_state`
+    and `_add_hourly`, and call these helpers under their write lock.
+    """
+
+    def _init_rollups(self):
+        self.total_spots = {}
+        self.spot_types = {}
+        # lot_id -> lot-status `layout` the cached spot types belong to
+        self.layouts = {}
+        self.current_hour = None
+
+    def _track_lot(self, lot_id, layout=None):
+        # Another process sharing the file may have saved the definition since
+        if lot_id not in self.total_spots or self.layouts.get(lot_id) != layout:
+            lot = self.get_lot_definition(lot_id)
+            self.total_spots[lot_id] = len(lot.get("spots", [])) if lot else 0
+            self.spot_types[lot_id] = spot_types(lot)
+            self.layouts[lot_id] = layout
+
+    def _occupied(self, lot_id):
+        return {spot_id for spot_id, doc in self._current_state(lot_id).items() if doc.get("occupied")}
+
+    def _reset_counters(self, lot_definition, status):
+        """Recompute a lot-status dict's counters after the lot definition was saved."""
+        lot_id = lot_definition["lot_id"]
+        self.total_spots[lot_id] = len(lot_definition["spots"])
+        self.spot_types[lot_id] = spot_types(lot_definition)
+        status.pop("by_type", None)
+        status["name"] = lot_definition["name"]
+        status["layout"] = self.layouts[lot_id] = status.get("layout", 0) + 1
+        return apply_fields(status, absolute_counts(self.spot_types[lot_id], self._occupied(lot_id)))
+
+    def _spot_docs(self, lot_id, changes, timestamps, video_file, version, previous, transitions):
+        """New spot documents for a batch; unchanged intervals keep their `credited_until`."""
+        docs = []
+        for spot_id, occupied in changes.items():
+            credited_until = transitions.credited_until.get(
+                spot_id, (previous.get(spot_id) or {}).get("credited_until")
+            )
+            docs.append({
+                "lot_id": lot_id,
+                "spot_id": spot_id,
+                "occupied": occupied,
+                "last_updated": timestamps[spot_id],
+                "video_source": video_file,
+                "version": version,
+                "credited_until": credited_until if occupied else None
+            })
+        return docs
+
+    def _credit(self, credits, lot_id, start, end):
+        for bucket, seconds in split_by_hour(start, end):
+            key = (lot_id, bucket)
+            credits[key] = credits.get(key, 0.0) + seconds
+
+    def _record(self, lot_id, transitions):
+        credits, arrivals = {}, {}
+        for timestamp in transitions.arrivals.values():
+            key = (lot_id, hour_start(timestamp))
+            arrivals[key] = arrivals.get(key, 0) + 1
+        for start, end in transitions.departures.values():
+            self._credit(credits, lot_id, start, end)
+        self._write_rollups(credits, arrivals)
+
+    def _write_rollups(self, credits, arrivals):
+        for key in set(credits) | set(arrivals):
+            lot_id, bucket = key
+            self._add_hourly(lot_id, bucket, credits.get(key, 0.0), arrivals.get(key, 0),
+                             self.total_spots.get(lot_id, 0))
+
+    def roll_history(self, now=None):
+        """Credit still-occupied spots to the hourly rollups once an hour has finished."""
+        boundary = hour_start(now or datetime.utcnow())
+        if self.current_hour == boundary:
+            return
+        credits = {}
+        for lot_id in self.total_spots:
+            for doc in self._current_state(lot_id).values():
+                since = interval_start(doc) if doc.get("occupied") else boundary
+                if since < boundary:
+                    self._credit(credits, lot_id, since, boundary)
+                    self._put_state(dict(doc, credited_until=boundary))
+        self._write_rollups(credits, {})
+        self.current_hour = boundary
+
+
+class MemoryParkingDB(_HourlyRollups, ParkingStore):
+    """Process-local store for benchmarks and tests; nothing is persisted."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.lots = {}
+        self.occupancy = {}   # lot_id -> {spot_id: doc}
+        self.hourly = {}      # lot_id -> {hour: doc}
+        self.status = {}      # lot_id -> lot-status doc (change counter, occupancy counters)
+        self._init_rollups()
+        logging.info("Using in-memory parking store")
+
+    def save_lot_definition(self, lot_id, name, spots, image_width, image_height):
+        lot_definition = build_lot_definition(lot_id, name, spots, image_width, image_height)
+        with self.lock:
+            previous = self.lots.get(lot_id)
+            if previous:
+                lot_definition["created_at"] = previous["created_at"]
+            self.lots[lot_id] = copy.deepcopy(lot_definition)
+            self._reset_counters(lot_definition, self.status.setdefault(lot_id, {"lot_id": lot_id, "version": 0}))
+        logging.info(f"Saved lot definition: {lot_id} with {len(lot_definition['spots'])} spots")
+        return lot_definition
+
+    def get_lot_definition(self, lot_id):
+        return copy.deepcopy(self.lots.get(lot_id))
+
+    def _current_state(self, lot_id, spot_ids=None):
+        state = self.occupancy.get(lot_id, {})
+        if spot_ids is None:
+            return state
+        return {spot_id: state[spot_id] for spot_id in spot_ids if spot_id in state}
+
+    def _put_state(self, doc):
+        self.occupancy.setdefault(doc["lot_id"], {})[doc["spot_id"]] = doc
+
+    def _add_hourly(self, lot_id, hour, seconds, arrivals, total_spots):
+        rollup = self.hourly.setdefault(lot_id, {}).setdefault(hour, {
+            "lot_id": lot_id, "hour": hour, "occupied_seconds": 0.0, "arrivals": 0, "total_spots": 0
+        })
+        rollup["occupied_seconds"] += seconds
+        rollup["arrivals"] += arrivals
+        rollup["total_spots"] = max(rollup["total_spots"], total_spots)
+
+    def update_spot_statuses(self, lot_id, changes, video_file=None, timestamps=None):
+        changes = dict(changes)
+        if not changes:
+            return 0
+
+        timestamp = datetime.utcnow()
+        timestamps = {spot_id: (timestamps or {}).get(spot_id, timestamp) for spot_id in changes}
+        with self.lock:
+            status = self.status.setdefault(lot_id, {"lot_id": lot_id, "version": 0})
+            self._track_lot(lot_id, status.get("layout"))
+            previous = self._current_state(lot_id, changes)
+            transitions = classify(changes, timestamps, previous)
+            status["version"] += 1
+            status["updated_at"] = timestamp
+            for doc in self._spot_docs(lot_id, changes, timestamps, video_file, status["version"],
+                                       previous, transitions):
+                self._put_state(doc)
+            occupied_before = {spot_id for spot_id, doc in previous.items() if doc.get("occupied")}
+            count_batch(status, self.spot_types[lot_id], changes, occupied_before,
+                        lambda: self._occupied(lot_id))
+            self._record(lot_id, transitions)
+        return len(changes)
+
+    def roll_history(self, now=None):
+        with self.lock:
+            super().roll_history(now)
+
+
+# The SQLite layout and JSON encoding are shared with backend/database/storage.py,
+# so the detector and the API can run against the same file at an edge site.
+# Both sides refuse a file whose schema differs from their copy; run
+# `python -m database.storage --check-schema` in backend/ to compare the copies.
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (firebase_id TEXT PRIMARY KEY, doc TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS preferences (firebase_id TEXT PRIMARY KEY, doc TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS lots (lot_id TEXT PRIMARY KEY, doc TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS occupancy (
+    lot_id TEXT NOT NULL, spot_id TEXT NOT NULL, doc TEXT NOT NULL,
+    PRIMARY KEY (lot_id, spot_id)
+);
+CREATE INDEX IF NOT EXISTS occupancy_lot_version ON occupancy (lot_id, json_extract(doc, '$.version'));
+CREATE TABLE IF NOT EXISTS lot_status (lot_id TEXT PRIMARY KEY, doc TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS occupancy_hourly (
+    lot_id TEXT NOT NULL, hour TEXT NOT NULL, doc TEXT NOT NULL,
+    PRIMARY KEY (lot_id, hour)
+);
+"""
+
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return {"$date": value.isoformat()}
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _decode(obj):
+    if len(obj) == 1 and "$date" in obj:
+        return datetime.fromisoformat(obj["$date"])
+    return obj
+
+
+def check_sqlite_schema(conn, path):
+    """Raise if a SQLite file holds tables or indexes other than SQLITE_SCHEMA's (see the backend's copy)."""
+    reference = sqlite3.connect(":memory:")
+    try:
+        reference.executescript(SQLITE_SCHEMA)
+        query = "SELECT name, sql FROM sqlite_master WHERE name NOT LIKE 'sqlite_%'"
+        expected, actual = dict(reference.execute(query)), dict(conn.execute(query))
+    finally:
+        reference.close()
+    drifted = sorted(name for name in set(expected) | set(actual) if expected.get(name) != actual.get(name))
+    if drifted:
+        raise RuntimeError(f"SQLite file {path} does not match SQLITE_SCHEMA: {', '.join(drifted)}")
+
+
+def dumps(doc):
+    return json.dumps(doc, default=_encode)
+
+
+def loads(text):
+    return json.loads(text, object_hook=_decode) if text is not None else None
+
+
+class SQLiteParkingDB(_HourlyRollups, ParkingStore):
+    """Embedded SQLite store (WAL mode) for edge sites without a MongoDB server."""
+
+    def __init__(self, path):
+        """
+        Args:
+            path: SQLite database file (created if missing)
+        """
+        self.path = path
+        self.lock = threading.RLock()
+        # The write-behind thread and the frame loop share one connection, serialized by the lock
+        self.conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SQLITE_SCHEMA)
+        check_sqlite_schema(self.conn, path)
+        self._init_rollups()
+        logging.info(f"Connected to SQLite: {path}")
+
+    def save_lot_definition(self, lot_id, name, spots, image_width, image_height):
+        lot_definition = build_lot_definition(lot_id, name, spots, image_width, image_height)
+        with self.lock, self.conn:
+            self._begin()
+            previous = self._get_lot(lot_id)
+            if previous:
+                lot_definition["created_at"] = previous["created_at"]
+            self.conn.execute(
+                "INSERT OR REPLACE INTO lots (lot_id, doc) VALUES (?, ?)",
+                (lot_id, dumps(lot_definition))
+            )
+            self._save_status(self._reset_counters(lot_definition, self._get_status(lot_id)))
+        logging.info(f"Saved lot definition: {lot_id} with {len(lot_definition['spots'])} spots")
+        return lot_definition
+
+    def _get_lot(self, lot_id):
+        row = self.conn.execute("SELECT doc FROM lots WHERE lot_id = ?", (lot_id,)).fetchone()
+        return loads(row[0]) if row else None
+
+    def get_lot_definition(self, lot_id):
+        with self.lock:
+            return self._get_lot(lot_id)
+
+    def _begin(self):
+        # Take the write lock up front: the stored state a batch is judged
+        # against must not change before it commits, even from another process
+        self.conn.execute("BEGIN IMMEDIATE")
+
+    def _current_state(self, lot_id, spot_ids=None):
+        if spot_ids is None:
+            rows = self.conn.execute("SELECT spot_id, doc FROM occupancy WHERE lot_id = ?", (lot_id,))
+        else:
+            spot_ids = list(spot_ids)
+            rows = self.conn.execute(
+                "SELECT spot_id, doc FROM occupancy WHERE lot_id = ? AND spot_id IN "
+                "(SELECT value FROM json_each(?))",
+                (lot_id, json.dumps(spot_ids))
+            )
+        return {spot_id: loads(doc) for spot_id, doc in rows}
+
+    def _put_state(self, doc):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO occupancy (lot_id, spot_id, doc) VALUES (?, ?, ?)",
+            (doc["lot_id"], doc["spot_id"], dumps(doc))
+        )
+
+    def _add_hourly(self, lot_id, hour, seconds, arrivals, total_spots):
+        key = hour.isoformat()
+        row = self.conn.execute(
+            "SELECT doc FROM occupancy_hourly WHERE lot_id = ? AND hour = ?", (lot_id, key)
+        ).fetchone()
+        rollup = loads(row[0]) if row else {
+            "lot_id": lot_id, "hour": hour, "occupied_seconds": 0.0, "arrivals": 0, "total_spots": 0
+        }
+        rollup["occupied_seconds"] += seconds
+        rollup["arrivals"] += arrivals
+        rollup["total_spots"] = max(rollup["total_spots"], total_spots)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO occupancy_hourly (lot_id, hour, doc) VALUES (?, ?, ?)",
+            (lot_id, key, dumps(rollup))
+        )
+
+    def update_spot_statuses(self, lot_id, changes, video_file=None, timestamps=None):
+        changes = dict(changes)
+        if not changes:
+            return 0
+
+        timestamp = datetime.utcnow()
+        timestamps = {spot_id: (timestamps or {}).get(spot_id, timestamp) for spot_id in changes}
+        with self.lock, self.conn:
+            self._begin()
+            status = self._get_status(lot_id)
+            self._track_lot(lot_id, status.get("layout"))
+            previous = self._current_state(lot_id, changes)
+            transitions = classify(changes, timestamps, previous)
+            status["version"] += 1
+            status["updated_at"] = timestamp
+            # One transaction per batch instead of one per spot
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO occupancy (lot_id, spot_id, doc) VALUES (?, ?, ?)",
+                [
+                    (lot_id, doc["spot_id"], dumps(doc))
+                    for doc in self._spot_docs(lot_id, changes, timestamps, video_file, status["version"],
+                                               previous, transitions)
+                ]
+            )
+            # Version, counters and rollups land in the same transaction as the spots
+            occupied_before = {spot_id for spot_id, doc in previous.items() if doc.get("occupied")}
+            self._save_status(count_batch(status, self.spot_types[lot_id], changes, occupied_before,
+                                          lambda: self._occupied(lot_id)))
+            self._record(lot_id, transitions)
+        return len(changes)
+
+    def _get_status(self, lot_id):
+        row = self.conn.execute("SELECT doc FROM lot_status WHERE lot_id = ?", (lot_id,)).fetchone()
+        return loads(row[0]) if row else {"lot_id": lot_id, "version": 0}
+
+    def _save_status(self, status):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO lot_status (lot_id, doc) VALUES (?, ?)", (status["lot_id"], dumps(status))
+        )
+
+    def roll_history(self, now=None):
+        now = now or datetime.utcnow()
+        with self.lock:
+            if self.current_hour == hour_start(now):
+                return
+            with self.conn:
+                self._begin()
+                super().roll_history(now)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+        logging.info("SQLite connection closed")
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def open_parking_db(uri=None, db_name="mac-a-park-db"):
+    """
+    Return the process-wide parking store for a URI, opening it on first use:
+        mongodb://... or mongodb+srv://...  -> ParkingDB (MongoDB)
+        sqlite:///path/to/file.db           -> SQLiteParkingDB
+        memory://                           -> MemoryParkingDB
+
+    CoordinatesGenerator, YOLODetector and the write-behind publisher in one
+    process therefore share a single client and connection pool.
+    """
+    uri = uri or "mongodb://localhost:27017/"
+    key = (uri, db_name)
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            if uri.startswith("sqlite:///"):
+                store = SQLiteParkingDB(uri[len("sqlite:///"):])
+            elif uri.startswith("memory://"):
+                store = MemoryParkingDB()
+            elif uri.startswith("mongodb"):
+                from mongo_db import ParkingDB
+                store = ParkingDB(connection_string=uri, db_name=db_name)
+            else:
+                raise ValueError(f"Unsupported storage URI: {uri}")
+            _stores[key] = store
+        return store
+
+
+def close_parking_dbs():
+    """Close every store opened through open_parking_db()."""
+    with _stores_lock:
+        for store in _stores.values():
+            store.close()
+        _stores.clear()
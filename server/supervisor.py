@@ -0,0 +1,323 @@
+import logging
+import multiprocessing
+import os
+import queue
+import sys
+import time
+
+import yaml
+
+from yolo_detector import YOLODetector, YOLO
+
+
+def load_config(path):
+    """
+    Load a multi-camera configuration file.
+
+    Expected layout:
+        workers: 0                  # 0 = one worker per CPU core (capped by camera count)
+        model_path: yolov8n.pt
+        conf: 0.25
+        detector: {}                # extra YOLODetector keyword arguments
+        reconnect_max_backoff: 30   # seconds, cap between reconnects of a live source
+        cameras:
+          - source: rtsp://...      # video file, stream URL or device index
+            lot_id: lot-001         # several cameras may report parts of the same lot...
+            coordinates: parking_coords.yml  # ...each with its own spots
+            camera_id: gate-east    # optional, defaults to lot_id/index
+            live: true              # optional, defaults to true for URLs and device indices
+    """
+    with open(path, "r") as f:
+        config = yaml.safe_load(f) or {}
+
+    cameras = config.get("cameras") or []
+    if not cameras:
+        raise ValueError(f"No cameras defined in {path}")
+
+    for index, camera in enumerate(cameras):
+        if "source" not in camera or "coordinates" not in camera:
+            raise ValueError(f"Camera #{index} in {path} needs 'source' and 'coordinates'")
+        camera.setdefault("lot_id", None)
+        camera.setdefault("camera_id", f"{camera['lot_id'] or 'camera'}/{index}")
+
+    # Same lot and same spots: the cameras would overwrite each other's statuses
+    seen = {}
+    for camera in cameras:
+        key = (camera["lot_id"], camera["coordinates"])
+        if camera["lot_id"] is not None and key in seen:
+            logging.warning(
+                f"cameras {seen[key]} and {camera['camera_id']} both report {camera['coordinates']} "
+                f"of lot {camera['lot_id']}"
+            )
+        seen.setdefault(key, camera["camera_id"])
+
+    return config
+
+
+def assign_cameras(cameras, workers):
+    """Split cameras round-robin into `workers` groups (empty groups are dropped)."""
+    groups = [[] for _ in range(max(int(workers), 1))]
+    for index, camera in enumerate(cameras):
+        groups[index % len(groups)].append(camera)
+    return [group for group in groups if group]
+
+
+def _load_coordinates(path):
+    with open(path, "r") as data:
+        return yaml.safe_load(data) or []
+
+
+def _open_source(source):
+    # Device indices are given as integers (or digit strings) in the config
+    if isinstance(source, str) and source.isdigit():
+        return int(source)
+    return source
+
+
+def is_live(camera):
+    """Streams and devices are reconnected when a read fails; files end at EOF."""
+    if camera.get("live") is not None:
+        return bool(camera["live"])
+    source = _open_source(camera["source"])
+    if isinstance(source, int):
+        return True
+    return "://" in source and not source.startswith("file://")
+
+
+class CameraFeed:
+    """A worker's camera: its detector, capture and reconnect state.
+
+    A failed read on a live source releases the capture and reopens it after
+    an exponential backoff (1s, 2s, 4s ... up to `max_backoff`); a file
+    source is finished at its first failed read.
+    """
+
+    def __init__(self, camera_id, detector, live, max_backoff=30.0):
+        self.camera_id = camera_id
+        self.detector = detector
+        self.live = live
+        self.max_backoff = float(max_backoff)
+        self.capture = None
+        self.failures = 0
+        self.retry_at = 0.0
+        self.ended = False
+        if not live:
+            self.capture = detector.open_capture()
+
+    def _retry_later(self, now, reason):
+        self.failures += 1
+        delay = min(2 ** (self.failures - 1), self.max_backoff)
+        self.retry_at = now + delay
+        logging.warning(f"camera {self.camera_id} {reason}, reconnecting in {delay:.0f}s")
+
+    def read(self, now):
+        """Return the next frame, or None (source ended or waiting to reconnect)."""
+        if self.capture is None:
+            if self.ended or now < self.retry_at:
+                return None
+            try:
+                self.capture = self.detector.open_capture()
+            except Exception as e:
+                self._retry_later(now, f"could not be opened ({e})")
+                return None
+
+        result, frame = self.capture.read()
+        if frame is not None and result:
+            self.failures = 0
+            return frame
+
+        self.capture.release()
+        self.capture = None
+        if self.live:
+            self._retry_later(now, "lost its stream")
+        else:
+            logging.warning(f"camera {self.camera_id} ended")
+            self.ended = True
+        return None
+
+    def close(self):
+        if self.capture is not None:
+            self.capture.release()
+            self.capture = None
+
+
+def camera_worker(worker_id, cameras, settings, stats_queue, stop_event):
+    """
+    Serve several cameras from one process with a single YOLO model.
+
+    Each round reads one frame per camera, plans the inference windows of
+    every camera, and runs all of them through the model in one predict call.
+    Per-camera frame counts are reported to the supervisor.
+    """
+    logging.basicConfig(level=logging.INFO)
+    model = YOLO(settings.get("model_path", "yolov8n.pt"))
+    conf = float(settings.get("conf", 0.25))
+    detector_options = dict(settings.get("detector") or {})
+    detector_options["headless"] = True
+    report_interval = float(settings.get("report_interval", 10.0))
+    max_backoff = float(settings.get("reconnect_max_backoff", 30.0))
+    imgsz = int(detector_options.get("tile_size", 640))
+
+    feeds, detectors = [], []
+    for camera in cameras:
+        detector = YOLODetector(
+            _open_source(camera["source"]),
+            _load_coordinates(camera["coordinates"]),
+            int(camera.get("start_frame", 0)),
+            model_path=settings.get("model_path", "yolov8n.pt"),
+            conf=conf,
+            lot_id=camera["lot_id"],
+            use_db=settings.get("use_db", False),
+            mongo_uri=settings.get("mongo_uri"),
+            **detector_options
+        )
+        detector.prepare_spots()
+        detector.start_publisher()
+        detectors.append(detector)
+        feeds.append(CameraFeed(camera["camera_id"], detector, is_live(camera), max_backoff))
+
+    logging.info(f"[worker {worker_id}] serving {len(feeds)} cameras: {[f.camera_id for f in feeds]}")
+    counts = {feed.camera_id: 0 for feed in feeds}
+    frame_index = 0
+    last_report = time.perf_counter()
+
+    try:
+        # Only file sources ever finish; live ones keep reconnecting until the supervisor stops
+        while feeds and not stop_event.is_set():
+            now = time.monotonic()
+            frames = []
+            for feed in list(feeds):
+                frame = feed.read(now)
+                if frame is not None:
+                    frames.append((feed, frame))
+                elif feed.ended:
+                    feeds.remove(feed)
+
+            if frames:
+                frame_index += 1
+                # One predict call for every camera served by this worker
+                plans, images = [], []
+                for feed, frame in frames:
+                    jobs = feed.detector.plan_inference([frame])
+                    plans.append(jobs)
+                    images.extend(feed.detector.crop_jobs([frame], jobs))
+
+                results = model.predict(images, conf=conf, imgsz=imgsz, verbose=False) if images else []
+
+                offset = 0
+                for (feed, frame), jobs in zip(frames, plans):
+                    outputs = feed.detector.assemble_outputs(model, 1, jobs, results[offset:offset + len(jobs)])
+                    offset += len(jobs)
+                    feed.detector.postprocess(frame_index, frame, outputs[0])
+                    counts[feed.camera_id] += 1
+            elif feeds:
+                # Every remaining camera is waiting to reconnect
+                next_retry = min(feed.retry_at for feed in feeds)
+                stop_event.wait(min(max(next_retry - time.monotonic(), 0.05), 1.0))
+
+            if time.perf_counter() - last_report >= report_interval:
+                stats_queue.put((worker_id, time.perf_counter() - last_report, dict(counts)))
+                counts = dict.fromkeys(counts, 0)
+                last_report = time.perf_counter()
+    finally:
+        for feed in feeds:
+            feed.close()
+        for detector in detectors:
+            detector.stop_publisher()
+        if settings.get("use_db"):
+            # The worker's cameras share one store (and connection pool) per process
+            from storage import close_parking_dbs
+            close_parking_dbs()
+
+
+class Supervisor:
+    """Runs many camera detectors across a pool of worker processes.
+
+    Cameras are split round-robin over `workers` processes (one per CPU core
+    by default). Each worker loads the YOLO model once. Workers that crash are
+    restarted with exponential backoff, and per-camera FPS is logged from the
+    counts the workers report.
+    """
+
+    def __init__(self, config, workers=None, max_backoff=60.0):
+        self.config = config
+        cameras = config["cameras"]
+        requested = workers or int(config.get("workers") or 0) or (os.cpu_count() or 1)
+        self.groups = assign_cameras(cameras, min(requested, len(cameras)))
+        self.max_backoff = max_backoff
+
+        self.context = multiprocessing.get_context("spawn")
+        self.stats_queue = self.context.Queue()
+        self.stop_event = self.context.Event()
+        self.processes = {}
+        self.restarts = {}
+        self.next_start = {}
+
+    def _settings(self):
+        keys = ("model_path", "conf", "detector", "use_db", "mongo_uri", "report_interval",
+                "reconnect_max_backoff")
+        return {k: self.config[k] for k in keys if k in self.config}
+
+    def _start(self, worker_id):
+        process = self.context.Process(
+            target=camera_worker,
+            args=(worker_id, self.groups[worker_id], self._settings(), self.stats_queue, self.stop_event),
+            name=f"camera-worker-{worker_id}",
+            daemon=True)
+        process.start()
+        self.processes[worker_id] = process
+
+    def _check_workers(self):
+        now = time.monotonic()
+        for worker_id, process in list(self.processes.items()):
+            if process.is_alive():
+                continue
+            if process.exitcode == 0:
+                logging.info(f"[supervisor] worker {worker_id} finished")
+                del self.processes[worker_id]
+                continue
+
+            if worker_id not in self.next_start:
+                self.restarts[worker_id] = self.restarts.get(worker_id, 0) + 1
+                delay = min(2 ** (self.restarts[worker_id] - 1), self.max_backoff)
+                self.next_start[worker_id] = now + delay
+                logging.error(f"[supervisor] worker {worker_id} crashed (exit code {process.exitcode}), "
+                              f"restarting in {delay:.0f}s")
+            elif now >= self.next_start[worker_id]:
+                del self.next_start[worker_id]
+                self._start(worker_id)
+
+    def _drain_stats(self):
+        while True:
+            try:
+                worker_id, seconds, counts = self.stats_queue.get_nowait()
+            except queue.Empty:
+                return
+            for camera_id, frames in counts.items():
+                logging.info(f"[supervisor] {camera_id}: {frames / seconds:.1f} FPS (worker {worker_id})")
+
+    def run(self):
+        logging.info(f"[supervisor] starting {len(self.groups)} workers for {len(self.config['cameras'])} cameras")
+        for worker_id in range(len(self.groups)):
+            self._start(worker_id)
+
+        try:
+            while self.processes:
+                self._check_workers()
+                self._drain_stats()
+                time.sleep(1.0)
+        except KeyboardInterrupt:
+            logging.info("[supervisor] stopping workers")
+        finally:
+            self.stop_event.set()
+            for process in self.processes.values():
+                process.join(timeout=5.0)
+                if process.is_alive():
+                    process.terminate()
+            self._drain_stats()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    config_path = sys.argv[1] if len(sys.argv) > 1 else os.getenv("CAMERAS_CONFIG", "cameras.yml")
+    Supervisor(load_config(config_path)).run()
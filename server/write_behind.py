@@ -0,0 +1,163 @@
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+
+class WriteBehindPublisher:
+    """Asynchronous write-behind queue between the detector and MongoDB.
+
+    `submit()` only records the latest state per (lot_id, spot_id) under a
+    lock, so the frame loop never waits on the database. A background thread
+    flushes the pending states with `ParkingDB.update_spot_statuses` when
+    `flush_size` keys are pending or `flush_interval` seconds have passed.
+    If a flush fails, the part of the batch not written yet is appended to a
+    JSONL spill file. The spill file is replayed, coalesced with newer states,
+    once a flush succeeds again. A (lot, video source) group that failed
+    halfway is written again in full; `update_spot_statuses` recognises the
+    reports it already logged, so the replay does not count them twice.
+    """
+
+    def __init__(self, db, spill_path, flush_interval=1.0, flush_size=500, max_pending=10000,
+                 retry_interval=5.0):
+        """
+        Args:
+            db: ParkingDB (or compatible) exposing update_spot_statuses()
+            spill_path: JSONL file used to persist batches during outages
+            flush_interval: Maximum seconds between flushes
+            flush_size: Pending spot count that triggers an early flush
+            max_pending: Pending spot count above which pending states are spilled to disk
+            retry_interval: Seconds to wait before retrying after a failed flush
+        """
+        self.db = db
+        self.spill_path = spill_path
+        self.flush_interval = float(flush_interval)
+        self.flush_size = int(flush_size)
+        self.max_pending = int(max_pending)
+        self.retry_interval = float(retry_interval)
+
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self.retry_at = 0.0
+        self.flushed = 0
+        self.spilled = 0
+
+        self.thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self.thread.start()
+
+    def submit(self, lot_id, spot_id, occupied, video_file=None):
+        """Record the latest state of a spot; never blocks on the database."""
+        with self.lock:
+            self.pending[(lot_id, spot_id)] = (occupied, video_file, datetime.utcnow())
+            size = len(self.pending)
+        if size >= self.flush_size:
+            self.wakeup.set()
+
+    def _take_pending(self):
+        with self.lock:
+            batch, self.pending = self.pending, {}
+        return batch
+
+    def _write(self, batch):
+        # One bulk write per (lot, video source)
+        groups = {}
+        for (lot_id, spot_id), (occupied, video_file, timestamp) in batch.items():
+            changes, timestamps = groups.setdefault((lot_id, video_file), ({}, {}))
+            changes[spot_id] = occupied
+            timestamps[spot_id] = timestamp
+
+        for (lot_id, video_file), (changes, timestamps) in groups.items():
+            self.db.update_spot_statuses(lot_id, changes, video_file=video_file, timestamps=timestamps)
+            # Written: if a later group fails, only the rest is spilled and replayed
+            for spot_id in changes:
+                del batch[(lot_id, spot_id)]
+
+    def _spill(self, batch):
+        directory = os.path.dirname(self.spill_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.spill_path, "a") as f:
+            for (lot_id, spot_id), (occupied, video_file, timestamp) in batch.items():
+                f.write(json.dumps({
+                    "lot_id": lot_id,
+                    "spot_id": spot_id,
+                    "occupied": occupied,
+                    "video_source": video_file,
+                    "timestamp": timestamp.isoformat()
+                }) + "\n")
+        self.spilled += len(batch)
+
+    def _load_spill(self):
+        # Later lines win, so replaying the file yields the latest spilled state per spot
+        batch = {}
+        with open(self.spill_path, "r") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                batch[(entry["lot_id"], entry["spot_id"])] = (
+                    entry["occupied"],
+                    entry["video_source"],
+                    datetime.fromisoformat(entry["timestamp"])
+                )
+        return batch
+
+    def flush(self):
+        """Write pending (and previously spilled) states; spill them if MongoDB is unavailable."""
+        batch = self._take_pending()
+        if time.monotonic() < self.retry_at:
+            # Still backing off after a failure: keep memory bounded by spilling to disk
+            if len(batch) >= self.max_pending or self.stopping.is_set():
+                self._spill(batch)
+            else:
+                with self.lock:
+                    for key, value in batch.items():
+                        self.pending.setdefault(key, value)
+            return
+
+        replay = os.path.exists(self.spill_path)
+        if replay:
+            spilled = self._load_spill()
+            spilled.update(batch)
+            batch = spilled
+        if not batch:
+            return
+
+        size = len(batch)
+        try:
+            self._write(batch)
+        except Exception as e:
+            logging.error(f"Write-behind flush failed, spilling {len(batch)} updates to {self.spill_path}: {e}")
+            if replay:
+                os.remove(self.spill_path)
+            self._spill(batch)
+            self.retry_at = time.monotonic() + self.retry_interval
+            return
+
+        if replay:
+            os.remove(self.spill_path)
+            logging.info(f"Replayed spilled updates from {self.spill_path}")
+        self.flushed += size
+
+    def _run(self):
+        while not self.stopping.is_set():
+            self.wakeup.wait(timeout=self.flush_interval)
+            self.wakeup.clear()
+            try:
+                self.flush()
+                self.db.roll_history()
+            except Exception as e:
+                logging.error(f"Write-behind publisher error: {e}")
+
+    def close(self):
+        """Stop the worker and make a final flush attempt (spilling on failure)."""
+        self.stopping.set()
+        self.wakeup.set()
+        self.thread.join()
+        self.retry_at = 0.0
+        self.flush()
+        logging.info(f"Write-behind publisher: flushed {self.flushed} | spilled {self.spilled}")
@@ -1,5 +1,8 @@
 import numpy as np
 import logging
+import os
+import re
+from collections import namedtuple
 import cv2 as open_cv
 
 try:
@@ -8,14 +11,27 @@ except Exception:
     YOLO = None
 
 try:
-    from mongo_db import ParkingDB
+    from storage import open_parking_db
 except ImportError:
-    ParkingDB = None
+    open_parking_db = None
 
 from drawing_utils import draw_contours
+from overlap_engine import OverlapEngine
+from spatial_index import SpotGridIndex
+from pipeline import FramePipeline, DROP_OLDEST
+from motion_gate import MotionGate
+from dirty_regions import DirtySpotTracker
+from hysteresis import SpotHysteresis
+from write_behind import WriteBehindPublisher
+from annotated_writer import AnnotatedWriter
+from roi_tiling import intersect, lot_roi, plan_tiles, merge_tiled_boxes
 from colors import COLOR_BLUE, COLOR_GREEN, COLOR_WHITE
 
 
+# Vehicle boxes for one frame; `spots` limits evaluation to a boolean spot mask (None = all spots)
+FrameDetections = namedtuple("FrameDetections", ["boxes", "spots"])
+
+
 class YOLODetector:
     """YOLO-based parking spot occupancy detector.
 
@@ -29,7 +45,13 @@ class YOLODetector:
     # COCO vehicle class names (common)
     VEHICLE_NAMES = set(["car", "truck", "bus", "motorcycle", "bicycle"])
 
-    def __init__(self, video, coordinates, start_frame, model_path="yolov8n.pt", conf=0.25, lot_id=None, use_db=False, mongo_uri=None):
+    def __init__(self, video, coordinates, start_frame, model_path="yolov8n.pt", conf=0.25, lot_id=None, use_db=False, mongo_uri=None,
+                 pipelined=False, queue_size=4, drop_policy=DROP_OLDEST, batch_size=1, batch_timeout=0.05,
+                 motion_gate=False, motion_threshold=0.05, refresh_interval=30.0,
+                 dirty_regions=False, roi_inference=False, tile_size=640, tile_overlap=0.2, max_tiles=4,
+                 headless=False, output_video=None, annotate_every=5,
+                 hysteresis=False, enter_threshold=None, exit_threshold=None, min_dwell=5,
+                 write_behind=True, spill_dir="spill"):
         if YOLO is None:
             raise ImportError("ultralytics package is required for YOLO mode. Install with: pip install ultralytics")
 
@@ -43,22 +65,71 @@ class YOLODetector:
         self.db = None
         
         if use_db:
-            if ParkingDB is None:
-                logging.warning("MongoDB integration not available. Install pymongo.")
+            if open_parking_db is None:
+                logging.warning("Database integration not available. Install pymongo.")
             else:
                 try:
-                    self.db = ParkingDB(connection_string=mongo_uri )
+                    self.db = open_parking_db(mongo_uri)
                 except Exception as e:
-                    logging.error(f"Failed to connect to MongoDB: {e}")
+                    logging.error(f"Failed to open parking store: {e}")
                     self.db = None
 
         self.bounds = []
         self.masks = []
+        self.overlap_engine = None
+        self.spot_index = None
+        self.overlaps = None
+        self.statuses = []
+        self.previous_statuses = []
+
+        # Threaded capture -> inference -> post-process pipeline settings
+        self.pipelined = pipelined
+        self.queue_size = int(queue_size)
+        self.drop_policy = drop_policy
+
+        # Batched inference: up to batch_size frames per predict call, waiting at most batch_timeout seconds
+        self.batch_size = max(int(batch_size), 1)
+        self.batch_timeout = float(batch_timeout)
+
+        # Optional MOG2 gate: skip YOLO on frames without motion inside any spot
+        self.use_motion_gate = motion_gate
+        self.motion_threshold = float(motion_threshold)
+        self.refresh_interval = float(refresh_interval)
+        self.motion_gate = None
+
+        # Optional dirty-region tracking: re-evaluate only spots whose pixels changed
+        self.use_dirty_regions = dirty_regions
+        self.dirty_tracker = None
+
+        # Optional ROI inference: only the lot area goes through YOLO, tiled on high-resolution feeds
+        self.roi_inference = roi_inference
+        self.tile_size = int(tile_size)
+        self.tile_overlap = float(tile_overlap)
+        self.max_tiles = int(max_tiles)
+
+        # Headless mode skips all display work; annotated output is rendered by a background writer
+        self.headless = headless
+        self.output_video = output_video
+        self.annotate_every = int(annotate_every)
+        self.writer = None
+
+        # Optional per-spot hysteresis: enter/exit thresholds plus a minimum dwell in frames
+        self.use_hysteresis = hysteresis
+        self.enter_threshold = YOLODetector.OVERLAP_THRESHOLD if enter_threshold is None else float(enter_threshold)
+        self.exit_threshold = self.enter_threshold * 0.75 if exit_threshold is None else float(exit_threshold)
+        self.min_dwell = int(min_dwell)
+        self.hysteresis = None
+
+        # Write-behind publishing: DB writes happen on a background thread, spilled to disk during outages
+        self.write_behind = write_behind
+        self.spill_dir = spill_dir
+        self.publisher = None
+
+    def prepare_spots(self):
+        """Build per-spot masks, the overlap engine and the spatial index."""
+        if self.overlap_engine is not None:
+            return
 
-    def detect_yolo(self):
-        model = YOLO(self.model_path)
-
-        # prepare per-spot masks
         for p in self.coordinates_data:
             coords = np.array(p["coordinates"])  # Nx2
             rect = open_cv.boundingRect(coords)
@@ -78,6 +149,27 @@ class YOLODetector:
             self.bounds.append(rect)
             self.masks.append(mask)
 
+        self.overlap_engine = OverlapEngine(self.bounds, self.masks)
+        self.spot_index = SpotGridIndex(self.bounds)
+        if self.use_motion_gate:
+            self.motion_gate = MotionGate(
+                self.bounds,
+                min_foreground=self.motion_threshold,
+                refresh_interval=self.refresh_interval)
+        if self.use_dirty_regions:
+            self.dirty_tracker = DirtySpotTracker(self.bounds, refresh_interval=self.refresh_interval)
+        self.overlaps = np.zeros(len(self.coordinates_data), dtype=np.float64)
+        if self.use_hysteresis:
+            self.hysteresis = SpotHysteresis(
+                len(self.coordinates_data),
+                enter_threshold=self.enter_threshold,
+                exit_threshold=self.exit_threshold,
+                min_dwell=self.min_dwell)
+        # With hysteresis a spot is unknown (None, never published) until its first state dwelled
+        self.statuses = [None if self.use_hysteresis else False] * len(self.coordinates_data)
+        self.previous_statuses = [None] * len(self.coordinates_data)  # Track previous state
+
+    def open_capture(self):
         capture = open_cv.VideoCapture(self.video)
         
         # Check if video opened successfully
@@ -92,102 +184,264 @@ class YOLODetector:
         logging.info(f"Video: {self.video} | FPS: {fps} | Frames: {frame_count} | Resolution: {width}x{height}")
         
         capture.set(open_cv.CAP_PROP_POS_FRAMES, self.start_frame)
-
-        statuses = [False] * len(self.coordinates_data)
-        previous_statuses = [None] * len(self.coordinates_data)  # Track previous state
-        frame_count = 0
-
-        while capture.isOpened():
-            frame_count += 1
-            result, frame = capture.read()
-            if frame is None:
-                break
-
-            if not result:
-                raise Exception("Error reading video capture")
-
-            # Run YOLO on the frame
-            results = model.predict(frame, conf=self.conf, imgsz=640, verbose=False)
-
-            # collect vehicle boxes
-            boxes = []  # list of (x1,y1,x2,y2)
-            for r in results:
-                # r.boxes may be empty
-                boxes_data = getattr(r, "boxes", None)
-                if boxes_data is None:
+        return capture
+
+    def infer(self, model, frame):
+        """Run YOLO on a frame and return its FrameDetections (or None when skipped)."""
+        return self.infer_batch(model, [frame])[0]
+
+    def inference_regions(self, frame, crop=None):
+        """
+        Return the (x1, y1, x2, y2) windows of a frame that go through YOLO.
+
+        Without ROI inference this is the crop (or the whole frame). With it,
+        the window is first limited to the lot's spot area and, if still much
+        larger than the model input, cut into overlapping tiles.
+        """
+        h, w = frame.shape[:2]
+        region = crop if crop is not None else (0, 0, w, h)
+        if not self.roi_inference:
+            return [region]
+
+        region = intersect(region, lot_roi(self.bounds, frame.shape))
+        if region is None:
+            return []
+        return plan_tiles(region, tile_size=self.tile_size, overlap=self.tile_overlap,
+                          max_tiles=self.max_tiles, spot_index=self.spot_index)
+
+    def plan_inference(self, frames):
+        """
+        Decide which windows of which frames go through YOLO.
+
+        With the motion gate enabled, frames without motion inside any spot get
+        no job. With dirty-region tracking, only a crop covering the changed
+        spots is planned, and detections are restricted to those spots. With
+        ROI inference, windows are limited to the lot area and tiled when large.
+
+        Returns:
+            List of (frame position, (x1, y1, x2, y2) region, dirty spots or None for all)
+        """
+        jobs = []
+        for position, frame in enumerate(frames):
+            if self.motion_gate is not None and not self.motion_gate.should_infer(frame):
+                continue
+
+            crop, spots = None, None
+            if self.dirty_tracker is not None:
+                dirty = self.dirty_tracker.update(frame)
+                if not dirty.any():
                     continue
+                if not dirty.all():
+                    crop, spots = self.dirty_tracker.crop_for(dirty, frame.shape), dirty
+
+            for region in self.inference_regions(frame, crop):
+                jobs.append((position, region, spots))
+        return jobs
+
+    @staticmethod
+    def crop_jobs(frames, jobs):
+        """Return the image views to send to the model, one per planned job."""
+        return [frames[position][y1:y2, x1:x2] for position, (x1, y1, x2, y2), _ in jobs]
+
+    def assemble_outputs(self, model, frame_count, jobs, results):
+        """
+        Map model results back onto their frames.
+
+        Returns:
+            List with one FrameDetections per frame, or None for frames that
+            were not inferred (meaning "carry statuses forward")
+        """
+        per_frame = {}
+        for (position, region, spots), r in zip(jobs, results):
+            ox, oy = region[:2]
+            boxes = self.extract_boxes(model, [r])
+            boxes += (ox, oy, ox, oy)
+            _, parts, tiles = per_frame.setdefault(position, (spots, [], []))
+            parts.append(boxes)
+            tiles.append(region)
+
+        outputs = [None] * frame_count
+        for position, (spots, parts, tiles) in per_frame.items():
+            boxes = parts[0] if len(parts) == 1 else merge_tiled_boxes(parts, tiles)
+            outputs[position] = FrameDetections(boxes, spots)
+        return outputs
+
+    def infer_batch(self, model, frames):
+        """Run YOLO on several frames in one call; returns one FrameDetections (or None) per frame, in order."""
+        jobs = self.plan_inference(frames)
+        if not jobs:
+            return [None] * len(frames)
+
+        results = model.predict(self.crop_jobs(frames, jobs), conf=self.conf, imgsz=self.tile_size, verbose=False)
+        return self.assemble_outputs(model, len(frames), jobs, results)
+
+    def extract_boxes(self, model, results):
+        # collect vehicle boxes
+        boxes = []  # list of (x1,y1,x2,y2)
+        for r in results:
+            # r.boxes may be empty
+            boxes_data = getattr(r, "boxes", None)
+            if boxes_data is None:
+                continue
+
+            # boxes_data.xyxy, boxes_data.conf, boxes_data.cls
+            xyxy = boxes_data.xyxy.cpu().numpy() if hasattr(boxes_data.xyxy, "cpu") else np.array(boxes_data.xyxy)
+            confs = boxes_data.conf.cpu().numpy() if hasattr(boxes_data.conf, "cpu") else np.array(boxes_data.conf)
+            cls_ids = boxes_data.cls.cpu().numpy() if hasattr(boxes_data.cls, "cpu") else np.array(boxes_data.cls)
+
+            for (x1, y1, x2, y2), conf, cls_id in zip(xyxy, confs, cls_ids):
+                name = model.names.get(int(cls_id), str(int(cls_id)))
+                if name in YOLODetector.VEHICLE_NAMES and conf >= self.conf:
+                    boxes.append((int(x1), int(y1), int(x2), int(y2)))
+
+        return np.array(boxes, dtype=np.int64).reshape(-1, 4)
+
+    def evaluate(self, boxes, spots=None):
+        """
+        Determine the occupied/free status of spots from vehicle boxes.
+
+        Args:
+            boxes: (M, 4) int array of vehicle boxes in frame space
+            spots: Optional boolean mask of spots to re-evaluate; the others
+                keep their cached overlap and status
+        """
+        pairs = self.spot_index.candidate_pairs(boxes)
+        if spots is None:
+            self.overlaps = self.overlap_engine.max_overlaps(boxes, pairs)
+        else:
+            keep = spots[pairs[0]]
+            overlaps = self.overlap_engine.max_overlaps(boxes, (pairs[0][keep], pairs[1][keep]))
+            self.overlaps[spots] = overlaps[spots]
+
+        self.statuses = (self.overlaps >= YOLODetector.OVERLAP_THRESHOLD).tolist()
+        return self.statuses
+
+    def publish(self, statuses):
+        # Update MongoDB only when status changes (not every frame or time interval)
+        if self.use_db and self.db and self.lot_id:
+            changed = [index for index, status in enumerate(statuses)
+                       if status != self.previous_statuses[index]]
+            if not changed:
+                return
+
+            changes = {str(self.coordinates_data[index]["id"]): statuses[index] for index in changed}
+            try:
+                if self.publisher is not None:
+                    # Handed to the write-behind thread; the frame loop never waits on MongoDB
+                    for spot_id, occupied in changes.items():
+                        self.publisher.submit(self.lot_id, spot_id, occupied, video_file=self.video)
+                else:
+                    # One bulk write for every spot that changed in this frame
+                    self.db.update_spot_statuses(
+                        lot_id=self.lot_id,
+                        changes=changes,
+                        video_file=self.video
+                    )
+                for index in changed:
+                    self.previous_statuses[index] = statuses[index]
+            except Exception as e:
+                logging.error(f"Failed to update MongoDB: {e}")
+
+    def render(self, frame, statuses):
+        """Hand the frame to the annotated writer and/or display it. Returns False when the user quits."""
+        if self.headless:
+            # No copy: the writer draws on the frame itself, off the hot path
+            if self.writer is not None:
+                self.writer.submit(frame, statuses)
+            return True
+
+        new_frame = frame.copy()
+        for index, p in enumerate(self.coordinates_data):
+            coords = np.array(p["coordinates"])
+            border = COLOR_BLUE if statuses[index] else COLOR_GREEN
+            draw_contours(new_frame, coords, str(p["id"] + 1), COLOR_WHITE, border)
+
+        if self.writer is not None:
+            self.writer.submit(frame, statuses)
+
+        open_cv.imshow(str(self.video) + " - yolo", new_frame)
+        k = open_cv.waitKey(1)
+        return k != ord('q')
+
+    def output_dropped(self, frame_index, frame, detections):
+        # The dirty tracker already folded these spots into its reference: have them re-evaluated
+        if detections is not None and self.dirty_tracker is not None:
+            self.dirty_tracker.invalidate(detections.spots)
+
+    def postprocess(self, frame_index, frame, detections):
+        # None means inference was skipped for this frame: keep the last statuses
+        if detections is not None:
+            self.evaluate(detections.boxes, detections.spots)
+
+            # Only states that held for the minimum dwell (the first one included) are
+            # committed and published; only the spots this frame evaluated get a sample
+            if self.hysteresis is not None:
+                self.statuses = self.hysteresis.update(self.overlaps, detections.spots).tolist()
+
+        statuses = self.statuses
+        self.publish(statuses)
+        return self.render(frame, statuses)
+
+    def start_publisher(self):
+        """Start the write-behind publisher when DB updates are enabled."""
+        if self.write_behind and self.use_db and self.db and self.lot_id and self.publisher is None:
+            source = os.path.basename(str(self.video)) or "camera"
+            spill_name = re.sub(r"[^A-Za-z0-9_.-]", "_", f"{self.lot_id}-{source}") + ".jsonl"
+            self.publisher = WriteBehindPublisher(self.db, os.path.join(self.spill_dir, spill_name))
+
+    def stop_publisher(self):
+        if self.publisher is not None:
+            self.publisher.close()
+            self.publisher = None
 
-                # boxes_data.xyxy, boxes_data.conf, boxes_data.cls
-                xyxy = boxes_data.xyxy.cpu().numpy() if hasattr(boxes_data.xyxy, "cpu") else np.array(boxes_data.xyxy)
-                confs = boxes_data.conf.cpu().numpy() if hasattr(boxes_data.conf, "cpu") else np.array(boxes_data.conf)
-                cls_ids = boxes_data.cls.cpu().numpy() if hasattr(boxes_data.cls, "cpu") else np.array(boxes_data.cls)
-
-                for (x1, y1, x2, y2), conf, cls_id in zip(xyxy, confs, cls_ids):
-                    name = model.names.get(int(cls_id), str(int(cls_id)))
-                    if name in YOLODetector.VEHICLE_NAMES and conf >= self.conf:
-                        boxes.append((int(x1), int(y1), int(x2), int(y2)))
-
-            # determine status per spot
-            for index, p in enumerate(self.coordinates_data):
-                rect = self.bounds[index]
-                spot_mask = self.masks[index]
-                spot_area = float(spot_mask.sum()) if spot_mask.sum() > 0 else 1.0
-
-                occupied = False
-                for (bx1, by1, bx2, by2) in boxes:
-                    # compute bbox intersection within spot rect
-                    x1 = max(bx1, rect[0]); y1 = max(by1, rect[1])
-                    x2 = min(bx2, rect[0] + rect[2]); y2 = min(by2, rect[1] + rect[3])
-                    if x2 <= x1 or y2 <= y1:
-                        continue
-
-                    # create bbox boolean mask clipped to spot
-                    bx_rel1 = x1 - rect[0]; by_rel1 = y1 - rect[1]
-                    bx_rel2 = x2 - rect[0]; by_rel2 = y2 - rect[1]
-
-                    try:
-                        bbox_mask = np.zeros_like(spot_mask, dtype=bool)
-                        bbox_mask[by_rel1:by_rel2, bx_rel1:bx_rel2] = True
-                    except Exception:
-                        bbox_mask = np.zeros_like(spot_mask, dtype=bool)
-
-                    intersection = np.logical_and(spot_mask, bbox_mask).sum()
-                    overlap = intersection / spot_area
-                    if overlap >= YOLODetector.OVERLAP_THRESHOLD:
-                        occupied = True
+    def detect_yolo(self):
+        model = YOLO(self.model_path)
+        self.prepare_spots()
+        self.start_publisher()
+        capture = self.open_capture()
+        if self.output_video:
+            self.writer = AnnotatedWriter(
+                self.output_video, self.coordinates_data,
+                fps=capture.get(open_cv.CAP_PROP_FPS),
+                every_n=self.annotate_every)
+
+        try:
+            # Batching needs the capture thread so slow sources can time out a partial batch
+            if self.pipelined or self.batch_size > 1:
+                pipeline = FramePipeline(
+                    capture.read,
+                    lambda frames: self.infer_batch(model, frames),
+                    queue_size=self.queue_size,
+                    drop_policy=self.drop_policy,
+                    batch_size=self.batch_size,
+                    max_wait=self.batch_timeout,
+                    on_output_dropped=self.output_dropped)
+                pipeline.run(self.postprocess)
+                pipeline.report()
+            else:
+                frame_count = 0
+                while capture.isOpened():
+                    frame_count += 1
+                    result, frame = capture.read()
+                    if frame is None:
                         break
 
-                statuses[index] = occupied
-            
-            # Update MongoDB only when status changes (not every frame or time interval)
-            if self.use_db and self.db and self.lot_id:
-                try:
-                    for index, p in enumerate(self.coordinates_data):
-                        # Only update if status changed
-                        if statuses[index] != previous_statuses[index]:
-                            self.db.update_spot_status(
-                                lot_id=self.lot_id,
-                                spot_id=str(p["id"]),
-                                occupied=statuses[index],
-                                video_file=self.video
-                            )
-                            previous_statuses[index] = statuses[index]
-                except Exception as e:
-                    logging.error(f"Failed to update MongoDB: {e}")
-
-            new_frame = frame.copy()
-            for index, p in enumerate(self.coordinates_data):
-                coords = np.array(p["coordinates"])
-                border = COLOR_BLUE if statuses[index] else COLOR_GREEN
-                draw_contours(new_frame, coords, str(p["id"] + 1), COLOR_WHITE, border)
+                    if not result:
+                        raise Exception("Error reading video capture")
 
-            open_cv.imshow(str(self.video) + " - yolo", new_frame)
-            k = open_cv.waitKey(1)
-            if k == ord('q'):
-                break
-
-        capture.release()
-        open_cv.destroyAllWindows()
+                    detections = self.infer(model, frame)
+                    if not self.postprocess(frame_count, frame, detections):
+                        break
+        finally:
+            capture.release()
+            if self.writer is not None:
+                self.writer.close()
+                self.writer = None
+            self.stop_publisher()
+            if not self.headless:
+                open_cv.destroyAllWindows()
+            if self.motion_gate is not None:
+                logging.info(self.motion_gate.summary())
 
 
 class YOLODetectorError(Exception):